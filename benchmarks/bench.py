@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+bench.py
+
+Offline benchmark of the scraping, parsing and query stages. The pages of a
+synthetic pcgs.com (see pcgs_scraper/synthetic.py) are recorded to a page cache
+and replayed by an offline client, so the real get_urls, get_prices,
+scrape_nums and scrape_coinfacts run without touching the network. The largest
+price table is a ps=-1 page with thousands of rows, it is also timed on its
+own. The coins scraped are joined into a price guide to time
+parse_descriptions, fold_denoms and query_price_guide
+
+Each stage reports seconds (best of --repeat), rows per second and the peak
+memory it allocates, and the results are written to a json file. compare
+flags the stages that got slower or bigger between two result files and exits
+with status 1 if any did
+
+    $ python benchmarks/bench.py run -o before.json
+    $ python benchmarks/bench.py run -o after.json --parser bs4 lxml
+    $ python benchmarks/bench.py compare before.json after.json
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pcgs_scraper.cache import PageCache                    # noqa: E402
+from pcgs_scraper.client import PCGSClient, set_client      # noqa: E402
+from pcgs_scraper.config import data_path, ensure_parent    # noqa: E402
+from pcgs_scraper.parsers import BACKENDS, get_backend      # noqa: E402
+from pcgs_scraper.pcgs_nums import scrape_coinfacts, scrape_nums  # noqa: E402
+from pcgs_scraper.pcgs_prices import (get_prices, get_urls,  # noqa: E402
+                                      merge_entries)
+from pcgs_scraper.pcgs_query import (build_query_index,     # noqa: E402
+                                     query_price_guide, validate_query)
+from pcgs_scraper.scraper import join_number_price          # noqa: E402
+from pcgs_scraper.synthetic import SyntheticSite            # noqa: E402
+from pcgs_scraper.utils import fold_denoms, parse_descriptions  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_VERSION = 1
+# denominations of the synthetic site as people type them
+DENOM_WORDS = {
+    '1C': 'one cent',
+    '5C': 'five cents',
+    '10C': 'dime',
+    '25C': 'quarter dollar',
+    '50C': 'half dollar',
+    '$1': 'silver dollar',
+    '$10': 'ten dollars',
+    '$20': 'twenty dollars',
+}
+
+
+##########
+# STAGES #
+##########
+# each stage takes the state of the run and returns the number of rows it
+# handled, parser stages also get the backend
+
+def stage_get_urls(state, backend):
+    urls_by_category = {}
+    for url in state['urls']['index']:
+        urls_by_category = get_urls(url, backend=backend)
+    return sum(len(urls) for urls in urls_by_category.values())
+
+
+def stage_get_prices(state, backend):
+    rows = []
+    for url in state['urls']['prices']:
+        rows.extend(get_prices(url, delay_s=0, backend=backend))
+    state['price_rows'] = rows
+    return len(rows)
+
+
+def stage_get_prices_large(state, backend):
+    rows = 0
+    for url in state['large_urls']:
+        rows += len(get_prices(url, delay_s=0, backend=backend))
+    return rows
+
+
+def stage_scrape_nums(state, backend):
+    rows = []
+    for url in state['urls']['numbers']:
+        rows.extend(scrape_nums(url, delay_s=0, backend=backend,
+                                enrich=False))
+    state['number_rows'] = rows
+    return len(rows)
+
+
+def stage_scrape_coinfacts(state, backend):
+    for url in state['coinfacts_urls']:
+        scrape_coinfacts(url, backend=backend)
+    return len(state['coinfacts_urls'])
+
+
+def stage_parse_descriptions(state):
+    price_guide = [{'description': coin['description']}
+                   for coin in state['coins']]
+    parse_descriptions(price_guide)
+    return len(price_guide)
+
+
+def stage_fold_denoms(state):
+    fold_denoms.cache_clear()       # time the normalizer, not its cache
+    for query in state['queries']:
+        fold_denoms(query)
+    return len(state['queries'])
+
+
+def stage_query_price_guide(state):
+    coins = state['coins']
+    index = state['index']
+    for query_tuple in state['query_tuples']:
+        query_price_guide(query_tuple, coins, index, top_k=10)
+    return len(state['query_tuples'])
+
+
+PARSER_STAGES = {
+    'get_urls': stage_get_urls,
+    'get_prices': stage_get_prices,
+    'get_prices_large': stage_get_prices_large,
+    'scrape_nums': stage_scrape_nums,
+    'scrape_coinfacts': stage_scrape_coinfacts,
+}
+GUIDE_STAGES = {
+    'parse_descriptions': stage_parse_descriptions,
+    'fold_denoms': stage_fold_denoms,
+    'query_price_guide': stage_query_price_guide,
+}
+
+
+#############
+# BENCHMARK #
+#############
+
+def measure(stage, repeat, *args):
+    """
+    :param stage: stage function
+    :param repeat: (int) times to time it, the best time is kept
+    :param args: arguments of the stage
+    :return result: (dict) seconds, rows, rows_per_s and peak_mib of the stage,
+        the peak is measured on one more run under tracemalloc so it does not
+        slow down the timed runs
+    """
+    seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = stage(*args)
+        elapsed = time.perf_counter() - start
+        if seconds is None or elapsed < seconds:
+            seconds = elapsed
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    stage(*args)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return {
+        'seconds': round(seconds, 6),
+        'rows': rows,
+        'rows_per_s': round(rows / seconds, 1) if seconds > 0 else None,
+        'peak_mib': round(peak / 2 ** 20, 3),
+    }
+
+
+def make_queries(coins, n):
+    """
+    :param coins: (list(Coin)) price guide
+    :param n: (int) number of queries
+    :return queries: (list(str)) descriptions of coins of the price guide the
+        way people type them, e.g. '1881-CC silver dollar VAM 3'
+    """
+    queries = []
+    for i in range(n):
+        coin = coins[i * 7919 % len(coins)]
+        query = coin['description']
+        for denom, words in DENOM_WORDS.items():
+            query = query.replace(f' {denom}', f' {words}', 1)
+        queries.append(query)
+    return queries
+
+
+def build_guide(state):
+    """
+    Join the price rows and number rows scraped by the parser stages into a
+    price guide, and make the queries of the guide stages
+    """
+    grouped = {}
+    for row in state['price_rows']:
+        if row['pcgs_num'] is not None:
+            grouped.setdefault(row['pcgs_num'], []).append(row)
+    merged = {pcgs_num: merge_entries(pcgs_num, rows)
+              for pcgs_num, rows in grouped.items()}
+    with redirect_stdout(open(os.devnull, 'w')):
+        state['coins'] = list(join_number_price(
+            merged, list(state['number_rows']), slim=True))
+    state['index'] = build_query_index(state['coins'])
+    state['queries'] = make_queries(state['coins'], state['n_queries'])
+    state['query_tuples'] = [validate_query(query, verbose=False)
+                             for query in state['queries']]
+    state['query_tuples'] = [query_tuple for query_tuple in
+                             state['query_tuples'] if query_tuple is not None]
+
+
+def git_commit():
+    """
+    :return commit: (str) commit of the checkout being benchmarked, None if it
+        is not a git checkout
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(config, parsers, repeat=3, stages=None):
+    """
+    :param config: (dict) keyword arguments of SyntheticSite, plus n_queries
+        and n_coinfacts
+    :param parsers: (list(str)) parser backends to time the parser stages with
+    :param repeat: (int) see measure
+    :param stages: (list(str)) names of the stages to run, None for all, the
+        parser stages are still run to make the price guide
+    :return results: (dict) the results, see write_results
+    """
+    site_config = {key: value for key, value in config.items()
+                   if not key.startswith('n_')}
+    site = SyntheticSite(**site_config)
+    urls = site.urls()
+    largest = max(site.subcategories, key=lambda subcat: len(subcat[4]))
+    state = {
+        'urls': urls,
+        'large_urls': [url for url in urls['prices']
+                       if f'/{largest[2]}/{largest[3]}/' in url],
+        'coinfacts_urls': urls['coinfacts'][:config['n_coinfacts']],
+        'n_queries': config['n_queries'],
+    }
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        pages = site.record(PageCache(cache_dir))
+        print(f'Recorded {pages} pages of {len(site.coins)} coins, largest '
+              f'price table {len(largest[4])} rows')
+        client = PCGSClient(cache=PageCache(cache_dir), offline=True)
+        set_client(client)
+        try:
+            for parser in parsers:
+                backend = get_backend(parser)
+                for name, stage in PARSER_STAGES.items():
+                    # the price guide is made from the first parser's rows
+                    needed = name in ('get_prices', 'scrape_nums') and \
+                        'coins' not in state
+                    if stages is not None and name not in stages \
+                            and not needed:
+                        continue
+                    result = measure(stage, repeat, state, backend)
+                    results[f'{name}[{parser}]'] = result
+                    report(f'{name}[{parser}]', result)
+                if 'coins' not in state:
+                    build_guide(state)
+        finally:
+            set_client(None)
+            client.close()
+    for name, stage in GUIDE_STAGES.items():
+        if stages is None or name in stages:
+            results[name] = measure(stage, repeat, state)
+            report(name, results[name])
+
+    return {
+        'version': RESULTS_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': dict(config, repeat=repeat),
+        'stages': results,
+    }
+
+
+def report(name, result):
+    rows_per_s = result['rows_per_s'] or 0
+    print(f'{name:<28}{result["seconds"]:10.4f}s{result["rows"]:9,}'
+          f'{rows_per_s:14,.0f} rows/s{result["peak_mib"]:10.2f} MiB')
+
+
+def write_results(results, path):
+    """
+    :param results: (dict) output of run
+    :param path: (str) json file to write
+    """
+    ensure_parent(path)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Saved results to {path}')
+
+
+###########
+# COMPARE #
+###########
+
+def compare(old_path, new_path, threshold=0.1, min_mib=1.0):
+    """
+    Compare two result files stage by stage. A stage regressed if its rows per
+    second dropped by more than threshold, or its peak memory grew by more
+    than threshold and by more than min_mib
+
+    :param old_path: (str) results before the change
+    :param new_path: (str) results after the change
+    :param threshold: (float) relative change that counts as a regression
+    :param min_mib: (float) memory changes smaller than this are noise
+    :return regressions: (list(str)) names of the stages that regressed
+    """
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    if old['config'] != new['config']:
+        print(f'WARNING: the runs used different configs, '
+              f'{old["config"]} vs {new["config"]}')
+
+    print(f'{old_path} ({old.get("commit")}) -> {new_path} '
+          f'({new.get("commit")})')
+    print(f'{"stage":<28}{"rows/s":>14}{"new":>14}{"change":>9}'
+          f'{"MiB":>9}{"new":>9}{"change":>9}')
+    regressions = []
+    for name, before in old['stages'].items():
+        after = new['stages'].get(name)
+        if after is None:
+            print(f'{name:<28}missing from {new_path}')
+            continue
+        speed = change(before['rows_per_s'], after['rows_per_s'])
+        memory = change(before['peak_mib'], after['peak_mib'])
+        slower = speed is not None and speed < -threshold
+        bigger = memory is not None and memory > threshold and \
+            after['peak_mib'] - before['peak_mib'] > min_mib
+        flag = ''
+        if slower or bigger:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:<28}{before["rows_per_s"] or 0:14,.0f}'
+              f'{after["rows_per_s"] or 0:14,.0f}{percent(speed):>9}'
+              f'{before["peak_mib"]:9.2f}{after["peak_mib"]:9.2f}'
+              f'{percent(memory):>9}{flag}')
+    for name in new['stages']:
+        if name not in old['stages']:
+            print(f'{name:<28}new in {new_path}')
+
+    if len(regressions) > 0:
+        print(f'{len(regressions)} stage(s) regressed by more than '
+              f'{threshold:.0%}: {", ".join(regressions)}')
+    else:
+        print(f'No stage regressed by more than {threshold:.0%}')
+    return regressions
+
+
+def change(before, after):
+    if not before or after is None:
+        return None
+    return after / before - 1
+
+
+def percent(value):
+    return '' if value is None else f'{value:+.1%}'
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmark')
+    run_parser.add_argument('--output', '-o', action='store', default=None,
+                            help='json file for the results, defaults to '
+                                 'bench_<time>.json in the data directory')
+    run_parser.add_argument('--parser', action='store', nargs='+',
+                            choices=BACKENDS, default=None,
+                            help='parser backends to time, defaults to the '
+                                 'shared backend')
+    run_parser.add_argument('--stages', action='store', nargs='+',
+                            choices=list(PARSER_STAGES) + list(GUIDE_STAGES),
+                            default=None, help='stages to run, default all')
+    run_parser.add_argument('--repeat', action='store', type=int, default=3,
+                            help='runs per stage, the best time is kept')
+    run_parser.add_argument('--coins', '-n', action='store', type=int,
+                            default=5000, help='size of the synthetic catalog')
+    run_parser.add_argument('--largest_table', action='store', type=int,
+                            default=3000, help='rows of the largest price '
+                                               'table')
+    run_parser.add_argument('--queries', action='store', type=int,
+                            default=5000, help='queries to time')
+    run_parser.add_argument('--coinfacts', action='store', type=int,
+                            default=200, help='coinfacts pages to time')
+    run_parser.add_argument('--seed', action='store', type=int, default=0,
+                            help='seed of the synthetic catalog')
+
+    compare_parser = subparsers.add_parser(
+        'compare', help='flag regressions between two result files')
+    compare_parser.add_argument('old', help='results before the change')
+    compare_parser.add_argument('new', help='results after the change')
+    compare_parser.add_argument('--threshold', action='store', type=float,
+                                default=0.1, help='relative slowdown or memory'
+                                                  ' growth that counts as a '
+                                                  'regression')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        parsers = args.parser or [get_backend().name]
+        results = run({
+            'coins': args.coins,
+            'largest_table': args.largest_table,
+            'seed': args.seed,
+            'n_queries': args.queries,
+            'n_coinfacts': args.coinfacts,
+        }, parsers, args.repeat, args.stages)
+        output = args.output or data_path(
+            f'bench_{datetime.now().strftime("%Y%m%d-%H%M%S")}.json')
+        write_results(results, output)
+    else:
+        regressed = compare(args.old, args.new, args.threshold)
+        sys.exit(1 if len(regressed) > 0 else 0)
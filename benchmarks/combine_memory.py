@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+combine_memory.py
+
+Peak memory of joining the number data and the price information
+(scraper.combine_number_price) on a synthetic catalog the size of the full
+price guide, with and without 'merged_from', and streamed to SQLite
+
+    $ python benchmarks/combine_memory.py
+    $ python benchmarks/combine_memory.py -n 20000
+
+Each mode runs in a fresh interpreter against the same generated inputs, with
+tracemalloc started before the inputs are loaded
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pcgs_scraper.pcgs_prices import GRADES, GUIDE_CHUNK       # noqa: E402
+from pcgs_scraper.journal import dump_list, dump_dict          # noqa: E402
+
+BINS = [('grades-1-20', 10), ('grades-25-60', 10), ('grades-61-70', 10)]
+SERIES = [('Lincoln Cent', '1C'), ('Buffalo Nickel', '5C'),
+          ('Mercury Dime', '10C'), ('Washington Quarter', '25C'),
+          ('Walking Liberty Half Dollar', '50C'), ('Morgan Dollar', '$1'),
+          ('Liberty Head Eagle', '$10'), ('Saint Gaudens Double Eagle', '$20')]
+MINTS = ['', '-D', '-S', '-O', '-CC']
+MODES = {
+    'full': "scraper.combine_number_price()",
+    'slim': "scraper.combine_number_price(slim=True)",
+    'provenance': "scraper.combine_number_price(slim=True, "
+                  "provenance_path=scraper.PROVENANCE_FILE)",
+    'stream_db': "scraper.stream_number_price()",
+}
+
+
+def price_pair(rng):
+    # a price cell, see parsers.price_cell
+    price = rng.randrange(1, 100000)
+    if rng.random() < 0.3:
+        return None, None
+    return f'{price:,}', f'{price * 11 // 10:,}' if rng.random() < 0.5 else None
+
+
+def make_inputs(data_dir, coins=50000, seed=0):
+    """
+    Write a synthetic scraped_pcgs_prices.pkl and number_data.pkl shaped like
+    the output of merge_grade_bins and pcgs_nums, in chunks like they write them
+
+    :param data_dir: (str) data directory to write to
+    :param coins: (int) number of PCGS numbers
+    :param seed: (int) random seed
+    """
+    rng = random.Random(seed)
+    price_guide = {None: {'pcgs_num': None}}
+    pcgs_numbers = []
+    for i in range(coins):
+        pcgs_num = str(1000 + i)
+        series, denom = SERIES[i % len(SERIES)]
+        description = f"{1800 + i % 220}{rng.choice(MINTS)} {denom} " \
+                      f"{series}{', Variety ' + str(i % 7) if i % 3 else ''}"
+        desig = rng.choice([['MS'], ['MS', 'RD'], ['PR', 'CAM'], ['MS', 'FB']])
+        entries = []
+        for grades, count in BINS:
+            entries.append({
+                'pcgs_num': pcgs_num,
+                'description': description,
+                'desig': list(desig),
+                'grades': grades,
+                'prices': [price_pair(rng) for _ in range(count)],
+                'url': f'https://www.pcgs.com/prices/detail/{series.lower()}/'
+                       f'{i % 900}/most-active?{grades}'
+            })
+        prices = [price for entry in entries for price in entry['prices']]
+        price_guide[pcgs_num] = {
+            'pcgs_num': pcgs_num,
+            'desig': desig,
+            'prices': dict(zip(GRADES, prices)),
+            'merged_from': entries,
+        }
+        pcgs_numbers.append({
+            'pcgs_num': pcgs_num,
+            'desig': desig,
+            'description': description,
+            'coinfacts_url': f'https://www.pcgs.com/coinfacts/coin/{i}',
+            'image': f'https://images.pcgs.com/CoinFacts/{i}_obv.jpg',
+            'images': [f'https://images.pcgs.com/CoinFacts/{i}_{side}.jpg'
+                       for side in ('obv', 'rev')],
+            'narrative': f'Narrative of PCGS #{pcgs_num}. ' * 8,
+        })
+    entries = list(price_guide.items())
+    dump_dict((entries[i:i + GUIDE_CHUNK] for i in
+               range(0, len(entries), GUIDE_CHUNK)),
+              os.path.join(data_dir, 'scraped_pcgs_prices.pkl'))
+    dump_list((pcgs_numbers[i:i + GUIDE_CHUNK] for i in
+               range(0, len(pcgs_numbers), GUIDE_CHUNK)),
+              os.path.join(data_dir, 'number_data.pkl'))
+
+
+def run_mode(mode, data_dir):
+    """
+    :param mode: (str) key of MODES
+    :param data_dir: (str) data directory holding the inputs
+    :return peak_mib, retained_mib, saved_mib: (float) peak memory traced
+        while combining, memory still held by the price guide once combined and
+        size of the price guide pickle, in MiB
+    """
+    code = "import json, pickle, tracemalloc\n" \
+           "tracemalloc.start()\n" \
+           "from pcgs_scraper import scraper\n" \
+           f"output = {MODES[mode]}\n" \
+           "retained, peak = tracemalloc.get_traced_memory()\n" \
+           "tracemalloc.stop()\n" \
+           "saved = len(pickle.dumps(output)) if isinstance(output, list) " \
+           "else 0\n" \
+           "print(json.dumps([peak, retained, saved]))\n"
+    env = dict(os.environ)
+    env['PCGS_SCRAPER_DATA'] = data_dir
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    result = subprocess.run([sys.executable, '-c', code], env=env,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(f'{mode} failed:\n{result.stderr}')
+    return [size / 2 ** 20 for size in
+            json.loads(result.stdout.splitlines()[-1])]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--coins', '-n', action='store', type=int,
+                        default=50000, help='size of the synthetic catalog')
+    parser.add_argument('--modes', '-m', action='store', nargs='+',
+                        default=list(MODES), choices=list(MODES))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        make_inputs(tmp_dir, args.coins)
+        print(f'{args.coins} coins')
+        print(f'{"mode":<12} {"peak MiB":>10} {"retained MiB":>14} '
+              f'{"pickle MiB":>12}')
+        for bench_mode in args.modes:
+            peak_mib, retained_mib, saved_mib = run_mode(bench_mode, tmp_dir)
+            print(f'{bench_mode:<12} {peak_mib:10.1f} {retained_mib:14.1f} '
+                  f'{saved_mib:12.1f}')
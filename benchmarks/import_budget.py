@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+import_budget.py
+
+Start-up benchmark: imports each entry point in a fresh interpreter with
+`python -X importtime` and fails if it takes longer than its budget or pulls in
+a module it should not need (e.g. bs4 for a query)
+
+    $ python benchmarks/import_budget.py
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+# module -> (budget in ms, modules it must not import)
+BUDGETS = {
+    'pcgs_scraper': (15, ['bs4', 'requests', 'tqdm', 'nltk', 'numpy']),
+    'pcgs_scraper.pcgs_query': (60, ['bs4', 'requests', 'tqdm', 'nltk',
+                                     'numpy', 'lxml']),
+    'pcgs_scraper.pcgs_batch': (120, ['bs4', 'requests', 'tqdm', 'nltk',
+                                      'numpy', 'lxml']),
+    'pcgs_scraper.pcgs_daemon': (120, ['bs4', 'requests', 'tqdm',
+                                       'nltk', 'numpy', 'lxml']),
+    'pcgs_scraper.pcgs_prices': (400, ['bs4', 'tqdm', 'nltk', 'numpy']),
+    'pcgs_scraper.pcgs_nums': (400, ['bs4', 'tqdm', 'nltk', 'numpy']),
+}
+
+
+def import_time(module, repo_root):
+    """
+    :param module: (str) module to import
+    :param repo_root: (str) directory containing the pcgs_scraper package
+    :return cumulative_ms, imported: (float) import time of module including
+        its imports, (set) names of every module imported
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = repo_root + os.pathsep + env.get('PYTHONPATH', '')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             f'import {module}'],
+                            env=env, capture_output=True, text=True,
+                            check=True)
+    cumulative_ms = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        imported.add(name)
+        if name == module:
+            cumulative_ms = int(cumulative) / 1000
+    return cumulative_ms, imported
+
+
+def check_budgets(repo_root, runs=5):
+    """
+    :param repo_root: (str) directory containing the pcgs_scraper package
+    :param runs: (int) imports per module, the fastest one is compared to the
+        budget since the others include noise from the rest of the machine
+    :return failures: (list(str)) budgets exceeded
+    """
+    failures = []
+    for module, (budget_ms, forbidden) in BUDGETS.items():
+        best_ms = None
+        imported = set()
+        for _ in range(runs):
+            cumulative_ms, imported = import_time(module, repo_root)
+            if best_ms is None or cumulative_ms < best_ms:
+                best_ms = cumulative_ms
+        unwanted = sorted(name for name in forbidden if name in imported)
+        status = 'ok'
+        if best_ms > budget_ms:
+            status = 'SLOW'
+            failures.append(f'{module} took {best_ms:.1f}ms, budget is '
+                            f'{budget_ms}ms')
+        if len(unwanted) > 0:
+            status = 'HEAVY'
+            failures.append(f'{module} imports {", ".join(unwanted)}')
+        print(f'{module:<28} {best_ms:8.1f}ms  budget {budget_ms:4d}ms  '
+              f'{status}')
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', '-n', action='store', type=int, default=5,
+                        help='imports per module, the fastest counts')
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    budget_failures = check_budgets(root, args.runs)
+    if len(budget_failures) > 0:
+        sys.exit('\n'.join(budget_failures))
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+normalize_bench.py
+
+Benchmark of the query normalizer, utils.fold_denoms, against the chain of
+re.sub calls it replaced (copied below as chain_fold_denoms)
+
+    $ python benchmarks/normalize_bench.py
+    $ python benchmarks/normalize_bench.py -p data/pcgs_price_guide.pkl
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import os
+import re
+import sys
+import time
+import pickle
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pcgs_scraper.utils import fold_denoms      # noqa: E402
+
+SAMPLE_QUERIES = [
+    '1909-S VDB Lincoln Cent',
+    '1921 Morgan Silver Dollar',
+    '1916-D Mercury Dime',
+    '1932-D Washington Quarter',
+    '1881-CC morgan dollar',
+    '1937-D 3 Legged Buffalo nickel',
+    '1794 Flowing Hair half dime',
+    '1872 three cent silver',
+    '1865 3 cent nickel',
+    '1907 twenty dollars saint gaudens',
+    '1911 indian head 2 and a half dollars',
+    '1795 half cent',
+    '1853 half dollar arrows',
+    '1999-P 25c Delaware',
+    '1804 $1 Class I',
+]
+
+
+####################
+# PREVIOUS VERSION #
+####################
+
+def chain_word_to_digit(input_string):
+    # as of v0.0.4, including its bug: only the last substitution is kept
+    replacement_pairs = [
+        ('one', '1'), ('two', '2'), ('three', '3'), ('four', '4'),
+        (r'(?<!twenty )five', '5'), ('six', '6'), ('seven', '7'),
+        ('eight', '8'), ('nine', '9'), ('ten', '10'), ('twenty', '20'),
+        ('twenty five', '25'), ('fifty', '50')
+    ]
+    for pattern, replacement in replacement_pairs:
+        output_string = re.sub(pattern, replacement, input_string)
+    return output_string
+
+
+def chain_fold_denoms(query_str):
+    # fold_denoms as of v0.0.4, one re.sub per denomination
+    denominations_mapping = [
+        (r'1/2C', r'(1 )?half( of (a|one) ?)? cents?'),
+        (r'1C', r'(1 cent|penny)'),
+        (r'2C', r'2 cents? (silver)?'),
+        (r'3CS', r'3( ?C| cents?) silver'),
+        (r'3CN', r'3 cents? nickel'),
+        (r'5C', r'((?<!cent )nickel|5 cents?)'),
+        (r'H10C', r'half dime'),
+        (r'10C', '(dime|10 cents?)'),
+        (r'20C', r'20 cents?'),
+        (r'25C', r'(quarter|25 cents?)'),
+        (r'50C', r'(?<!and a )(half dollar|50 cents?)'),
+        (r'$1', r'(?<![02-9] )(?<!half )(1 )?dollar'),
+        (r'$2.50', r'(2 (and a half dollars?|dollars and 50 cents)|\$?2\.50)'),
+        (r'$3', r'3 dollars?'),
+        (r'$4', r'4 dollars?'),
+        (r'$5', r'5 dollars?'),
+        (r'$10', r'10 dollars?'),
+        (r'$20', r'20 dollars?'),
+        (r'$25', r'25 dollars?'),
+        (r'$50', r'50 dollars?'),
+        (r'1C', r'(?<![0-9] )(?<!half )cent')
+    ]
+    query_str = chain_word_to_digit(query_str)
+    for repl, pattern in denominations_mapping:
+        query_str = re.sub(pattern, repl, query_str, flags=re.IGNORECASE)
+    return query_str
+
+
+#############
+# BENCHMARK #
+#############
+
+def queries_per_s(function, queries, repeat=5):
+    """
+    :param function: normalizer to time
+    :param queries: (list(str)) queries to normalize
+    :param repeat: (int) passes over queries, the fastest counts
+    :return rate: (float) queries normalized per second
+    """
+    best_s = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for query in queries:
+            function(query)
+        elapsed_s = time.perf_counter() - start
+        if best_s is None or elapsed_s < best_s:
+            best_s = elapsed_s
+    return len(queries) / best_s
+
+
+def uncached_fold_denoms(query_str):
+    # fold_denoms without its lru_cache, the cost of a query never seen before
+    return fold_denoms.__wrapped__(query_str)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--price_guide', '-p', action='store',
+                        help='use the descriptions of this price guide as '
+                             'queries instead of the built in samples')
+    parser.add_argument('--repeat', '-n', action='store', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.price_guide is not None:
+        bench_queries = [coin['description'] for coin in
+                         pickle.load(open(args.price_guide, 'rb'))]
+    else:
+        bench_queries = SAMPLE_QUERIES * 200
+
+    chain_rate = queries_per_s(chain_fold_denoms, bench_queries, args.repeat)
+    single_rate = queries_per_s(uncached_fold_denoms, bench_queries,
+                                args.repeat)
+    fold_denoms.cache_clear()
+    cached_rate = queries_per_s(fold_denoms, bench_queries, args.repeat)
+    print(f'{len(bench_queries)} queries')
+    print(f're.sub chain (v0.0.4)   {chain_rate:12,.0f} queries/s')
+    print(f'single pass             {single_rate:12,.0f} queries/s  '
+          f'({single_rate / chain_rate:.1f}x)')
+    print(f'single pass, cached     {cached_rate:12,.0f} queries/s  '
+          f'({cached_rate / chain_rate:.1f}x)')
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+parser_check.py
+
+Runs both parser backends (pcgs_scraper.parsers) over every page of a synthetic
+catalog (pcgs_scraper.synthetic) and checks they return the same data: the
+index pages, the price pages (largest table included), the PCGS number pages
+and the coinfacts pages. Pages of one kind are also fed to the parsers of the
+others, which must agree that there is nothing to find
+
+    $ python benchmarks/parser_check.py
+    $ python benchmarks/parser_check.py --coins 2000 --largest_table 1000
+
+Exits 1 if the backends differ anywhere. bs4 is slow on large tables, the
+defaults keep a run to about ten seconds
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import os
+import sys
+import time
+import argparse
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pcgs_scraper.parsers import Bs4Backend, LxmlBackend     # noqa: E402
+from pcgs_scraper.synthetic import SyntheticSite, BASE_URL   # noqa: E402
+
+
+def parse(backend, kind, url, html):
+    """
+    :param backend: parser backend
+    :param kind: (str) kind of parser to run, see SyntheticSite.urls
+    :param url: (str) url of the page
+    :param html: (str) html of the page
+    :return parsed: what the backend makes of the page
+    """
+    if kind == 'index':
+        return backend.category_urls(html, BASE_URL)
+    if kind == 'prices':
+        grades = urlsplit(url).path.rstrip('/').split('/')[-1]
+        return backend.price_rows(html, grades, url)
+    if kind == 'numbers':
+        return backend.number_rows(html)
+    return backend.coinfacts(html)
+
+
+def check(site, backends):
+    """
+    :param site: (SyntheticSite) site to parse
+    :param backends: (list) parser backends, the first one is the reference
+    :return failures: (list(str)) pages the backends differ on
+        times: (dict) backend name -> seconds spent parsing
+    """
+    pages = {kind: [(url, site.page(url)) for url in urls]
+             for kind, urls in site.urls().items()}
+    # one page of each kind, to run through the parsers of the other kinds
+    samples = [pages_of_kind[0] for pages_of_kind in pages.values()]
+
+    failures = []
+    times = defaultdict(float)
+    for kind in pages:
+        checked = 0
+        for url, html in pages[kind] + samples:
+            results = []
+            for backend in backends:
+                start = time.perf_counter()
+                results.append(parse(backend, kind, url, html))
+                times[backend.name] += time.perf_counter() - start
+            for backend, result in zip(backends[1:], results[1:]):
+                if result != results[0]:
+                    failures.append(f'{kind} parser, {backend.name} differs '
+                                    f'from {backends[0].name} on {url}')
+            checked += 1
+        print(f'{kind}: {checked} pages')
+    return failures, dict(times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--coins', '-n', action='store', type=int,
+                        default=200, help='size of the synthetic catalog')
+    parser.add_argument('--largest_table', action='store', type=int,
+                        default=300, help='rows of the largest price table')
+    args = parser.parse_args()
+
+    site = SyntheticSite(coins=args.coins, largest_table=args.largest_table)
+    problems, seconds = check(site, [Bs4Backend(), LxmlBackend()])
+    for name, spent in seconds.items():
+        print(f'{name}: {spent:.2f}s')
+    for problem in problems:
+        print(f'FAILED: {problem}')
+    if not problems:
+        print('bs4 and lxml return the same data for every page')
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+record_memory.py
+
+Memory per coin of the price rows, merged entries and price guide as dicts
+(v0.0.4) and as the compact records of pcgs_scraper.records, on a synthetic
+catalog (see combine_memory.py). Each is measured the way a query worker pays
+for it: the memory tracemalloc sees once it is unpickled and, for records,
+made compact again (records are pickled as plain dicts). The memory costs load
+time: next to the seconds pickle.load takes is the time it takes to make the
+records compact again on top of it, what pcgs_query.load_price_guide pays for
+the price guide (see records.compact_coins)
+
+    $ python benchmarks/record_memory.py
+    $ python benchmarks/record_memory.py -n 50000
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import os
+import sys
+import time
+import pickle
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from combine_memory import ROOT, make_inputs     # noqa: E402,F401
+from pcgs_scraper.records import PriceRow, MergedEntry, \
+    compact_coins, gc_paused      # noqa: E402
+from pcgs_scraper.utils import parse_description_set     # noqa: E402
+from pcgs_scraper.pcgs_prices import merge_entries   # noqa: E402
+from pcgs_scraper.scraper import join_number_price   # noqa: E402
+
+
+####################
+# PREVIOUS VERSION #
+####################
+
+def dict_coins(price_guide, pcgs_numbers):
+    # the coins of combine_number_price as of v0.0.4, without merged_from
+    lookup = {entry['pcgs_num']: entry for entry in pcgs_numbers}
+    parsed = parse_description_set(entry['description']
+                                   for entry in pcgs_numbers)
+    coins = []
+    for number, price_entry in price_guide.items():
+        detail = lookup.get(number)
+        if detail is None:
+            continue
+        year_short, year_full, mint, denom, detail_text = \
+            parsed[detail['description']]
+        coins.append({
+            'pcgs_num': price_entry['pcgs_num'],
+            'description': detail['description'],
+            'desig': price_entry['desig'],
+            'prices': price_entry['prices'],
+            'image': detail['image'],
+            'images': detail['images'],
+            'narrative': detail['narrative'],
+            'coinfacts_url': detail['coinfacts_url'],
+            'year_short': year_short,
+            'year_full': year_full,
+            'mint': mint,
+            'denom': denom,
+            'detail': detail_text,
+        })
+    return coins
+
+
+#############
+# BENCHMARK #
+#############
+
+def loaded_size(obj, load=pickle.loads):
+    """
+    :param obj: object to measure
+    :param load: function turning the pickle of obj back into the form
+        measured
+    :return size, load_s: (int) bytes held once obj is loaded, (float)
+        seconds it takes to load, best of 3 timed without tracemalloc
+    """
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    load_s = float('inf')
+    for _ in range(3):
+        start = time.perf_counter()
+        loaded = load(data)
+        load_s = min(load_s, time.perf_counter() - start)
+        del loaded
+    tracemalloc.start()
+    loaded = load(data)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del loaded
+    return size, load_s
+
+
+def record_forms(price_guide, pcgs_numbers):
+    """
+    :param price_guide: (dict) dict price guide from make_inputs
+    :param pcgs_numbers: (list(dict)) number data from make_inputs
+    :return rows, merged, coins: the same data as records
+    """
+    merged = {}
+    rows = []
+    for pcgs_num, entry in price_guide.items():
+        if pcgs_num is None:
+            continue
+        entry_rows = [PriceRow(row) for row in entry['merged_from']]
+        rows.extend(entry_rows)
+        merged[pcgs_num] = merge_entries(pcgs_num, entry_rows)
+    coins = list(join_number_price(dict(merged), list(pcgs_numbers),
+                                   slim=True))
+    return rows, merged, coins
+
+
+def compact_entries(entries):
+    with gc_paused():
+        return {pcgs_num: MergedEntry(entry)
+                for pcgs_num, entry in entries.items()}
+
+
+def compact_rows(rows):
+    with gc_paused():
+        return [PriceRow(row) for row in rows]
+
+
+# how each of record_forms is loaded back into records, like compact_coins
+RECORD_LOADS = [
+    lambda data: compact_rows(pickle.loads(data)),
+    lambda data: compact_entries(pickle.loads(data)),
+    lambda data: compact_coins(pickle.loads(data)),
+]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--coins', '-n', action='store', type=int,
+                        default=20000, help='size of the synthetic catalog')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        make_inputs(tmp_dir, args.coins)
+        with open(os.path.join(tmp_dir, 'scraped_pcgs_prices.pkl'), 'rb') as f:
+            dict_guide = pickle.load(f)
+        with open(os.path.join(tmp_dir, 'number_data.pkl'), 'rb') as f:
+            number_data = pickle.load(f)
+    dict_guide.pop(None)
+
+    before = {
+        'price rows': [row for entry in dict_guide.values()
+                       for row in entry['merged_from']],
+        'merged entries': dict_guide,
+        'price guide': dict_coins(dict_guide, number_data),
+    }
+    after = dict(zip(before, record_forms(dict_guide, number_data)))
+
+    print(f'{args.coins} coins, bytes per coin once unpickled and seconds '
+          f'to load')
+    print(f'{"":<16}{"dicts":>10}{"records":>10}{"":>8}'
+          f'{"load s dicts":>14}{"records":>10}{"":>8}')
+    for name, load in zip(before, RECORD_LOADS):
+        before_size, before_s = loaded_size(before[name])
+        after_size, after_s = loaded_size(after[name], load)
+        print(f'{name:<16}{before_size / args.coins:10,.0f}'
+              f'{after_size / args.coins:10,.0f}'
+              f'{after_size / before_size:7.2f}x'
+              f'{before_s:14.2f}{after_s:10.2f}'
+              f'{after_s / before_s:7.2f}x')
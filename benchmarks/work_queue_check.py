@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+work_queue_check.py
+
+Round trip of the work queue (pcgs_scraper.work_queue) against a local
+stand-in pcgs.com (pcgs_scraper.standin) that answers some requests 503:
+init, several worker processes (one of them killed mid scrape, plus leases of
+a worker that never comes back), finalize with combine_number_price, and a
+check that the unprocessed prices, the number data and the combined price
+guide saved by finalize are the same as those of a one process scrape
+
+    $ python benchmarks/work_queue_check.py
+    $ python benchmarks/work_queue_check.py --coins 2000 --workers 4
+
+Exits 1 if anything differs
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import os
+import sys
+import json
+import time
+import pickle
+import signal
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pcgs_scraper.records import to_json     # noqa: E402
+from pcgs_scraper.standin import start      # noqa: E402
+from pcgs_scraper.synthetic import SyntheticSite     # noqa: E402
+
+# one process scrape of the same site, for reference
+REFERENCE = """
+import pickle
+from pcgs_scraper.ratelimit import HostRateLimiter, set_limiter
+set_limiter(HostRateLimiter(100))
+from pcgs_scraper import pcgs_prices, pcgs_nums
+from pcgs_scraper.scraper import combine_number_price
+from pcgs_scraper.config import data_path
+save_file = pcgs_prices.scrape_all()
+pcgs_prices.merge_grade_bins(save_file)
+pcgs_nums.main()
+pickle.dump(combine_number_price(), open(data_path('guide.pkl'), 'wb'))
+print('SAVED', save_file)
+"""
+
+
+def env_for(root, name, base_url):
+    """
+    :return env: (dict) environment of a process with its own data directory,
+        as if on its own machine, scraping base_url
+    """
+    env = dict(os.environ, PCGS_BASE_URL=base_url,
+               PCGS_SCRAPER_DATA=os.path.join(root, name))
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+
+def as_json(obj):
+    return json.dumps(obj, default=to_json, sort_keys=True)
+
+
+def check(root, base_url, workers):
+    """
+    :param root: (str) scratch directory
+    :param base_url: (str) url of the stand-in server
+    :param workers: (int) worker processes
+    :return failures: (list(str)) what differs from the one process scrape
+    """
+    os.environ['PCGS_BASE_URL'] = base_url
+    os.environ['PCGS_SCRAPER_DATA'] = os.path.join(root, 'final')
+    from pcgs_scraper import work_queue
+    from pcgs_scraper.ratelimit import HostRateLimiter, set_limiter
+    from pcgs_scraper.scraper import PRICE_GUIDE_FILE
+    set_limiter(HostRateLimiter(100))
+
+    queue_dir = os.path.join(root, 'queue')
+    print(f'Queued {work_queue.init_queue(queue_dir)}')
+    # a worker that claims tasks and is never heard from again
+    conn = work_queue.connect(queue_dir)
+    for _ in range(4):
+        work_queue.claim(conn, 'lost', lease_s=2)
+    conn.close()
+
+    script = os.path.join(ROOT, 'pcgs_scraper', 'work_queue.py')
+    processes = []
+    for i in range(workers):
+        log = open(os.path.join(root, f'worker{i}.log'), 'w')
+        processes.append(subprocess.Popen(
+            [sys.executable, script, 'work', queue_dir, '--worker',
+             f'worker{i}', '--lease', '3', '--rate', '40'],
+            env=env_for(root, f'worker{i}', base_url), stdout=log,
+            stderr=subprocess.STDOUT))
+    time.sleep(3)
+    processes[-1].send_signal(signal.SIGKILL)
+    print(f'Killed worker{workers - 1}')
+    for process in processes[:-1]:
+        process.wait()
+    status = work_queue.queue_status(queue_dir)
+    print(f'Queue after the workers: {status}')
+
+    saved = work_queue.finalize(queue_dir)
+    reference = subprocess.run([sys.executable, '-c', REFERENCE],
+                               env=env_for(root, 'reference', base_url),
+                               capture_output=True, text=True, check=True)
+    reference_prices = [line.split()[1] for line in
+                        reference.stdout.splitlines()
+                        if line.startswith('SAVED')][0]
+    reference_dir = os.path.join(root, 'reference')
+
+    failures = []
+    pairs = [
+        ('prices', saved.get('prices'), reference_prices),
+        ('numbers', saved.get('numbers'),
+         os.path.join(reference_dir, 'number_data.pkl')),
+        ('guide', saved.get('guide'), os.path.join(reference_dir,
+                                                   'guide.pkl')),
+    ]
+    for name, path, reference_path in pairs:
+        if path is None or not os.path.isfile(path):
+            failures.append(f'finalize did not save {name}')
+            continue
+        got = pickle.load(open(path, 'rb'))
+        expected = pickle.load(open(reference_path, 'rb'))
+        if as_json(got) != as_json(expected):
+            failures.append(f'{name} differ from a one process scrape')
+        else:
+            print(f'{name}: {len(got)} entries, same as a one process scrape')
+    if saved.get('guide') != PRICE_GUIDE_FILE:
+        failures.append(f'guide saved to {saved.get("guide")}')
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--coins', '-n', action='store', type=int,
+                        default=600, help='size of the synthetic catalog')
+    parser.add_argument('--workers', '-w', action='store', type=int,
+                        default=3,
+                        help='worker processes, the last one is killed')
+    parser.add_argument('--error_rate', action='store', type=float,
+                        default=0.05,
+                        help='fraction of requests answered 503')
+    args = parser.parse_args()
+
+    server = start(SyntheticSite(coins=args.coins, largest_table=100,
+                                 subcat_size=20),
+                   error_rate=args.error_rate, latency_s=0.01)
+    with tempfile.TemporaryDirectory() as scratch:
+        problems = check(scratch, server.url, args.workers)
+    server.shutdown()
+    for problem in problems:
+        print(f'FAILED: {problem}')
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+cache.py
+
+On-disk HTTP cache for request_page. Page bodies are stored by the hash of
+their content, so identical pages are only stored once, and each url points to
+the body it last returned along with its ETag/Last-Modified validators
+
+    data/http_cache/
+        bodies/ab/ab12...   page bodies, named by sha256 of the body
+        urls/cd/cd34....json  validators + headers for a url, named by sha256
+                            of the url
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import os
+import json
+import hashlib
+import tempfile
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from pcgs_scraper.config import data_path
+
+DEFAULT_CACHE_DIR = data_path('http_cache')
+
+# headers worth keeping, the rest describe the transfer and not the page
+KEPT_HEADERS = ['content-type', 'etag', 'last-modified', 'date']
+
+
+def sha256(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def atomic_write(path, data):
+    """
+    Write bytes to path so that a crash never leaves a half written file
+
+    :param path: (str) destination path
+    :param data: (bytes) file contents
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class PageCache:
+    """
+    Content addressed page cache with conditional revalidation
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        """
+        :param directory: (str) where to keep the cache, created if missing
+        """
+        self.directory = directory
+
+    def _url_path(self, url):
+        key = sha256(url)
+        return os.path.join(self.directory, 'urls', key[:2], key + '.json')
+
+    def _body_path(self, body_hash):
+        return os.path.join(self.directory, 'bodies', body_hash[:2], body_hash)
+
+    def load(self, url):
+        """
+        :param url: (str) requested url
+        :return entry: (dict) metadata stored for the url with the cached body
+            under 'body', None if the url is not cached
+        """
+        try:
+            with open(self._url_path(url), 'r') as meta_file:
+                entry = json.load(meta_file)
+            with open(self._body_path(entry['body_hash']), 'rb') as body_file:
+                entry['body'] = body_file.read()
+        except (OSError, ValueError, KeyError):
+            return None
+        return entry
+
+    def store(self, url, response):
+        """
+        Save a 200 response
+
+        :param url: (str) requested url
+        :param response: (requests.Response) response to save
+        """
+        body = response.content
+        body_hash = sha256(body)
+        body_path = self._body_path(body_hash)
+        if not os.path.exists(body_path):
+            atomic_write(body_path, body)
+        entry = {
+            'url': url,
+            'body_hash': body_hash,
+            'encoding': response.encoding,
+            'headers': {k: response.headers[k] for k in KEPT_HEADERS
+                        if k in response.headers},
+        }
+        atomic_write(self._url_path(url), json.dumps(entry).encode('utf-8'))
+
+    @staticmethod
+    def conditional_headers(entry):
+        """
+        :param entry: (dict) cache entry from load
+        :return headers: (dict) If-None-Match/If-Modified-Since headers to
+            revalidate the entry with
+        """
+        headers = {}
+        if 'etag' in entry['headers']:
+            headers['If-None-Match'] = entry['headers']['etag']
+        if 'last-modified' in entry['headers']:
+            headers['If-Modified-Since'] = entry['headers']['last-modified']
+        return headers
+
+    @staticmethod
+    def to_response(entry):
+        """
+        Rebuild a response from a cache entry so callers can use .text etc.
+        like any other page
+
+        :param entry: (dict) cache entry from load
+        :return response: (requests.Response) response with status 200 and
+            from_cache set to True
+        """
+        response = requests.Response()
+        response.status_code = 200
+        response.url = entry['url']
+        response._content = entry['body']
+        response.encoding = entry['encoding']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.from_cache = True
+        return response
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+client.py
+
+HTTP client shared by all of the scrapers: one pooled keep-alive session,
+bounded retries with capped exponential backoff, and typed exceptions instead
+of exiting the interpreter
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import time
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pcgs_scraper.metrics import get_metrics, page_kind
+from pcgs_scraper.ratelimit import get_limiter
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+##############
+# EXCEPTIONS #
+##############
+class ScrapeError(Exception):
+    """ Base class for errors raised while requesting pages """
+
+
+class ResponseError(ScrapeError):
+    """ Page responded with a status other than 200 """
+
+    def __init__(self, url, status_code, text=''):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        super().__init__(f'{url} responded with status {status_code}')
+
+
+class TooManyRequests(ResponseError):
+    """ Page kept responding with 429 after all retries were used """
+
+    def __init__(self, url, retry_after=None, text=''):
+        self.retry_after = retry_after
+        super().__init__(url, 429, text)
+
+
+class OfflineCacheMiss(ScrapeError):
+    """ Page was requested in offline mode but is not in the cache """
+
+    def __init__(self, url):
+        self.url = url
+        super().__init__(f'{url} is not cached and the client is offline')
+
+
+class ConnectionFailed(ScrapeError):
+    """ Could not get any response after all retries were used """
+
+    def __init__(self, url, error):
+        self.url = url
+        self.error = error
+        super().__init__(f'could not connect to {url}: {error}')
+
+
+##########
+# CLIENT #
+##########
+def parse_retry_after(value):
+    """
+    retry-after can be a number of seconds or an HTTP date
+
+    :param value: (str) value of the retry-after header, or None
+    :return seconds: (float) seconds to wait, None if header missing or invalid
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class PCGSClient:
+    """
+    Pooled keep-alive session for requesting pages from pcgs.com
+    """
+
+    def __init__(self, max_retries=5, backoff_s=1.0, max_backoff_s=60.0,
+                 connect_timeout_s=10.0, read_timeout_s=60.0, pool_size=16,
+                 verbose=True, cache=None, offline=False, limiter=None):
+        """
+        :param max_retries: (int) retries after the first attempt before giving
+            up on a page
+        :param backoff_s: (float) base for the exponential backoff
+        :param max_backoff_s: (float) backoff and retry-after waits are capped
+            at this many seconds
+        :param connect_timeout_s: (float) timeout to open a connection
+        :param read_timeout_s: (float) timeout waiting for the page, pages with
+            ps=-1 can be slow
+        :param pool_size: (int) max number of pooled connections per host,
+            should be at least the number of concurrent requests
+        :param verbose: (bool) print a message when waiting to retry
+        :param cache: (PageCache) if given, pages are saved to and revalidated
+            against this on-disk cache
+        :param offline: (bool) serve pages only from cache, never touch the
+            network, requires cache
+        :param limiter: (HostRateLimiter) rate budget told about every answer
+            and 429, see ratelimit.AdaptiveRateLimiter, defaults to the shared
+            one
+        """
+        if offline and cache is None:
+            raise ValueError('offline mode requires a cache')
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.timeout = (connect_timeout_s, read_timeout_s)
+        self.verbose = verbose
+        self.cache = cache
+        self.offline = offline
+        self.limiter = limiter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        })
+
+    def backoff(self, attempt):
+        """
+        Full jitter exponential backoff
+
+        :param attempt: (int) number of attempts made so far, starting at 1
+        :return seconds: (float) seconds to wait before the next attempt
+        """
+        cap = min(self.max_backoff_s, self.backoff_s * 2 ** (attempt - 1))
+        return random.uniform(0, cap)
+
+    def wait(self, seconds, reason, cause='backoff'):
+        get_metrics().inc('pcgs_wait_seconds_total', seconds, cause=cause)
+        if self.verbose:
+            print(f"{reason}\nWaiting {seconds:.1f}s and retrying...")
+        time.sleep(seconds)
+
+    def get(self, page_url, headers=None):
+        """
+        Request a page, retrying on 429, server errors and connection errors
+
+        :param page_url: url to request
+        :param headers: (dict) extra headers for this request
+        :return response: (requests.Response) response with status 200
+        :raises TooManyRequests: still throttled after max_retries
+        :raises ResponseError: any other status that is not 200
+        :raises ConnectionFailed: no response after max_retries
+        :raises OfflineCacheMiss: offline and the page is not cached
+        """
+        metrics = get_metrics()
+        limiter = self.limiter if self.limiter is not None else get_limiter()
+        kind = page_kind(page_url)
+        entry = None
+        if self.cache is not None:
+            entry = self.cache.load(page_url)
+            if self.offline:
+                if entry is None:
+                    raise OfflineCacheMiss(page_url)
+                metrics.inc('pcgs_responses_total', page=kind, status='cache')
+                return self.cache.to_response(entry)
+            if entry is not None:
+                headers = dict(headers or {},
+                               **self.cache.conditional_headers(entry))
+
+        attempt = 0
+        while True:
+            attempt += 1
+            sent_at = time.monotonic()
+            start = time.perf_counter()
+            try:
+                response = self.session.get(page_url, headers=headers,
+                                            timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                metrics.inc('pcgs_request_errors_total', page=kind,
+                            error=type(error).__name__)
+                if attempt > self.max_retries:
+                    raise ConnectionFailed(page_url, error) from error
+                self.wait(self.backoff(attempt),
+                          f"Request to {page_url} failed: {error}")
+                continue
+
+            metrics.observe('pcgs_request_seconds',
+                            time.perf_counter() - start, page=kind)
+            metrics.inc('pcgs_responses_total', page=kind,
+                        status=response.status_code)
+
+            if response.status_code in (200, 304):
+                limiter.on_success(page_url)
+            if response.status_code == 304 and entry is not None:
+                # not modified since we cached it
+                return self.cache.to_response(entry)
+            if response.status_code == 200:
+                size = len(response.content)
+                metrics.inc('pcgs_response_bytes_total', size, page=kind)
+                metrics.observe('pcgs_response_bytes', size, page=kind)
+                if self.cache is not None:
+                    self.cache.store(page_url, response)
+                return response
+            if response.status_code not in RETRY_STATUSES:
+                raise ResponseError(page_url, response.status_code,
+                                    response.text)
+
+            retry_after = parse_retry_after(
+                response.headers.get('retry-after'))
+            if retry_after is not None:
+                # a retry-after of hours (or a date far off) would stall the
+                # scrape, it is capped like backoff
+                retry_after = min(retry_after, self.max_backoff_s)
+            if response.status_code == 429:
+                # slow every request to the host down, not just this one
+                limiter.on_throttle(page_url, retry_after, sent_at)
+            if attempt > self.max_retries:
+                if response.status_code == 429:
+                    raise TooManyRequests(page_url, retry_after, response.text)
+                raise ResponseError(page_url, response.status_code,
+                                    response.text)
+            if retry_after is not None:
+                # server told us how long, wait that long plus some jitter
+                wait_s = retry_after + random.uniform(0, self.backoff_s)
+            else:
+                wait_s = self.backoff(attempt)
+            self.wait(wait_s, f"Encountered response status "
+                              f"{response.status_code} from {page_url}",
+                      'backoff' if retry_after is None else 'retry_after')
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    :return client: (PCGSClient) client shared by all scrapers, created on
+        first use
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = PCGSClient()
+        return _client
+
+
+def set_client(client):
+    """
+    Replace the shared client, e.g. to change retry policy or timeouts
+
+    :param client: (PCGSClient) new shared client
+    """
+    global _client
+    _client = client
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+config.py
+
+Where pcgs_scraper keeps its data files. Defaults to ./data, set the
+PCGS_SCRAPER_DATA environment variable to use another directory. Nothing is
+created until a file is written
+
+And where it scrapes pages from. Defaults to https://www.pcgs.com, set the
+PCGS_BASE_URL environment variable or call set_base_url to scrape another host,
+e.g. the stand-in server of standin.py
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import os
+import sys
+
+DATA_DIR_ENV = 'PCGS_SCRAPER_DATA'
+DEFAULT_DATA_DIR = 'data'
+BASE_URL_ENV = 'PCGS_BASE_URL'
+DEFAULT_BASE_URL = 'https://www.pcgs.com'
+
+
+def data_dir():
+    """
+    :return directory: (str) data directory, from PCGS_SCRAPER_DATA or ./data
+    """
+    return os.environ.get(DATA_DIR_ENV) or DEFAULT_DATA_DIR
+
+
+def data_path(filename):
+    """
+    :param filename: (str) name of a data file
+    :return path: (str) path of that file in the data directory
+    """
+    return os.path.join(data_dir(), filename)
+
+
+def ensure_parent(path):
+    """
+    Create the directory a file is about to be written to, if needed
+
+    :param path: (str) path of the file
+    :return path: (str) the same path
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return path
+
+
+def base_url():
+    """
+    :return url: (str) scheme and host pages are scraped from, from
+        PCGS_BASE_URL or https://www.pcgs.com, without a trailing slash
+    """
+    return (os.environ.get(BASE_URL_ENV) or DEFAULT_BASE_URL).rstrip('/')
+
+
+def set_base_url(url):
+    """
+    Scrape pages from another host: sets INDEX and PRICES of pcgs_prices and
+    URL and URL_NOLOOKUP of pcgs_nums if they are already imported, and
+    PCGS_BASE_URL for modules imported later and child processes
+
+    :param url: (str) scheme and host, e.g. http://127.0.0.1:8766
+    """
+    url = url.rstrip('/')
+    os.environ[BASE_URL_ENV] = url
+    pcgs_prices = sys.modules.get('pcgs_scraper.pcgs_prices')
+    if pcgs_prices is not None:
+        pcgs_prices.INDEX = url
+        pcgs_prices.PRICES = f'{url}/prices'
+    pcgs_nums = sys.modules.get('pcgs_scraper.pcgs_nums')
+    if pcgs_nums is not None:
+        pcgs_nums.URL = url
+        pcgs_nums.URL_NOLOOKUP = f'{url}/pcgsnolookup/'
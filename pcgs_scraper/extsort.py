@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+extsort.py
+
+External merge sort of (key, row) records, for grouping more scraped rows than
+fit in memory. Records are sorted in runs of a fixed size; a run that fills up
+is spilled to a temporary file in the journal format (length-prefixed pickle
+records, see journal.py), and the runs are merged back with heapq.merge
+
+The sort is stable: records with equal keys come out in the order they went in
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import os
+import heapq
+import shutil
+import tempfile
+from operator import itemgetter
+from itertools import groupby
+
+from pcgs_scraper.journal import Journal, pack_pair
+
+RUN_SIZE = 200000
+record_key = itemgetter(0)
+
+
+def spill_run(run, spill_dir):
+    """
+    :param run: (list(tuple)) (key, row) records, sorted
+    :param spill_dir: (str) directory to write the run to
+    :return journal: (Journal) the saved run
+    """
+    path = os.path.join(spill_dir, f'run-{len(os.listdir(spill_dir)):06d}')
+    with open(path, 'wb') as run_file:
+        for key, row in run:
+            run_file.write(pack_pair(key, row))
+    return Journal(path)
+
+
+def external_sort(records, run_size=RUN_SIZE, spill_dir=None):
+    """
+    Sort records by key, holding at most run_size records in memory at once.
+    Nothing is written to disk if all records fit in one run
+
+    :param records: iterable of (key, row), keys must be comparable
+    :param run_size: (int) records sorted in memory at a time
+    :param spill_dir: (str) directory for the temporary run files, the system
+        temporary directory by default
+    :return: generator of (key, row) records sorted by key
+    """
+    run = []
+    runs = []
+    tmp_dir = None
+    try:
+        for record in records:
+            run.append(record)
+            if len(run) >= run_size:
+                if tmp_dir is None:
+                    tmp_dir = tempfile.mkdtemp(prefix='pcgs-sort-',
+                                               dir=spill_dir)
+                run.sort(key=record_key)
+                runs.append(spill_run(run, tmp_dir))
+                run = []
+        run.sort(key=record_key)
+        if len(runs) == 0:
+            yield from run
+            return
+        # the run still in memory is the last one, so ties go to spilled runs
+        yield from heapq.merge(*runs, run, key=record_key)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def sorted_groups(records, run_size=RUN_SIZE, spill_dir=None):
+    """
+    :param records: iterable of (key, row)
+    :param run_size: (int) see external_sort
+    :param spill_dir: (str) see external_sort
+    :return: generator of (key, rows) for each distinct key, in key order, rows
+        in the order they went in
+    """
+    for key, group in groupby(external_sort(records, run_size, spill_dir),
+                              key=record_key):
+        yield key, [row for _, row in group]
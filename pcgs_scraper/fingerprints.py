@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+fingerprints.py
+
+Per-page fingerprints of the price tables, used to re-scrape incrementally:
+a grade bin page whose table-main fingerprint did not change since the last run
+is not parsed again, its rows are read back from the unprocessed pkl of the
+last run instead
+
+Only fingerprints and where each page's rows are in that pkl are kept, never
+the rows themselves. A scrape saves its fingerprints next to its unprocessed
+pkl (see pending_path), and they become the ones the next scrape compares
+against (FINGERPRINTS_FILE) only once that pkl is merged into the price guide
+(see commit), so pages are always compared against the guide they would be
+copied from
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import os
+import pickle
+import threading
+
+from pcgs_scraper.config import data_path, ensure_parent
+from pcgs_scraper.journal import load_chunk
+from pcgs_scraper.parsers import table_fingerprint
+
+FINGERPRINTS_FILE = data_path('price_fingerprints.pkl')
+
+
+class PageFingerprints:
+    """
+    Fingerprints of every grade bin page of a scrape, compared against the ones
+    of the scrape merged into the price guide
+    """
+
+    def __init__(self, previous_pages=None, source=None):
+        """
+        :param previous_pages: (dict) url -> (fingerprint, location) saved by
+            the previous scrape, location of the page's rows in source
+        :param source: (str) unprocessed pkl of the previous scrape, see
+            journal.dump_list
+        """
+        self.previous_pages = previous_pages or {}
+        self.source = source
+        self.fingerprints = {}
+        self.changed = set()
+        self._lock = threading.Lock()
+
+    def parse(self, html, url, parse):
+        """
+        Parse a page only if its table changed since the previous scrape
+
+        :param html: (str) html of the page
+        :param url: (str) url of the page
+        :param parse: function(html, url) -> rows, called if the page changed
+        :return rows: rows of the page
+        """
+        fingerprint = table_fingerprint(html)
+        previous = self.previous_pages.get(url)
+        if previous is not None and previous[0] == fingerprint and \
+                fingerprint is not None and os.path.isfile(self.source):
+            rows = load_chunk(self.source, previous[1])
+            changed = False
+        else:
+            rows = parse(html, url)
+            changed = True
+        with self._lock:
+            self.fingerprints[url] = fingerprint
+            if changed:
+                self.changed.add(url)
+        return rows
+
+    def add_unknown(self, url):
+        """
+        Record a page scraped without a fingerprint (e.g. resumed from a
+        journal), it counts as changed and will be parsed next time
+
+        :param url: (str) url of the page
+        """
+        with self._lock:
+            if url not in self.fingerprints:
+                self.fingerprints[url] = None
+                self.changed.add(url)
+
+    def save(self, filepath, locations):
+        """
+        Save the fingerprints next to the unprocessed pkl of this scrape, see
+        pending_path
+
+        :param filepath: (str) unprocessed pkl of this scrape
+        :param locations: (dict) url -> location of the page's rows in it
+        """
+        pages = {url: (self.fingerprints.get(url), location)
+                 for url, location in locations.items()}
+        with open(ensure_parent(pending_path(filepath)), 'wb') as outfile:
+            pickle.dump({'source': filepath, 'pages': pages,
+                         'changed': self.changed}, outfile)
+
+    @classmethod
+    def load(cls, path=FINGERPRINTS_FILE):
+        """
+        :param path: (str) fingerprints of the scrape merged into the price
+            guide, see commit
+        :return fingerprints: (PageFingerprints) empty, compared against the
+            pages saved in path, or against nothing if path does not exist
+        """
+        if not os.path.isfile(path):
+            return cls()
+        saved = pickle.load(open(path, 'rb'))
+        return cls(saved['pages'], saved['source'])
+
+
+def pending_path(filepath):
+    """
+    :param filepath: (str) unprocessed pkl of a scrape
+    :return path: (str) fingerprints of that scrape, not merged yet
+    """
+    return filepath + '.fingerprints'
+
+
+def load_changed(filepath):
+    """
+    :param filepath: (str) unprocessed pkl of an incremental scrape
+    :return changed: (set) urls whose table changed in that scrape
+    """
+    saved = pickle.load(open(pending_path(filepath), 'rb'))
+    return saved['changed']
+
+
+def commit(filepath, path=FINGERPRINTS_FILE):
+    """
+    Make the fingerprints of a scrape the ones the next incremental scrape
+    compares against, call once its unprocessed pkl is merged into the price
+    guide. Nothing happens if the scrape was not incremental
+
+    :param filepath: (str) unprocessed pkl that was merged
+    :param path: (str) see PageFingerprints.load
+    """
+    pending = pending_path(filepath)
+    if os.path.isfile(pending):
+        os.replace(pending, ensure_parent(path))
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+journal.py
+
+Crash-safe append-only journal of scraped work. Each finished unit of work
+(e.g. one grade bin page) is written to disk as soon as it is scraped, so a
+crash only loses the page being worked on and a restarted run can skip
+everything already journaled
+
+File format: a sequence of length-prefixed pickle records, either
+    [8 byte big-endian length][pickle of key][pickle of rows]     (pack)
+    [8 byte big-endian length][pickle of (key, rows)]             (pack_pair)
+The key is pickled on its own so the keys of a journal can be read without
+unpickling any rows (see Journal.index). pack_pair records, what journals
+held before v0.0.5, are faster to write and read in full, e.g. for files that
+are only ever read in full like the runs of extsort.py. A record cut off by a
+crash is detected by its length and dropped
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import io
+import os
+import struct
+import pickle
+from contextlib import contextmanager
+
+from pcgs_scraper.config import ensure_parent
+
+HEADER = struct.Struct('>Q')
+# dump_list writes a list chunk by chunk. Protocol 3 names each memo slot, so
+# the slots of each chunk can reuse those of the chunks before it (from
+# protocol 4 slots are numbered implicitly across the whole pickle)
+STREAM_PROTOCOL = 3
+# PROTO 3, EMPTY_LIST, BINPUT 0: how every list pickled with it starts
+LIST_HEAD = pickle.dumps([], protocol=STREAM_PROTOCOL)[:-len(pickle.STOP)]
+# PROTO 3, EMPTY_DICT, BINPUT 0: same for dicts, see dump_dict
+DICT_HEAD = pickle.dumps({}, protocol=STREAM_PROTOCOL)[:-len(pickle.STOP)]
+# ends the chunk index written after the STOP of dump_list, see load_chunks
+CHUNKS_TAG = b'pcgs-chunks'
+
+
+def pack(key, rows):
+    """
+    :param key: hashable id of the record
+    :param rows: (list) data of the record
+    :return record: (bytes) length header, pickled key and pickled rows
+    """
+    payload = pickle.dumps(key, protocol=pickle.HIGHEST_PROTOCOL) + \
+        pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL)
+    return HEADER.pack(len(payload)) + payload
+
+
+def pack_pair(key, rows):
+    """
+    :param key: hashable id of the record
+    :param rows: (list) data of the record
+    :return record: (bytes) length header and pickled (key, rows), the key
+        can not be read without the rows
+    """
+    payload = pickle.dumps((key, rows), protocol=pickle.HIGHEST_PROTOCOL)
+    return HEADER.pack(len(payload)) + payload
+
+
+def unpack_rows(payload):
+    """
+    :param payload: (bytes) a record without its length header
+    :return rows: the rows of the record
+    """
+    stream = io.BytesIO(payload)
+    first = pickle.load(stream)
+    if stream.tell() == len(payload):
+        return first[1]     # pack_pair, one pickle of (key, rows)
+    return pickle.load(stream)
+
+
+class Journal:
+    """
+    Append-only journal of (key, rows) records
+    """
+
+    def __init__(self, path):
+        """
+        :param path: (str) journal file, created on first append
+        """
+        self.path = path
+
+    def _scan(self, with_rows=False):
+        """
+        :param with_rows: (bool) also unpickle the rows of each record
+        :return: generator of (key, location, rows) for every complete record,
+            location is (offset, size) of the record after its header, rows
+            is None unless with_rows
+        """
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, 'rb') as journal_file:
+            file_size = os.fstat(journal_file.fileno()).st_size
+            while True:
+                header = journal_file.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return
+                size, = HEADER.unpack(header)
+                offset = journal_file.tell()
+                end = offset + size
+                if end > file_size:
+                    return      # torn write from a crash
+                # the rows are read along with the key, or skipped
+                if with_rows:
+                    stream = io.BytesIO(journal_file.read(size))
+                else:
+                    stream = journal_file
+                try:
+                    key = pickle.load(stream)
+                    rows = None
+                    if stream.tell() == (size if with_rows else end):
+                        # pack_pair, one pickle of (key, rows)
+                        key, rows = key
+                    elif with_rows:
+                        rows = pickle.load(stream)
+                except (pickle.UnpicklingError, EOFError, ValueError,
+                        TypeError):
+                    return
+                if journal_file.tell() > end:
+                    return
+                journal_file.seek(end)
+                yield key, (offset, size), rows
+
+    def __iter__(self):
+        """
+        :return: generator of (key, rows) records, in the order they were
+            appended
+        """
+        for key, _, rows in self._scan(with_rows=True):
+            yield key, rows
+
+    def index(self):
+        """
+        Where the record of each key is, found without unpickling any rows
+
+        :return locations: (dict) key -> location of its last record, for
+            read_rows
+        """
+        return {key: location for key, location, _ in self._scan()}
+
+    def read_rows(self, location, journal_file=None):
+        """
+        :param location: location of a record, from index
+        :param journal_file: (file) the journal opened 'rb', to read many
+            records without opening it for each
+        :return rows: (list) rows of the record
+        """
+        offset, size = location
+        if journal_file is None:
+            with open(self.path, 'rb') as journal_file:
+                journal_file.seek(offset)
+                return unpack_rows(journal_file.read(size))
+        journal_file.seek(offset)
+        return unpack_rows(journal_file.read(size))
+
+    def ordered(self, keys):
+        """
+        Rows of the given keys in the given order, one record in memory at a
+        time, keys not in the journal are skipped
+
+        :param keys: iterable of keys, e.g. urls in the order a sequential
+            scrape would visit them
+        :return: generator of the rows of each key, latest record of a key
+        """
+        locations = self.index()
+        if len(locations) == 0:
+            return
+        with open(self.path, 'rb') as journal_file:
+            for key in keys:
+                location = locations.get(key)
+                if location is not None:
+                    yield self.read_rows(location, journal_file)
+
+    def done(self):
+        """
+        :return keys: (set) keys of every record in the journal, read without
+            unpickling any rows
+        """
+        return set(self.index())
+
+    def rows(self):
+        """
+        :return: generator of every row of every record
+        """
+        for _, rows in self:
+            yield from rows
+
+    def recover(self):
+        """
+        Cut off a partial record left at the end of the file by a crash, so new
+        records are not appended after garbage
+        """
+        if not os.path.isfile(self.path):
+            return
+        valid_end = 0
+        for _, (offset, size), _ in self._scan():
+            valid_end = offset + size
+        if valid_end != os.path.getsize(self.path):
+            with open(self.path, 'r+b') as journal_file:
+                journal_file.truncate(valid_end)
+
+    def append(self, key, rows):
+        """
+        Write a record and make sure it reached the disk before returning
+
+        :param key: hashable id of the unit of work, e.g. a url
+        :param rows: (list) data scraped for that unit of work
+        """
+        with open(ensure_parent(self.path), 'ab') as journal_file:
+            journal_file.write(pack(key, rows))
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+    @contextmanager
+    def batch(self):
+        """
+        Append many records, synced to disk once at the end instead of after
+        every record. For records that can be made again if they are lost
+
+            with journal.batch() as append:
+                append(key, rows)
+
+        :return: context manager giving an append(key, rows) function
+        """
+        with open(ensure_parent(self.path), 'ab') as journal_file:
+            def append(key, rows):
+                journal_file.write(pack(key, rows))
+            yield append
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+    def remove(self):
+        """ Delete the journal once its contents are saved elsewhere """
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+def dump_list(chunks, path):
+    """
+    Pickle the items of many chunks as one list, loaded back with pickle.load
+    like pickle.dump(list) would be, holding one chunk at a time in memory
+    instead of the whole list
+
+    The file is one list header, then the pickle of each chunk without its
+    own header and STOP: the APPENDS of its items, which add them to the list
+    on top of the stack. pickle.load stops at the STOP, after it comes an
+    index of the chunks for load_chunks
+
+    :param chunks: iterable of lists, e.g. Journal.ordered
+    :param path: (str) pickle file to write
+    :return locations: (list) (offset, size) of each chunk in the file, to
+        read one back with load_chunk
+    """
+    return _dump_chunks(chunks, path, list, LIST_HEAD)
+
+
+def dump_dict(chunks, path):
+    """
+    Same as dump_list for a dict: the SETITEMS of the items of each chunk are
+    added to one dict, loaded back with pickle.load like pickle.dump(dict)
+
+    :param chunks: iterable of iterables of (key, value), e.g. chunks of
+        dict.items()
+    :param path: (str) pickle file to write
+    :return locations: (list) see dump_list
+    """
+    return _dump_chunks(chunks, path, dict, DICT_HEAD)
+
+
+def _dump_chunks(chunks, path, kind, head):
+    """
+    :param chunks: see dump_list and dump_dict
+    :param path: (str) pickle file to write
+    :param kind: list or dict, made of each chunk
+    :param head: (bytes) LIST_HEAD or DICT_HEAD, same kind
+    :return locations: (list) see dump_list
+    """
+    locations = []
+    with open(ensure_parent(path), 'wb') as outfile:
+        outfile.write(head)
+        offset = len(head)
+        for chunk in chunks:
+            data = pickle.dumps(kind(chunk), protocol=STREAM_PROTOCOL)
+            size = len(data) - len(head) - len(pickle.STOP)
+            outfile.write(memoryview(data)[len(head):-len(pickle.STOP)])
+            locations.append((offset, size))
+            offset += size
+        outfile.write(pickle.STOP)
+        index = pickle.dumps(locations, protocol=pickle.HIGHEST_PROTOCOL)
+        outfile.write(index + HEADER.pack(len(index)) + CHUNKS_TAG)
+    return locations
+
+
+def load_chunk(path, location, infile=None):
+    """
+    :param path: (str) pickle file written by dump_list or dump_dict
+    :param location: (tuple) (offset, size) of a chunk, from dump_list
+    :param infile: open path to read from instead of opening it again
+    :return chunk: (list or dict) items of that chunk only
+    """
+    if infile is None:
+        with open(path, 'rb') as infile:
+            return load_chunk(path, location, infile)
+    offset, size = location
+    infile.seek(0)
+    head = infile.read(len(LIST_HEAD))
+    infile.seek(offset)
+    data = infile.read(size)
+    return pickle.loads(head + data + pickle.STOP)
+
+
+def load_chunks(path):
+    """
+    Read a pickle written by dump_list or dump_dict one chunk at a time, so
+    only one chunk is in memory at once. A pickle written any other way (e.g.
+    with pickle.dump before v0.0.5) has no chunk index and is read in full
+
+    :param path: (str) pickle file
+    :return: generator of chunks (list or dict), in order
+    """
+    with open(path, 'rb') as infile:
+        locations = chunk_index(infile)
+        if locations is None:
+            infile.seek(0)
+            yield pickle.load(infile)
+            return
+        for location in locations:
+            yield load_chunk(path, location, infile)
+
+
+def chunk_index(infile):
+    """
+    :param infile: open pickle file
+    :return locations: (list) the locations dump_list returned when it wrote
+        the file, None if it was not written by dump_list or dump_dict
+    """
+    footer = HEADER.size + len(CHUNKS_TAG)
+    end = infile.seek(0, io.SEEK_END)
+    if end < footer:
+        return None
+    infile.seek(end - footer)
+    (size,) = HEADER.unpack(infile.read(HEADER.size))
+    if infile.read() != CHUNKS_TAG or size > end - footer:
+        return None
+    infile.seek(end - footer - size)
+    return pickle.loads(infile.read(size))
+
+
+def open_journal(path):
+    """
+    Open a journal, recovering it if a previous run crashed mid write
+
+    :param path: (str) journal file
+    :return journal: (Journal) journal ready to append to
+    """
+    journal = Journal(path)
+    journal.recover()
+    return journal
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+metrics.py
+
+Instrumentation of the scrapers: counters and histograms of requests, waits
+and parsing, shared by every thread of a scrape and written at the end of a
+scrape as a Prometheus textfile (for node_exporter's textfile collector) and a
+JSON summary
+
+    get_metrics().inc('pcgs_responses_total', page='prices', status='200')
+    get_metrics().observe('pcgs_request_seconds', 0.42, page='prices')
+    write_metrics('pcgs_prices')    # data/pcgs_prices.prom and
+                                    # data/pcgs_prices_metrics.json
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import os
+import json
+import time
+import threading
+from urllib.parse import urlparse
+
+from pcgs_scraper.config import data_path
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PARSE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+ROWS_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000)
+SIZE_BUCKETS = (1e4, 5e4, 1e5, 5e5, 1e6, 5e6)
+QUANTILES = (50, 90, 99)
+
+# name -> (type, help, buckets of a histogram)
+STANDARD_METRICS = {
+    'pcgs_request_seconds': (
+        'histogram', 'Latency of each request to pcgs.com, by page kind',
+        LATENCY_BUCKETS),
+    'pcgs_responses_total': (
+        'counter', 'Responses by page kind and status, cache for pages '
+                   'served from the offline cache', None),
+    'pcgs_request_errors_total': (
+        'counter', 'Requests that got no response, by error', None),
+    'pcgs_response_bytes_total': (
+        'counter', 'Bytes of page bodies received, by page kind', None),
+    'pcgs_response_bytes': (
+        'histogram', 'Size of each page body received, by page kind',
+        SIZE_BUCKETS),
+    'pcgs_wait_seconds_total': (
+        'counter', 'Seconds spent waiting instead of requesting, by cause: '
+                   'retry_after, backoff, rate_limit or sleep', None),
+    'pcgs_rate_cuts_total': (
+        'counter', 'Times the adaptive rate of a host was cut after a 429',
+        None),
+    'pcgs_parse_seconds': (
+        'histogram', 'Time to parse each page, by page kind', PARSE_BUCKETS),
+    'pcgs_rows_per_page': (
+        'histogram', 'Rows parsed from each page, by page kind',
+        ROWS_BUCKETS),
+}
+
+
+def page_kind(url):
+    """
+    :param url: (str) url of a pcgs.com page
+    :return kind: (str) label for the kind of page, e.g. prices,
+        prices/detail, pcgsnolookup or coinfacts
+    """
+    parts = [part for part in urlparse(url).path.split('/') if part]
+    if len(parts) == 0:
+        return 'root'
+    if parts[0] == 'prices' and len(parts) > 1:
+        return 'prices/detail'
+    return parts[0]
+
+
+def label_key(labels):
+    """
+    :param labels: (dict) label name -> value
+    :return key: (tuple) hashable, sorted (name, value) pairs
+    """
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def escape_label(value):
+    return value.replace('\\', r'\\').replace('"', r'\"') \
+        .replace('\n', r'\n')
+
+
+def format_labels(key, extra=()):
+    """
+    :param key: (tuple) output of label_key
+    :param extra: (tuple) more (name, value) pairs, e.g. le of a bucket
+    :return labels: (str) prometheus label set, e.g. {page="prices"}, empty
+        if there are no labels
+    """
+    pairs = list(key) + list(extra)
+    if len(pairs) == 0:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"'
+                          for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Histogram:
+    """
+    Observations of one label set, counted into fixed buckets
+    """
+    __slots__ = ('buckets', 'counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self, buckets):
+        """
+        :param buckets: (tuple(float)) upper bounds, ascending, +Inf is added
+        """
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """
+        :param q: (float) quantile in percent, e.g. 90
+        :return value: (float) upper bound of the bucket holding the quantile,
+            the largest value observed if that is lower, None if empty
+        """
+        if self.count == 0:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        summary = {
+            'count': self.count,
+            'sum': round(self.total, 6),
+            'mean': round(self.total / self.count, 6) if self.count else None,
+            'min': self.min,
+            'max': self.max,
+        }
+        for q in QUANTILES:
+            summary[f'p{q}'] = self.quantile(q)
+        return summary
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters and histograms, each with any number of label sets
+    """
+
+    def __init__(self, metrics=None):
+        """
+        :param metrics: (dict) name -> (type, help, buckets) of every metric
+            that can be recorded, defaults to STANDARD_METRICS
+        """
+        self.metrics = dict(STANDARD_METRICS if metrics is None else metrics)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Forget everything recorded, e.g. at the start of a scrape """
+        with self._lock:
+            self.started = time.time()
+            self._values = {name: {} for name in self.metrics}
+
+    def inc(self, name, value=1, **labels):
+        """
+        :param name: (str) name of a counter
+        :param value: (float) amount to add
+        :param labels: label values, e.g. status=200
+        """
+        key = label_key(labels)
+        with self._lock:
+            values = self._values[name]
+            values[key] = values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        :param name: (str) name of a histogram
+        :param value: (float) the observation, e.g. seconds
+        :param labels: label values, e.g. page='prices/detail'
+        """
+        key = label_key(labels)
+        with self._lock:
+            values = self._values[name]
+            histogram = values.get(key)
+            if histogram is None:
+                histogram = values[key] = Histogram(self.metrics[name][2])
+            histogram.observe(value)
+
+    def value(self, name, **labels):
+        """
+        :return value: (float) value of a counter, (Histogram) of a histogram,
+            None if nothing was recorded for these labels
+        """
+        with self._lock:
+            return self._values[name].get(label_key(labels))
+
+    def to_prometheus(self, extra_labels=None):
+        """
+        :param extra_labels: (dict) labels added to every sample, e.g. job
+        :return text: (str) every metric in the prometheus text format
+        """
+        extra = label_key(extra_labels or {})
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, _) in self.metrics.items():
+                values = self._values[name]
+                if len(values) == 0:
+                    continue
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for key in sorted(values):
+                    labels = key + extra
+                    if kind == 'counter':
+                        lines.append(f'{name}{format_labels(labels)} '
+                                     f'{format_value(values[key])}')
+                        continue
+                    histogram = values[key]
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets,
+                                            histogram.counts):
+                        cumulative += count
+                        le = (('le', format_value(bound)),)
+                        lines.append(f'{name}_bucket'
+                                     f'{format_labels(labels, le)} '
+                                     f'{cumulative}')
+                    lines.append(f'{name}_sum{format_labels(labels)} '
+                                 f'{format_value(histogram.total)}')
+                    lines.append(f'{name}_count{format_labels(labels)} '
+                                 f'{histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """
+        :return summary: (dict) run times, counters by label set, and count,
+            sum, mean, min, max and quantiles of histograms by label set
+        """
+        finished = time.time()
+        summary = {
+            'started': self.started,
+            'finished': finished,
+            'duration_s': round(finished - self.started, 3),
+            'counters': {},
+            'histograms': {},
+        }
+        with self._lock:
+            for name, (kind, _, _) in self.metrics.items():
+                values = self._values[name]
+                if len(values) == 0:
+                    continue
+                by_labels = {','.join(f'{label}={value}'
+                                      for label, value in key): values[key]
+                             for key in sorted(values)}
+                if kind == 'counter':
+                    summary['counters'][name] = by_labels
+                else:
+                    summary['histograms'][name] = {
+                        labels: histogram.summary()
+                        for labels, histogram in by_labels.items()}
+        return summary
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """
+    :return metrics: (MetricsRegistry) registry shared by all scrapers,
+        created on first use
+    """
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = MetricsRegistry()
+        return _metrics
+
+
+def set_metrics(metrics):
+    """
+    Replace the shared registry
+
+    :param metrics: (MetricsRegistry) new shared registry
+    """
+    global _metrics
+    _metrics = metrics
+
+
+def write_metrics(job, directory=None, metrics=None):
+    """
+    Write the metrics of a scrape as a Prometheus textfile, <job>.prom, and a
+    JSON summary, <job>_metrics.json. Both are replaced atomically so a
+    collector never reads half a file
+
+    :param job: (str) name of the scrape, e.g. pcgs_prices, added to every
+        sample as the job label
+    :param directory: (str) where to write, defaults to the data directory
+    :param metrics: (MetricsRegistry) defaults to the shared registry
+    :return prom_path, json_path: (str) paths written
+    """
+    from pcgs_scraper.cache import atomic_write
+
+    if metrics is None:
+        metrics = get_metrics()
+    if directory is None:
+        prom_path = data_path(f'{job}.prom')
+        json_path = data_path(f'{job}_metrics.json')
+    else:
+        prom_path = os.path.join(directory, f'{job}.prom')
+        json_path = os.path.join(directory, f'{job}_metrics.json')
+    summary = dict(metrics.summary(), job=job)
+    text = metrics.to_prometheus({'job': job})
+    text += f'# HELP pcgs_run_duration_seconds Duration of the scrape\n' \
+            f'# TYPE pcgs_run_duration_seconds gauge\n' \
+            f'pcgs_run_duration_seconds{{job="{job}"}} ' \
+            f'{format_value(summary["duration_s"])}\n' \
+            f'# HELP pcgs_run_finished_timestamp_seconds When the scrape ' \
+            f'finished\n' \
+            f'# TYPE pcgs_run_finished_timestamp_seconds gauge\n' \
+            f'pcgs_run_finished_timestamp_seconds{{job="{job}"}} ' \
+            f'{format_value(round(summary["finished"], 3))}\n'
+    atomic_write(os.path.abspath(prom_path), text.encode('utf-8'))
+    atomic_write(os.path.abspath(json_path),
+                 json.dumps(summary, indent=2).encode('utf-8'))
+    return prom_path, json_path
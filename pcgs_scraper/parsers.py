@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+parsers.py
+
+HTML parser backends for the scraping functions. Each backend turns the html of
+one kind of pcgs.com page into plain python data, so the scrapers do not care
+which library did the parsing:
+
+    Bs4Backend:  BeautifulSoup with the pure python html.parser, the original
+                 implementation and the reference output for other backends
+    LxmlBackend: lxml (C-accelerated). Price and number pages are cut down to
+                 their tables with a quick scan of the raw html (see
+                 main_table_html and tables_html) and only those are parsed,
+                 category and coinfacts pages are parsed whole
+
+Both backends return exactly the same rows for the same html
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import re
+import hashlib
+from collections import defaultdict
+
+BACKENDS = ['lxml', 'bs4']
+
+MAIN_TABLE_START = re.compile(
+    r'<table\b[^>]*\bclass\s*=\s*["\'][^"\']*(?<![\w-])table-main(?![\w-])',
+    re.IGNORECASE)
+TABLE_TAG = re.compile(r'<(/?)table\b', re.IGNORECASE)
+TABLE_END = re.compile(r'</table\s*>', re.IGNORECASE)
+BETWEEN_TAGS = re.compile(r'>\s+<')
+WHITESPACE = re.compile(r'\s+')
+
+
+class Bs4Backend:
+    """
+    BeautifulSoup + html.parser
+    """
+    name = 'bs4'
+
+    def __init__(self):
+        from bs4 import BeautifulSoup
+        self.BeautifulSoup = BeautifulSoup
+
+    def soup(self, html):
+        return self.BeautifulSoup(html, 'html.parser')
+
+    def category_urls(self, html, index):
+        """
+        :param html: (str) html of the /prices or /pcgsnolookup page
+        :param index: (str) base url the category hrefs are relative to
+        :return urls_by_category: (dict) category -> [(name, url), ...]
+        """
+        from pcgs_scraper.utils import non_ns_children
+        soup = self.soup(html)
+
+        urls_by_category = defaultdict(list)
+
+        # get all category urls from /prices page
+        # first: get two columns which contain the boxes for each category
+        columns = soup.find_all('div', class_='col-xs-12 col-sm-6')
+        for column in columns:
+            for box in non_ns_children(column, 'children'):
+                for box_element in non_ns_children(box, 'children'):
+                    if 'class' in box_element.attrs and \
+                            'coin-heading' in box_element.attrs['class']:
+                        heading = box_element.text.strip()
+                    elif box_element.name == 'ul':
+                        for list_item in non_ns_children(box_element,
+                                                         'children'):
+                            # presumably only has one tag as a child, <a>
+                            category_href = list_item.contents[0].attrs['href']
+                            category_url = index + category_href
+                            category_name = list_item.contents[0].text.strip()
+                            this_category = (category_name, category_url)
+                            urls_by_category[heading].append(this_category)
+        # turn into a regular dict
+        return dict(urls_by_category)
+
+    def price_rows(self, html, grades, url):
+        """
+        :param html: (str) html of a page under www.pcgs.com/prices/detail/...
+        :param grades: (str) grade bin of the page, one of BINS
+        :param url: (str) url of the page, saved with each row
+        :return prices: a list of dictionaries representing each row in the
+            table
+        """
+        from pcgs_scraper.utils import non_ns_children
+        soup = self.soup(html)
+
+        # find the table
+        table = soup.find('table', class_='table-main')
+        if table is None:
+            # some pages like counterstamped colonials have no price
+            # information, would crash script otherwise
+            return []
+
+        # loop through table elements and scrape prices
+        prices = []
+        for element in non_ns_children(table, 'children'):
+            if element.name == 'tbody':
+                for child in non_ns_children(element, 'children'):
+                    # table has lots of elements, but the ones which contain
+                    # coin prices are colored bg-pale and bg-light, this makes
+                    # IDing them a lot easier
+                    if 'class' in child.attrs:  # check if it has class attr
+                        if 'bg-pale' in child.attrs['class'] \
+                                or 'bg-light' in child.attrs['class']:
+                            # each row has 13 cells with two possible internal
+                            # rows
+                            cells = non_ns_children(child, 'children')
+                            row_prices = []  # to collect all prices in this row
+                            for i, cell in enumerate(cells):
+                                if i == 0:  # cell 0 is the pcgs number
+                                    pcgs_num = cell.text.strip()
+                                    if len(pcgs_num) == 0:
+                                        pcgs_num = None
+                                elif i == 1:  # cell 1 is the description
+                                    description = cell.text.strip()
+                                elif i == 2:  # cell 2 is the designation
+                                    desig = cell.text.split()
+                                elif 3 <= i <= 12:  # rest are prices
+                                    row_prices.append(
+                                        price_cell(cell.text))
+                            # after each cell is scraped, turn into a dict &
+                            # append
+                            row = {
+                                'pcgs_num': pcgs_num,
+                                'description': description,
+                                'desig': desig,
+                                'grades': grades,
+                                'prices': row_prices,
+                                'url': url
+                            }
+                            prices.append(row)
+        return prices
+
+    def number_rows(self, html):
+        """
+        :param html: (str) html of a pcgs.com/pcgsnolookup subcategory page
+        :return rows: list of dicts with pcgs_num, desig, description and
+            coinfacts_href (relative to the site) for each number row
+        """
+        from pcgs_scraper.utils import non_ns_children
+        soup = self.soup(html)
+        table_rows = soup.find_all('tr')
+
+        rows = []
+        for table_row in table_rows:
+            # add some variables to track progress
+            number_row = True           # init value of flag is True
+            all_cells_filled = False    # True once all 3 columns filled
+
+            for cell in non_ns_children(table_row, 'children'):
+                if number_row:  # since init is True, always runs first cell
+                    if 'data-title' in cell.attrs:
+                        if 'PCGS #' in cell.attrs['data-title']:
+                            number_row = True       # set flag true
+                            pcgs_num = cell.text.strip()
+                            coinfacts_href = cell.contents[0].attrs['href']
+                        elif 'Designation' in cell.attrs['data-title']:
+                            designation = cell.text.strip()
+                        elif 'Description' in cell.attrs['data-title']:
+                            description = cell.text.strip()
+                            all_cells_filled = True
+                    else:       # cell is not in a number row
+                        number_row = False
+                        # one non 'data-title' cell kills a row
+                        # this should save time by not having to check each
+                        # cell in a row we know does not contain data-title
+                        # information, like a header
+
+            if all_cells_filled:
+                rows.append({
+                    'pcgs_num': pcgs_num,
+                    'desig': designation,
+                    'description': description,
+                    'coinfacts_href': coinfacts_href,
+                })
+        return rows
+
+    def coinfacts(self, html):
+        """
+        :param html: (str) html of a coinfacts page
+        :return coinfacts: (dict) image, images and narrative of the coin
+        """
+        soup = self.soup(html)
+        images_html = soup.find_all('img')
+        filtered_images = []
+        for image_html in images_html:
+            if 'alt' not in image_html.attrs.keys():
+                continue
+            alt = image_html.attrs['alt']
+            if "logo" in alt:
+                continue        # no logos
+            if "PCGS" in alt:
+                filtered_images.append(image_html)
+        images = [(i.attrs['data-src'], i.attrs['alt'].strip())
+                  for i in filtered_images]
+        narrative_html = soup.find(id="sectionNarrative")
+        if narrative_html is None:
+            narrative = None
+        else:
+            narrative = narrative_html.text
+        return coinfacts_dict(images, narrative)
+
+
+class LxmlBackend:
+    """
+    lxml, mirrors Bs4Backend step for step but only parses the tables of price
+    and number pages
+    """
+    name = 'lxml'
+
+    # same matching rules as bs4's find/find_all with class_
+    COLUMNS = "//div[@class='col-xs-12 col-sm-6']"
+    MAIN_TABLE = "//table[contains(concat(' ', normalize-space(@class), ' '), " \
+                 "' table-main ')]"
+
+    def __init__(self):
+        import lxml.html
+        self.lxml_html = lxml.html
+
+    def tree(self, html):
+        try:
+            return self.lxml_html.document_fromstring(html)
+        except ValueError:
+            # unicode strings with an xml encoding declaration are refused
+            return self.lxml_html.document_fromstring(html.encode('utf-8'))
+
+    def fragment(self, html):
+        """
+        :param html: (str) piece of a page, e.g. one table
+        :return element: (HtmlElement) div holding the parsed piece
+        """
+        return self.lxml_html.fragment_fromstring(html, create_parent='div')
+
+    @staticmethod
+    def children(element):
+        """ lxml version of non_ns_children(tag, 'children') """
+        return [child for child in element if isinstance(child.tag, str)]
+
+    @staticmethod
+    def classes(element):
+        return element.get('class', '').split()
+
+    def category_urls(self, html, index):
+        """ see Bs4Backend.category_urls """
+        tree = self.tree(html)
+        urls_by_category = defaultdict(list)
+        for column in tree.xpath(self.COLUMNS):
+            for box in self.children(column):
+                for box_element in self.children(box):
+                    if box_element.get('class') is not None and \
+                            'coin-heading' in self.classes(box_element):
+                        heading = box_element.text_content().strip()
+                    elif box_element.tag == 'ul':
+                        for list_item in self.children(box_element):
+                            anchor = list_item[0]
+                            category_url = index + anchor.attrib['href']
+                            category_name = anchor.text_content().strip()
+                            this_category = (category_name, category_url)
+                            urls_by_category[heading].append(this_category)
+        return dict(urls_by_category)
+
+    def price_rows(self, html, grades, url):
+        """ see Bs4Backend.price_rows """
+        table_html = main_table_html(html)
+        if table_html is None:
+            return []       # no table, nothing to parse
+        tables = self.fragment(table_html).xpath(self.MAIN_TABLE)
+        if len(tables) == 0:
+            return []
+        table = tables[0]
+
+        prices = []
+        for element in self.children(table):
+            if element.tag != 'tbody':
+                continue
+            for child in self.children(element):
+                if child.get('class') is None:
+                    continue
+                child_classes = self.classes(child)
+                if 'bg-pale' not in child_classes \
+                        and 'bg-light' not in child_classes:
+                    continue
+                row_prices = []
+                for i, cell in enumerate(self.children(child)):
+                    if i == 0:
+                        pcgs_num = cell.text_content().strip()
+                        if len(pcgs_num) == 0:
+                            pcgs_num = None
+                    elif i == 1:
+                        description = cell.text_content().strip()
+                    elif i == 2:
+                        desig = cell.text_content().split()
+                    elif 3 <= i <= 12:
+                        row_prices.append(price_cell(cell.text_content()))
+                prices.append({
+                    'pcgs_num': pcgs_num,
+                    'description': description,
+                    'desig': desig,
+                    'grades': grades,
+                    'prices': row_prices,
+                    'url': url
+                })
+        return prices
+
+    def number_rows(self, html):
+        """ see Bs4Backend.number_rows """
+        table_html = tables_html(html)
+        if table_html is None:
+            tree = self.tree(html)      # no tables, rows may be anywhere
+        else:
+            tree = self.fragment(table_html)
+        rows = []
+        for table_row in tree.iter('tr'):
+            number_row = True
+            all_cells_filled = False
+            for cell in self.children(table_row):
+                if not number_row:
+                    continue
+                data_title = cell.get('data-title')
+                if data_title is None:
+                    number_row = False
+                elif 'PCGS #' in data_title:
+                    pcgs_num = cell.text_content().strip()
+                    coinfacts_href = cell[0].attrib['href']
+                elif 'Designation' in data_title:
+                    designation = cell.text_content().strip()
+                elif 'Description' in data_title:
+                    description = cell.text_content().strip()
+                    all_cells_filled = True
+            if all_cells_filled:
+                rows.append({
+                    'pcgs_num': pcgs_num,
+                    'desig': designation,
+                    'description': description,
+                    'coinfacts_href': coinfacts_href,
+                })
+        return rows
+
+    def coinfacts(self, html):
+        """ see Bs4Backend.coinfacts """
+        tree = self.tree(html)
+        images = []
+        for image in tree.iter('img'):
+            alt = image.get('alt')
+            if alt is None or "logo" in alt or "PCGS" not in alt:
+                continue
+            images.append((image.attrib['data-src'], alt.strip()))
+        narrative_html = tree.xpath("//*[@id='sectionNarrative']")
+        if len(narrative_html) == 0:
+            narrative = None
+        else:
+            narrative = narrative_html[0].text_content()
+        return coinfacts_dict(images, narrative)
+
+
+def main_table_html(html):
+    """
+    Raw html of the table-main price table of a page, from its <table to the
+    matching </table>, found with a quick scan so no parser is needed
+
+    :param html: (str) html of a page under www.pcgs.com/prices/detail/...
+    :return table: (str) html of the table, None if the page has no table
+    """
+    start = MAIN_TABLE_START.search(html)
+    if start is None:
+        return None
+    end = len(html)
+    depth = 0
+    for tag in TABLE_TAG.finditer(html, start.start()):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            end = html.find('>', tag.end()) + 1 or len(html)
+            break
+    return html[start.start():end]
+
+
+def tables_html(html):
+    """
+    :param html: (str) html of a page
+    :return tables: (str) raw html from the first <table to the last </table>
+        of the page, None if the page has no table
+    """
+    start = TABLE_TAG.search(html)
+    if start is None:
+        return None
+    end = len(html)
+    for end_tag in TABLE_END.finditer(html, start.start()):
+        end = end_tag.end()
+    return html[start.start():end]
+
+
+def table_fingerprint(html):
+    """
+    Fingerprint of the table-main price table of a page, see main_table_html.
+    Whitespace is normalized so only changes to the table's markup and text
+    change the fingerprint
+
+    :param html: (str) html of a page under www.pcgs.com/prices/detail/...
+    :return fingerprint: (str) sha1 hex digest, None if the page has no table
+    """
+    table = main_table_html(html)
+    if table is None:
+        return None
+    table = BETWEEN_TAGS.sub('><', table)
+    table = WHITESPACE.sub(' ', table).strip()
+    return hashlib.sha1(table.encode('utf-8')).hexdigest()
+
+
+def price_cell(cell_text):
+    """
+    :param cell_text: (str) text of one price cell
+    :return prices: (tuple) always two prices, None where there is no price
+    """
+    this_cell_prices = cell_text.strip('▲▼').split()
+    # always make prices cell a double for ease
+    # KNOWN ISSUE: in some rare cases, only one price is shown and appears in
+    # the bottom row
+    if len(this_cell_prices) == 0:
+        this_cell_prices = (None, None)
+    elif len(this_cell_prices) == 1:
+        this_cell_prices.append(None)
+    return tuple(this_cell_prices)
+
+
+def coinfacts_dict(images, narrative):
+    # images = all images of the coin on this page
+    # image = the large one on the page, i.e. the first one in the html
+    if len(images) != 0:
+        image = images[0]
+    else:       # no images on page
+        images = None
+        image = None
+    return {'image': image, 'images': images, 'narrative': narrative}
+
+
+_backend = None
+
+
+def get_backend(name=None):
+    """
+    :param name: (str) one of BACKENDS, if None the shared backend is returned,
+        which is lxml if it is installed and bs4 otherwise
+    :return backend: parser backend
+    """
+    global _backend
+    if name == 'lxml':
+        return LxmlBackend()
+    elif name == 'bs4':
+        return Bs4Backend()
+    elif name is not None:
+        raise ValueError(f'Unknown parser backend {name}, choose from '
+                         f'{BACKENDS}')
+    if _backend is None:
+        try:
+            _backend = LxmlBackend()
+        except ImportError:
+            _backend = Bs4Backend()
+    return _backend
+
+
+def set_backend(name):
+    """
+    Choose the backend shared by all scraping functions
+
+    :param name: (str) one of BACKENDS
+    """
+    global _backend
+    _backend = get_backend(name)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+pcgs_batch.py
+
+Batch version of pcgs_query: answer many queries (e.g. a dealer inventory) in
+one run. The price guide is loaded once and the queries are spread over a pool
+of worker processes, results are written as they come in, one JSON object per
+line (NDJSON)
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import sys
+import csv
+import json
+import time
+import argparse
+from multiprocessing import Pool
+
+from pcgs_scraper.price_db import connect
+from pcgs_scraper.records import to_json
+from pcgs_scraper.pcgs_query import query_answer, load_price_guide, \
+    PRICE_GUIDE_FILE
+
+# price guide of this process, set by load_guide, inherited by forked workers
+_guide = None
+
+
+def load_guide(price_guide_path=None, db_path=None):
+    """
+    Load the price guide for answer, once per process
+
+    :param price_guide_path: (str) path to the price guide pkl
+    :param db_path: (str) path to the price guide database, used instead of
+        price_guide_path if given
+    """
+    global _guide
+    if _guide is not None:
+        return      # already loaded, or inherited from the parent process
+    if db_path is not None:
+        _guide = (connect(db_path), None)
+    else:
+        _guide = load_price_guide(price_guide_path)
+
+
+def answer(query, top_k=None):
+    """
+    :param query: (str) one query, as for pcgs_query.py -q
+    :param top_k: (int) only return the best top_k results, None for all
+    :return answer: (dict) see pcgs_query.query_answer
+    """
+    coin_ft, index = _guide
+    return query_answer(query, coin_ft, index, top_k)
+
+
+def answer_item(item):
+    # item: (query, extra fields from the input, top_k), for Pool.imap
+    query, extra, top_k = item
+    query_answer = answer(query, top_k)
+    if extra is not None:
+        query_answer['input'] = extra
+    return query_answer
+
+
+def read_queries(infile, csv_column=None):
+    """
+    :param infile: (file) one query per line, or a csv file if csv_column
+    :param csv_column: (str) name of the csv column with the queries
+    :return: generator of (query, extra), extra is the full csv row as a dict
+        or None for plain lines
+    """
+    if csv_column is not None:
+        for row in csv.DictReader(infile):
+            yield row[csv_column], row
+    else:
+        for line in infile:
+            line = line.strip()
+            if len(line) > 0:
+                yield line, None
+
+
+def run_batch(queries, outfile, price_guide_path=None, db_path=None,
+              processes=None, top_k=None, chunksize=64):
+    """
+    Answer every query and write the answers to outfile as NDJSON, in the same
+    order as the queries
+
+    :param queries: iterable of (query, extra), see read_queries
+    :param outfile: (file) where to write the answers
+    :param price_guide_path: (str) path to the price guide pkl
+    :param db_path: (str) path to the price guide database, used instead of
+        price_guide_path if given
+    :param processes: (int) number of worker processes, defaults to the number
+        of cpus, 1 answers in this process
+    :param top_k: (int) only return the best top_k results per query
+    :param chunksize: (int) queries sent to a worker at a time
+    :return stats: (dict) queries, answered, errors, seconds, queries_per_s
+    """
+    start = time.perf_counter()
+    items = ((query, extra, top_k) for query, extra in queries)
+    if db_path is None:
+        # loaded once here, forked workers share it
+        load_guide(price_guide_path)
+    stats = {'queries': 0, 'answered': 0, 'errors': 0}
+
+    def write(query_answers):
+        for query_answer in query_answers:
+            outfile.write(json.dumps(query_answer, default=to_json) + '\n')
+            stats['queries'] += 1
+            if 'error' in query_answer:
+                stats['errors'] += 1
+            elif len(query_answer['results']) > 0:
+                stats['answered'] += 1
+
+    if processes == 1:
+        load_guide(price_guide_path, db_path)
+        write(map(answer_item, items))
+    else:
+        with Pool(processes, initializer=load_guide,
+                  initargs=(price_guide_path, db_path)) as pool:
+            write(pool.imap(answer_item, items, chunksize=chunksize))
+
+    stats['seconds'] = time.perf_counter() - start
+    stats['queries_per_s'] = stats['queries'] / max(stats['seconds'], 1e-9)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', nargs='?', default='-',
+                        help='file with one query per line, or - for stdin '
+                             '(default)')
+    parser.add_argument('--price_guide', '-p', action='store',
+                        default=PRICE_GUIDE_FILE,
+                        help='path to binary for price guide created with '
+                             'pcgs_scraper')
+    parser.add_argument('--db', '-d', action='store',
+                        help='path to SQLite price guide created with '
+                             'pcgs_scraper, used instead of --price_guide')
+    parser.add_argument('--csv', action='store', metavar='COLUMN',
+                        help='input is a csv file, queries are in this column. '
+                             'The whole row is included in the output')
+    parser.add_argument('--output', '-o', action='store', default='-',
+                        help='where to write the NDJSON results, - for stdout '
+                             '(default)')
+    parser.add_argument('--processes', '-j', action='store', type=int,
+                        help='number of worker processes, defaults to the '
+                             'number of cpus')
+    parser.add_argument('--top', '-k', action='store', type=int,
+                        help='number of results per query, best first, '
+                             'defaults to all')
+    args = parser.parse_args()
+
+    infile = sys.stdin if args.input == '-' else open(args.input, newline='')
+    outfile = sys.stdout if args.output == '-' else open(args.output, 'w')
+    batch_stats = run_batch(read_queries(infile, args.csv), outfile,
+                            price_guide_path=args.price_guide,
+                            db_path=args.db, processes=args.processes,
+                            top_k=args.top)
+    outfile.flush()
+    print(f"{batch_stats['queries']} queries, "
+          f"{batch_stats['answered']} with results, "
+          f"{batch_stats['errors']} not recognized, "
+          f"in {batch_stats['seconds']:.2f}s "
+          f"({batch_stats['queries_per_s']:.1f} queries/s)", file=sys.stderr)
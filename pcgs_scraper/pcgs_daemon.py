@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+pcgs_daemon.py
+
+Query server: loads the price guide and its query index once and answers
+queries over a local HTTP JSON API, so a lookup does not pay for starting
+python and loading the price guide every time
+
+    GET /query?q=1909-S VDB Cent&k=10   answer, see pcgs_query.query_answer
+    GET /stats                          queries served and latency percentiles
+
+Query it with `pcgs_query.py --server http://127.0.0.1:8765 -q ...`
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import deque
+from contextlib import nullcontext
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from pcgs_scraper.price_db import connect
+from pcgs_scraper.records import to_json
+from pcgs_scraper.pcgs_query import query_answer, load_price_guide, \
+    PRICE_GUIDE_FILE
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+PERCENTILES = [50, 90, 99]
+
+
+class LatencyStats:
+    """
+    Latency of the most recent queries, for the percentiles in /stats
+    """
+
+    def __init__(self, window=10000):
+        """
+        :param window: (int) number of most recent queries to keep
+        """
+        self.started = time.time()
+        self.count = 0
+        self.errors = 0
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, latency_s, error=False):
+        with self._lock:
+            self.count += 1
+            self.errors += int(error)
+            self._latencies.append(latency_s)
+
+    def summary(self):
+        """
+        :return summary: (dict) queries served, errors, uptime and latency
+            percentiles in milliseconds over the last `window` queries
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            summary = {'queries': self.count, 'errors': self.errors,
+                       'uptime_s': round(time.time() - self.started, 3)}
+        latency_ms = {}
+        if len(latencies) > 0:
+            for percentile in PERCENTILES:
+                i = min(len(latencies) - 1,
+                        int(len(latencies) * percentile / 100))
+                latency_ms[f'p{percentile}'] = round(latencies[i] * 1000, 3)
+            latency_ms['max'] = round(latencies[-1] * 1000, 3)
+        summary['latency_ms'] = latency_ms
+        return summary
+
+
+class QueryServer(ThreadingHTTPServer):
+    """
+    HTTP server holding the price guide, one thread per request
+    """
+    daemon_threads = True
+
+    def __init__(self, address, price_guide, index=None, verbose=False):
+        """
+        :param address: (tuple) (host, port) to listen on
+        :param price_guide: price guide, see pcgs_query.query_price_guide
+        :param index: query index of price_guide, see load_price_guide
+        :param verbose: (bool) log every request to stderr
+        """
+        super().__init__(address, QueryHandler)
+        self.price_guide = price_guide
+        self.index = index
+        self.verbose = verbose
+        self.stats = LatencyStats()
+        # a sqlite connection can not run two queries at once, the pickled
+        # price guide is only read so it needs no lock
+        self.query_lock = threading.Lock()
+
+    def answer(self, query_str, top_k=None):
+        with self.query_lock if self.index is None else nullcontext():
+            return query_answer(query_str, self.price_guide, self.index, top_k)
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path == '/query':
+            self.query(params)
+        elif url.path == '/stats':
+            self.send_json(200, self.server.stats.summary())
+        else:
+            self.send_json(404, {'error': f'unknown path {url.path}'})
+
+    def query(self, params):
+        start = time.perf_counter()
+        if 'q' not in params:
+            self.send_json(400, {'error': 'missing query parameter q'})
+            return
+        try:
+            top_k = int(params['k'][0]) if 'k' in params else None
+        except ValueError:
+            self.send_json(400, {'error': 'k must be an integer'})
+            return
+        answer = self.server.answer(params['q'][0], top_k)
+        self.send_json(200, answer)
+        self.server.stats.add(time.perf_counter() - start,
+                              error='error' in answer)
+
+    def send_json(self, status, body):
+        data = json.dumps(body, default=to_json).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve(price_guide_path=None, db_path=None, host=DEFAULT_HOST,
+          port=DEFAULT_PORT, verbose=False):
+    """
+    Load the price guide and answer queries until interrupted
+
+    :param price_guide_path: (str) path to the price guide pkl
+    :param db_path: (str) path to the price guide database, used instead of
+        price_guide_path if given
+    :param host: (str) address to listen on, local only by default
+    :param port: (int) port to listen on
+    :param verbose: (bool) log every request to stderr
+    """
+    if db_path is not None:
+        price_guide, index = connect(db_path), None
+    else:
+        price_guide, index = load_price_guide(price_guide_path)
+    server = QueryServer((host, port), price_guide, index, verbose)
+    print(f'Serving queries on http://{host}:{server.server_port}',
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--price_guide', '-p', action='store',
+                        default=PRICE_GUIDE_FILE,
+                        help='path to binary for price guide created with '
+                             'pcgs_scraper')
+    parser.add_argument('--db', '-d', action='store',
+                        help='path to SQLite price guide created with '
+                             'pcgs_scraper, used instead of --price_guide')
+    parser.add_argument('--host', action='store', default=DEFAULT_HOST,
+                        help=f'address to listen on, default {DEFAULT_HOST}')
+    parser.add_argument('--port', action='store', type=int,
+                        default=DEFAULT_PORT,
+                        help=f'port to listen on, default {DEFAULT_PORT}')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='log every request')
+    args = parser.parse_args()
+
+    serve(args.price_guide, args.db, args.host, args.port, args.verbose)
@@ -11,128 +11,332 @@ twitter: @ryanamannion
 """
 import time
 import pickle
-from tqdm import tqdm
-from bs4 import BeautifulSoup
+import argparse
+from os.path import isfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-from pcgs_scraper.utils import non_ns_children, request_page
+from pcgs_scraper.config import data_path, ensure_parent, base_url
+from pcgs_scraper.utils import request_page, pace
+from pcgs_scraper.parsers import get_backend, set_backend, BACKENDS
+from pcgs_scraper.cache import PageCache, DEFAULT_CACHE_DIR
+from pcgs_scraper.client import PCGSClient, set_client
+from pcgs_scraper.journal import open_journal, dump_list
+from pcgs_scraper.ratelimit import HostRateLimiter, AdaptiveRateLimiter, \
+    get_limiter, set_limiter, MIN_RATE, MAX_RATE
 from pcgs_scraper.pcgs_prices import get_urls
+from pcgs_scraper.metrics import get_metrics, write_metrics
 
-URL = "https://www.pcgs.com"
-URL_NOLOOKUP = "https://www.pcgs.com/pcgsnolookup/"
+URL = base_url()        # https://www.pcgs.com unless PCGS_BASE_URL is set
+URL_NOLOOKUP = f"{URL}/pcgsnolookup/"
+NUMS_JOURNAL = data_path('number_data.journal')
+NUMS_FILE = data_path('number_data.pkl')
+COINFACTS_KEYS = ['image', 'images', 'narrative']
+# coinfacts of this many of the latest urls are kept to copy to repeats
+RECENT_COINFACTS = 1024
 
 
-def scrape_coinfacts(url):
+def scrape_coinfacts(url, backend=None, limiter=None):
     """
+    Scrape images and narrative of a coin from its coinfacts page
 
-    :param coinfacts_url:
-    :return:
+    :param url: (str) coinfacts url of the coin
+    :param backend: parser backend, see pcgs_scraper.parsers, defaults to the
+        shared backend
+    :param limiter: (HostRateLimiter) rate budget to wait on before the
+        request, defaults to the shared one (v0.0.5: instead of sleeping 2s)
+    :return coinfacts: (dict) image, images and narrative of the coin
     """
-    time.sleep(2)
+    if backend is None:
+        backend = get_backend()
+    pace(url, limiter=limiter)
     page = request_page(url)
-    soup = BeautifulSoup(page.text, 'html.parser')
-    images_html = soup.find_all('img')
-    filtered_images = []
-    for image_html in images_html:
-        if 'alt' not in image_html.attrs.keys():
-            continue
-        alt = image_html.attrs['alt']
-        if "logo" in alt:
-            continue        # no logos
-        if "PCGS" in alt:
-            filtered_images.append(image_html)
-    # images = all images of the coin on this page
-    # image = the large one on the page, i.e. the first one in the html
-    images = [(i.attrs['data-src'], i.attrs['alt'].strip()) for i in filtered_images]
-    if len(images) != 0:
-        image = images[0]
-    else:       # no images on page
-        images = None
-        image = None
-    narrative_html = soup.find(id="sectionNarrative")
-    if narrative_html is None:
-        narrative = None
-    else:
-        narrative = narrative_html.text
-    return {'image': image, 'images': images, 'narrative': narrative}
+    start = time.perf_counter()
+    coinfacts = backend.coinfacts(page.text)
+    get_metrics().observe('pcgs_parse_seconds', time.perf_counter() - start,
+                          page='coinfacts')
+    return coinfacts
 
 
-def scrape_nums(url, delay_s=25):
+class RecentCoinfacts(OrderedDict):
+    """
+    coinfacts_url -> coinfacts of the latest `size` urls fetched, the oldest
+    are dropped so memory does not grow with the catalog
+    """
+
+    def __init__(self, size=RECENT_COINFACTS):
+        super().__init__()
+        self.size = size
+
+    def __setitem__(self, url, coinfacts):
+        super().__setitem__(url, coinfacts)
+        self.move_to_end(url)
+        if len(self) > self.size:
+            self.popitem(last=False)
+
+
+def enrich_rows(rows, workers=4, limiter=None, backend=None, seen=None):
+    """
+    Fill in image, images and narrative of number rows from their coinfacts
+    pages. Pages are fetched by a pool of workers that share one rate budget,
+    and each coinfacts url is only fetched once
+
+    :param rows: (list(dict)) rows from scrape_nums, updated in place
+    :param workers: (int) max number of coinfacts pages fetched at once
+    :param limiter: (HostRateLimiter) rate budget, defaults to the global one
+    :param backend: parser backend, see pcgs_scraper.parsers
+    :param seen: (dict) coinfacts_url -> coinfacts already fetched, share it
+        between calls to not fetch the same url again, e.g. a RecentCoinfacts
+    :return rows: the same rows
+    """
+    if limiter is None:
+        limiter = get_limiter()
+    if seen is None:
+        seen = {}
+
+    # dict keeps order and drops repeats, seen may drop urls as it is
+    # updated so the coinfacts of these rows are collected here
+    by_url = {}
+    for row in rows:
+        url = row['coinfacts_url']
+        if url not in by_url:
+            by_url[url] = seen.get(url)
+    todo = [url for url, coinfacts in by_url.items() if coinfacts is None]
+    if len(todo) > 0:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            fetched = executor.map(
+                lambda url: scrape_coinfacts(url, backend, limiter), todo)
+            for url, coinfacts in zip(todo, fetched):
+                by_url[url] = seen[url] = coinfacts
+
+    for row in rows:
+        coinfacts = by_url[row['coinfacts_url']]
+        for key in COINFACTS_KEYS:
+            row[key] = coinfacts[key]
+    return rows
+
+
+def scrape_nums(url, delay_s=None, backend=None, enrich=True, workers=4,
+                limiter=None, seen=None):
     """
     Scrape PCGS numbers from a single given pcgs.com/pcgsnolookup url
 
     :param url: (str) url to pcgsnolookup page
     :param delay_s: time to wait to avoid error code 429
-        this means that each subcategory will wait delay_s num of seconds
+        this means that each subcategory will wait delay_s num of seconds.
+        v0.0.5: None (the default, was 25) to wait as long as the rate budget
+        says instead, see utils.pace
+    :param backend: parser backend, see pcgs_scraper.parsers, defaults to the
+        shared backend
+    :param enrich: (bool) scrape coinfacts pages for image, images and
+        narrative, if False these are None and can be filled in later with
+        enrich_rows
+    :param workers: (int) max number of coinfacts pages fetched at once
+    :param limiter: (HostRateLimiter) rate budget for this page and its
+        coinfacts pages, defaults to the global one
+    :param seen: (dict) coinfacts already fetched, see enrich_rows
     :return rows: (list(dict)) free table of all rows containing pcgs_nums on
         this page
     """
-    time.sleep(delay_s)
+    if backend is None:
+        backend = get_backend()
+    pace(url, delay_s, limiter)
     page = request_page(url)
-    soup = BeautifulSoup(page.text, 'html.parser')
-    table_rows = soup.find_all('tr')
 
+    start = time.perf_counter()
     rows = []
-    for table_row in table_rows:
-        # add some variables to track progress
-        number_row = True           # init value of flag is True
-        all_cells_filled = False    # True once all 3 columns filled
-
-        for cell in non_ns_children(table_row, 'children'):
-            if number_row:  # since init is True, always runs first cell
-                if 'data-title' in cell.attrs:
-                    if 'PCGS #' in cell.attrs['data-title']:
-                        number_row = True       # set flag true
-                        pcgs_num = cell.text.strip()
-                        coinfacts_url = URL + cell.contents[0].attrs['href']
-                    elif 'Designation' in cell.attrs['data-title']:
-                        designation = cell.text.strip()
-                    elif 'Description' in cell.attrs['data-title']:
-                        description = cell.text.strip()
-                        all_cells_filled = True
-                else:       # cell is not in a number row
-                    number_row = False
-                    # one non 'data-title' cell kills a row
-                    # this should save time by not having to check each cell in
-                    # a row we know does not contain data-title information,
-                    # like a header
-
-        if all_cells_filled:
-            coinfacts = scrape_coinfacts(coinfacts_url)
-            row_cells = {
-                'pcgs_num': pcgs_num,
-                'desig': designation,
-                'description': description,
-                'coinfacts_url': coinfacts_url,
-                'image': coinfacts['image'],
-                'images': coinfacts['images'],
-                'narrative': coinfacts['narrative']
-            }
-            rows.append(row_cells)
+    for number_row in backend.number_rows(page.text):
+        row_cells = {
+            'pcgs_num': number_row['pcgs_num'],
+            'desig': number_row['desig'],
+            'description': number_row['description'],
+            'coinfacts_url': URL + number_row['coinfacts_href'],
+            'image': None,
+            'images': None,
+            'narrative': None
+        }
+        rows.append(row_cells)
+    metrics = get_metrics()
+    metrics.observe('pcgs_parse_seconds', time.perf_counter() - start,
+                    page='pcgsnolookup')
+    metrics.observe('pcgs_rows_per_page', len(rows), page='pcgsnolookup')
 
+    if enrich:
+        enrich_rows(rows, workers=workers, limiter=limiter, backend=backend,
+                    seen=seen)
     return rows
 
 
-def main():
+def scraped_path(filepath=NUMS_FILE):
+    """
+    :param filepath: (str) number data pkl
+    :return path: (str) file of the coinfacts urls already scraped for it
+    """
+    return filepath + '.coinfacts'
+
+
+def load_scraped(filepath=NUMS_FILE, rows=()):
+    """
+    :param filepath: (str) number data pkl
+    :param rows: (list(dict)) its rows, if the file of scraped urls is missing
+        (the number data was saved by v0.0.4 or by work_queue.finalize) the
+        urls of rows with any coinfacts count as scraped
+    :return urls: (set(str)) coinfacts urls already scraped
+    """
+    path = scraped_path(filepath)
+    if isfile(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    return {row['coinfacts_url'] for row in rows
+            if any(row[key] is not None for key in COINFACTS_KEYS)}
+
+
+def save_scraped(urls, filepath=NUMS_FILE):
+    """
+    :param urls: (set(str)) coinfacts urls already scraped, see load_scraped
+    :param filepath: (str) number data pkl they were scraped for
+    """
+    with open(ensure_parent(scraped_path(filepath)), 'wb') as f:
+        pickle.dump(set(urls), f)
+
+
+def enrich_file(filepath=NUMS_FILE, workers=4):
+    """
+    Fill in coinfacts for rows of a number data file scraped without them, the
+    file is overwritten. Metrics are saved like main's. The coinfacts urls
+    scraped are saved next to the file (see scraped_path), so coins whose
+    coinfacts page really is empty are not fetched again on the next run
+
+    :param filepath: (str) number data pkl from main
+    :param workers: (int) max number of coinfacts pages fetched at once
+    """
+    all_data = pickle.load(open(filepath, 'rb'))
+    scraped = load_scraped(filepath, all_data)
+    missing = [row for row in all_data if row['coinfacts_url'] not in scraped]
+    print(f'Scraping coinfacts for {len(missing)} rows...')
+    get_metrics().reset()
+    enrich_rows(missing, workers=workers, seen=RecentCoinfacts())
+    get_limiter().save()
+    pickle.dump(all_data, open(filepath, 'wb'))
+    save_scraped(scraped.union(row['coinfacts_url'] for row in missing),
+                 filepath)
+    print(f'Saved to {filepath}')
+    prom_path, json_path = write_metrics('pcgs_nums')
+    print(f'Saved metrics to {prom_path} and {json_path}')
+
+
+def main(journal_path=NUMS_JOURNAL, enrich=True, workers=4):
     """
     scrape coin categories and their href urls from the main number lookup url,
     use those to scrape the PCGS numbers and other information for each type
-    from each category's detail page. Save as pkl file
+    from each category's detail page. Each subcategory is journaled as soon as
+    it is scraped, a restarted run skips subcategories already in the journal
+    (resume it with the same enrich). Save as pkl file once all are done, with
+    the coinfacts urls scraped next to it for enrich_file. Metrics of the
+    scrape are saved to data/pcgs_nums.prom and data/pcgs_nums_metrics.json,
+    see pcgs_scraper.metrics
+
+    :param journal_path: (str) journal file, removed once the pickle is saved
+    :param enrich: (bool) scrape coinfacts pages too, see scrape_nums
+    :param workers: (int) max number of coinfacts pages fetched at once
     """
+    from tqdm import tqdm
+
+    get_metrics().reset()
+    limiter = get_limiter()
+    seen = RecentCoinfacts()     # shared by all subcategories
     urls = get_urls(URL_NOLOOKUP)
-    all_data = []
+    journal = open_journal(journal_path)
+    done = journal.done()
+    if len(done) > 0:
+        print(f"Resuming from {journal_path}, {len(done)} subcategories "
+              f"already scraped")
     print('Scraping PCGS Number Data...')
     for i, (category, subcategories) in enumerate(urls.items()):
         print(f"\tStarting Category {i+1}/{len(urls.items())}: {category}...")
         for subcat_name, subcat_url in tqdm(subcategories):
-            time.sleep(1.0)
-            subcat_data = scrape_nums(subcat_url)
-            all_data.extend(subcat_data)
+            if subcat_url in done:
+                continue
+            subcat_data = scrape_nums(subcat_url, enrich=enrich,
+                                      workers=workers, limiter=limiter,
+                                      seen=seen)
+            journal.append(subcat_url, subcat_data)
+    limiter.save()
     print('Done with PCGS Number Data! Saving...')
 
-    pickle.dump(all_data, open('data/number_data.pkl', 'wb'))
+    scraped = set()
+
+    def pages():
+        for rows in journal.ordered(subcat_url for subcategories in
+                                    urls.values()
+                                    for _, subcat_url in subcategories):
+            if enrich:
+                scraped.update(row['coinfacts_url'] for row in rows)
+            yield rows
 
-    print('Saved to data/number_data.pkl')
+    # same order as scraping one subcategory after another, one subcategory
+    # in memory at a time
+    dump_list(pages(), NUMS_FILE)
+    save_scraped(scraped)
+    journal.remove()
+
+    print(f'Saved to {NUMS_FILE}')
+    prom_path, json_path = write_metrics('pcgs_nums')
+    print(f'Saved metrics to {prom_path} and {json_path}')
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cache', action='store', nargs='?',
+                        const=DEFAULT_CACHE_DIR,
+                        help="cache pages on disk and revalidate them with "
+                             "pcgs.com instead of downloading them again, "
+                             f"defaults to {DEFAULT_CACHE_DIR}")
+    parser.add_argument('--offline', action='store_true',
+                        help="only serve pages from the --cache directory, "
+                             "never touch the network")
+    parser.add_argument('--parser', action='store', choices=BACKENDS,
+                        help="html parser backend, defaults to lxml if it is "
+                             "installed and bs4 otherwise")
+    parser.add_argument('--no_coinfacts', action='store_true',
+                        help="skip scraping coinfacts images and narratives, "
+                             "fill them in later with --enrich")
+    parser.add_argument('--enrich', action='store_true',
+                        help=f"only scrape coinfacts for rows of {NUMS_FILE} "
+                             f"that do not have them yet")
+    parser.add_argument('--workers', '-w', action='store', type=int,
+                        default=4,
+                        help="max number of coinfacts pages fetched at once, "
+                             "defaults to 4")
+    parser.add_argument('--rate', '-r', action='store', type=float,
+                        help="fixed max requests per second to pcgs.com, "
+                             "shared by all workers. By default the rate "
+                             "adapts: it grows while pages load and is cut on "
+                             "a 429")
+    parser.add_argument('--min_rate', action='store', type=float,
+                        default=MIN_RATE,
+                        help="the adaptive rate is never cut below this many "
+                             f"requests per second, defaults to {MIN_RATE}")
+    parser.add_argument('--max_rate', action='store', type=float,
+                        default=MAX_RATE,
+                        help="the adaptive rate never grows above this many "
+                             f"requests per second, defaults to {MAX_RATE}")
+    args = parser.parse_args()
+
+    if args.rate is not None:
+        set_limiter(HostRateLimiter(args.rate))
+    else:
+        set_limiter(AdaptiveRateLimiter(floor=args.min_rate,
+                                        ceiling=args.max_rate))
+
+    if args.parser is not None:
+        set_backend(args.parser)
+
+    if args.cache is not None or args.offline:
+        set_client(PCGSClient(cache=PageCache(args.cache or DEFAULT_CACHE_DIR),
+                              offline=args.offline))
+
+    if args.enrich:
+        enrich_file(workers=args.workers)
+    else:
+        main(enrich=not args.no_coinfacts, workers=args.workers)
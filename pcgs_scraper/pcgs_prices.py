@@ -12,142 +12,276 @@ twitter: @ryanamannion
 import json
 import time
 import pickle
+import asyncio
 import argparse
-from tqdm import tqdm
+from itertools import groupby, islice
+from os.path import isfile, basename, getmtime
 from datetime import datetime
-from collections import defaultdict
-
-import ft
-from bs4 import BeautifulSoup
-
-from pcgs_scraper.utils import request_page, non_ns_children
-
-INDEX = 'https://www.pcgs.com'
-PRICES = 'https://www.pcgs.com/prices'
+from concurrent.futures import ThreadPoolExecutor
+
+from pcgs_scraper.config import data_path, ensure_parent, base_url
+from pcgs_scraper.utils import request_page, pace
+from pcgs_scraper.parsers import get_backend, set_backend, BACKENDS
+from pcgs_scraper.cache import PageCache, DEFAULT_CACHE_DIR
+from pcgs_scraper.client import PCGSClient, get_client, set_client
+from pcgs_scraper.journal import Journal, open_journal, dump_list, \
+    dump_dict
+from pcgs_scraper.extsort import sorted_groups, RUN_SIZE
+from pcgs_scraper.records import PriceRow, MergedEntry, to_json
+from pcgs_scraper.fingerprints import PageFingerprints, load_changed, commit
+from pcgs_scraper.ratelimit import HostRateLimiter, AdaptiveRateLimiter, \
+    get_limiter, set_limiter, MIN_RATE, MAX_RATE
+from pcgs_scraper.metrics import get_metrics, write_metrics
+
+INDEX = base_url()      # https://www.pcgs.com unless PCGS_BASE_URL is set
+PRICES = f'{INDEX}/prices'
 BINS = ['grades-1-20', 'grades-25-60', 'grades-61-70']
 GRADES = [1, 2, 3, 4, 6, 8, 10, 12, 15, 20, 25, 30, 35, 40, 45, 50, 53, 55, 58,
           60, 61, 62, 63, 64, 65, 66, 67, 68, 69, 70]
+PRICES_JOURNAL = data_path('pcgs_prices.journal')
+PRICE_GUIDE_FILE = data_path('scraped_pcgs_prices.pkl')
+PRICE_GUIDE_JSON = data_path('scraped_pcgs_prices.json')
+PRICE_KEYS_FILE = data_path('price_keys.npy')
+PRICE_CENTS_FILE = data_path('price_cents.npy')
+MALFORMED_FILE = data_path('malformed_price_groups.jsonl')
+# pcgs numbers per chunk of PRICE_GUIDE_FILE, see scraper.load_inputs
+GUIDE_CHUNK = 1000
+SNAPSHOT_TIME_FORMAT = "%d-%m-%Y-%H:%M:%S"
 
 
 ######################
 # SCRAPING FUNCTIONS #
 ######################
-def get_urls(page_url):
+def get_urls(page_url, backend=None):
     """
     Gets urls for each subcategory on the /prices page, returns them as a
     dictionary where the keys are the categories, and the values are a tuple of
     (subcategory_name, subcategory_url)
 
+    :param backend: parser backend, see pcgs_scraper.parsers, defaults to the
+        shared backend
     :return urls_by_category: (dict) dict of all urls on /prices page
     """
-    # prep page html and soup
+    if backend is None:
+        backend = get_backend()
     page = request_page(page_url)
-    soup = BeautifulSoup(page.text, 'html.parser')
-
-    urls_by_category = defaultdict(list)
-
-    # get all category urls from /prices page
-    # first: get two columns which contain the boxes for each category
-    columns = soup.find_all('div', class_='col-xs-12 col-sm-6')
-    for column in columns:
-        for box in non_ns_children(column, 'children'):
-            for box_element in non_ns_children(box, 'children'):
-                if 'class' in box_element.attrs and \
-                        'coin-heading' in box_element.attrs['class']:
-                    heading = box_element.text.strip()
-                elif box_element.name == 'ul':
-                    for list_item in non_ns_children(box_element, 'children'):
-                        # presumably only has one tag as a child, <a>
-                        category_href = list_item.contents[0].attrs['href']
-                        category_url = INDEX + category_href
-                        category_name = list_item.contents[0].text.strip()
-                        this_category = (category_name, category_url)
-                        urls_by_category[heading].append(this_category)
-    # turn into a regular dict
-    return dict(urls_by_category)
-
-
-def get_prices(url, delay_s=1.5):
+    return backend.category_urls(page.text, INDEX)
+
+
+def get_prices(url, delay_s=None, backend=None, fingerprints=None,
+               limiter=None):
     """
     For a given URL, extract price information
 
+    v0.0.5: waits on the adaptive rate budget instead of a fixed 1.5s sleep
+
     :param url: url for a page under www.pcgs.com/prices/detail/...
-    :param delay_s: seconds to sleep to avoid response status 429, 1.5s worked
-        in my testing, though I did not try any lower
+    :param delay_s: seconds to sleep to avoid response status 429, None to
+        wait as long as the rate budget says, see utils.pace
+    :param backend: parser backend, see pcgs_scraper.parsers, defaults to the
+        shared backend
+    :param fingerprints: (PageFingerprints) if given, the page is only parsed
+        if its table changed since the previous scrape
+    :param limiter: (HostRateLimiter) rate budget, defaults to the shared one
     :return prices: a list of dictionaries representing each row in the table
     """
-
-    # 1: prep for task
-    time.sleep(delay_s)
+    pace(url, delay_s, limiter)
     page = request_page(url)
-    soup = BeautifulSoup(page.text, 'html.parser')
+    if fingerprints is not None:
+        return fingerprints.parse(
+            page.text, url, lambda html, url: parse_prices(html, url, backend))
+    return parse_prices(page.text, url, backend=backend)
+
+
+def parse_prices(html, url, backend=None):
+    """
+    Extract price information from the html of a price detail page
+
+    v0.0.5: parse time and rows are recorded, see pcgs_scraper.metrics
+
+    :param html: (str) html of a page under www.pcgs.com/prices/detail/...
+    :param url: url the html came from, used to determine the grade bin
+    :param backend: parser backend, see pcgs_scraper.parsers, defaults to the
+        shared backend
+    :return prices: a list of PriceRow (see records.py) representing each row
+        in the table
+    """
+    if backend is None:
+        backend = get_backend()
 
-    # 2: determine which grades we are dealing with in the table
+    # determine which grades we are dealing with in the table
+    grades = None
     for grade_bin in BINS:
         if grade_bin in url:
             grades = grade_bin
 
-    # 3: find the table
-    table = soup.find('table', class_='table-main')
-    if table is None:
-        # some pages like counterstamped colonials have no price information,
-        # would crash script otherwise
-        return []
-
-    # 4: loop through table elements and scrape prices
-    prices = []
-    for element in non_ns_children(table, 'children'):
-        if element.name == 'tbody':
-            for child in non_ns_children(element, 'children'):
-                # table has lots of elements, but the ones which contain coin
-                # prices are colored bg-pale and bg-light, this makes IDing
-                # them a lot easier
-                if 'class' in child.attrs:      # check if it has class attr
-                    if 'bg-pale' in child.attrs['class'] \
-                            or 'bg-light' in child.attrs['class']:
-                        # each row has 13 cells with two possible internal rows
-                        cells = non_ns_children(child, 'children')
-                        row_prices = []     # to collect all prices in this row
-                        for i, cell in enumerate(cells):
-                            if i == 0:          # cell 0 is the pcgs number
-                                pcgs_num = cell.text.strip()
-                                if len(pcgs_num) == 0:
-                                    pcgs_num = None
-                            elif i == 1:        # cell 1 is the description
-                                description = cell.text.strip()
-                            elif i == 2:        # cell 2 is the designation
-                                desig = cell.text.split()
-                            elif 3 <= i <= 12:  # rest are prices
-                                this_cell_prices = cell.text.strip('▲▼').split()
-                                # always make prices cell a double for ease
-                                # KNOWN ISSUE: in some rare cases, only one
-                                # price is shown and appears in the bottom row
-                                if len(this_cell_prices) == 0:
-                                    this_cell_prices = (None, None)
-                                elif len(this_cell_prices) == 1:
-                                    this_cell_prices.append(None)
-                                this_cell_prices = tuple(this_cell_prices)
-                                row_prices.append(this_cell_prices)
-                        # after each cell is scraped, turn into a dict & append
-                        row = {
-                            'pcgs_num': pcgs_num,
-                            'description': description,
-                            'desig': desig,
-                            'grades': grades,
-                            'prices': row_prices,
-                            'url': url
-                        }
-                        prices.append(row)
-    return prices
-
-
-def scrape_all():
+    start = time.perf_counter()
+    rows = [PriceRow(row) for row in backend.price_rows(html, grades, url)]
+    metrics = get_metrics()
+    metrics.observe('pcgs_parse_seconds', time.perf_counter() - start,
+                    page='prices/detail')
+    metrics.observe('pcgs_rows_per_page', len(rows), page='prices/detail')
+    return rows
+
+
+def bin_urls(subcat_url):
+    """
+    Each subcategory has one price page per grade bin, get all of their urls
+
+    :param subcat_url: subcategory url as scraped by get_urls
+    :return urls: list of urls, one per grade bin in BINS
+    """
+    urls = []
+    for grade_bin in BINS:
+        # url defaults to most-active page first, but we want all the
+        # grade information
+        this_bin_url = subcat_url.replace('most-active', grade_bin)
+        this_bin_url += '?pn=1&ps=-1'       # show all prices one page
+        urls.append(this_bin_url)
+    return urls
+
+
+async def get_prices_async(url, limiter, executor, fingerprints=None,
+                           slots=None):
+    """
+    Async version of get_prices, the request and the parsing are run in the
+    executor so many pages can be in flight at once. Instead of a fixed sleep,
+    waits on limiter to keep the request rate to the host under budget
+
+    :param url: url for a page under www.pcgs.com/prices/detail/...
+    :param limiter: (HostRateLimiter) shared by all requests of the scrape
+    :param executor: (concurrent.futures.Executor) runs the blocking calls
+    :param fingerprints: (PageFingerprints) see get_prices
+    :param slots: (asyncio.Semaphore) held from waiting on limiter until the
+        page is fetched, so only requests in flight have a place in the
+        limiter's line and a cut of the rate (or a pause) slows all the rest
+    :return prices: a list of dictionaries representing each row in the table
+    """
+    loop = asyncio.get_running_loop()
+    if slots is None:
+        slots = asyncio.Semaphore(1)     # this page alone
+    async with slots:
+        if not get_client().offline:
+            await limiter.acquire_async(url)
+        page = await loop.run_in_executor(executor, request_page, url)
+    if fingerprints is not None:
+        return await loop.run_in_executor(executor, fingerprints.parse,
+                                          page.text, url, parse_prices)
+    return await loop.run_in_executor(executor, parse_prices, page.text, url)
+
+
+async def scrape_subcategory_async(subcat_url, limiter, executor, journal,
+                                   done, fingerprints=None, slots=None):
+    """
+    Fetch all grade bin pages of a subcategory in parallel, journaling each bin
+    as soon as it is scraped
+
+    :param journal: (Journal) where finished bins are saved
+    :param done: (set) urls already in the journal, these are skipped
+    :param fingerprints: (PageFingerprints) see get_prices
+    :param slots: (asyncio.Semaphore) see get_prices_async
+    """
+    async def scrape_bin(url):
+        bin_prices = await get_prices_async(url, limiter, executor,
+                                            fingerprints, slots)
+        journal.append(url, bin_prices)
+
+    await asyncio.gather(*[scrape_bin(url) for url in bin_urls(subcat_url)
+                           if url not in done])
+
+
+async def scrape_categories_async(urls_by_category, concurrency, limiter,
+                                  journal, done, fingerprints=None):
+    """
+    Scrape every subcategory with up to `concurrency` requests in flight and
+    within the rate budget of limiter
+
+    :param urls_by_category: output of get_urls
+    :param concurrency: (int) max number of pages being fetched at once
+    :param limiter: (HostRateLimiter) rate budget per host
+    :param journal: (Journal) where finished bins are saved
+    :param done: (set) urls already in the journal, these are skipped
+    :param fingerprints: (PageFingerprints) see get_prices
+    """
+    from tqdm import tqdm
+
+    # every subcategory of a category is started at once, only `concurrency`
+    # of their pages may wait on the limiter or be fetched at a time
+    slots = asyncio.Semaphore(concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for i, (category, subcategories) in \
+                enumerate(urls_by_category.items()):
+            print(f"\tBeginning category {i + 1}/{len(urls_by_category)}:"
+                  f" {category}")
+            progress = tqdm(total=len(subcategories))
+
+            async def scrape_one(subcat_url):
+                await scrape_subcategory_async(subcat_url, limiter, executor,
+                                               journal, done, fingerprints,
+                                               slots)
+                progress.update()
+
+            await asyncio.gather(*[scrape_one(url) for _, url in subcategories])
+            progress.close()
+
+
+def scrape_order(urls_by_category):
+    """
+    :param urls_by_category: output of get_urls
+    :return: generator of every grade bin url in the order a sequential
+        scrape visits them
+    """
+    for subcategories in urls_by_category.values():
+        for _, subcat_url in subcategories:
+            yield from bin_urls(subcat_url)
+
+
+def collect_journal(journal, urls_by_category):
+    """
+    Put the rows of every journaled grade bin in the order a sequential scrape
+    would have produced them, no matter what order they were scraped in
+
+    v0.0.5: a generator of the rows of each page, read from the journal one
+    page at a time, write them with journal.dump_list
+
+    :param journal: (Journal) journal of a finished scrape
+    :param urls_by_category: output of get_urls
+    :return: generator of the list of rows of each grade bin page
+    """
+    return journal.ordered(scrape_order(urls_by_category))
+
+
+def scrape_all(concurrency=None, rate=None, journal_path=PRICES_JOURNAL,
+               incremental=False):
     """
     Entire scraping process in one call:
         Step 1: Load www.pcgs.com/prices and get all URL information
-        Step 2: Load each URL and scrape prices from its table
+        Step 2: Load each URL and scrape prices from its table, journaling
+            each page as it is scraped
         Step 3: Save price information to pickle
+
+    If a previous run crashed, its journal is picked up and the pages already
+    in it are not scraped again. Metrics of the scrape are saved to
+    data/pcgs_prices.prom and data/pcgs_prices_metrics.json, see
+    pcgs_scraper.metrics
+
+    :param concurrency: (int) if given, scrape with asyncio and up to this many
+        pages in flight at once, otherwise scrape one page at a time
+    :param rate: (float) fixed requests per second budget to pcgs.com, made
+        the shared budget so the client reports answers to the limiter that
+        paces the requests. None for the shared budget as it is, adaptive by
+        default, see pcgs_scraper.ratelimit
+    :param journal_path: (str) journal file, removed once the pickle is saved
+    :param incremental: (bool) only parse pages whose price table changed
+        since the scrape merged into the price guide, the fingerprints are
+        saved next to the pkl, see pcgs_scraper.fingerprints
+    :return filename: (str) unprocessed pkl the rows were saved to
     """
+    from tqdm import tqdm
+
+    get_metrics().reset()
+    if rate is not None:
+        set_limiter(HostRateLimiter(rate))
 
     # Step 1
     print(f"Getting URLs from {PRICES}...")
@@ -155,35 +289,191 @@ def scrape_all():
     print("Success!")
 
     # Step 2
+    journal = open_journal(journal_path)
+    done = journal.done()
+    if len(done) > 0:
+        print(f"Resuming from {journal_path}, {len(done)} pages already "
+              f"scraped")
+    fingerprints = PageFingerprints.load() if incremental else None
+    limiter = get_limiter()
     print("Scraping price data by category...")
-    prices = []
-    for i, (category, subcategories) in enumerate(urls_by_category.items()):
-        print(f"\tBeginning category {i + 1}/{len(urls_by_category.items())}:"
-              f" {category}")
-        for subcat, subcat_url in tqdm(subcategories):
-            for grade_bin in BINS:
-                # url defaults to most-active page first, but we want all the
-                # grade information
-                this_bin_url = subcat_url.replace('most-active', grade_bin)
-                this_bin_url += '?pn=1&ps=-1'       # show all prices one page
-                this_bin_prices = get_prices(this_bin_url, delay_s=1.0)
-                prices.extend(this_bin_prices)
+    if concurrency is not None:
+        asyncio.run(scrape_categories_async(urls_by_category, concurrency,
+                                            limiter, journal, done,
+                                            fingerprints))
+    else:
+        for i, (category, subcategories) in \
+                enumerate(urls_by_category.items()):
+            print(f"\tBeginning category {i + 1}/{len(urls_by_category)}:"
+                  f" {category}")
+            for subcat, subcat_url in tqdm(subcategories):
+                for this_bin_url in bin_urls(subcat_url):
+                    if this_bin_url in done:
+                        continue
+                    this_bin_prices = get_prices(this_bin_url,
+                                                 fingerprints=fingerprints,
+                                                 limiter=limiter)
+                    journal.append(this_bin_url, this_bin_prices)
+    limiter.save()
     print("Success!")
 
     # Step 3
     today = datetime.now()
-    current_time = today.strftime("%d-%m-%Y-%H:%M:%S")
-    filename = f'data/pcgs_prices_unprocessed-{current_time}.pkl'
+    current_time = today.strftime(SNAPSHOT_TIME_FORMAT)
+    filename = data_path(f'pcgs_prices_unprocessed-{current_time}.pkl')
     print(f"Saving price data to {filename}")
-    pickle.dump(prices, open(filename, 'wb'))
+    if fingerprints is None:
+        # one page of rows in memory at a time
+        dump_list(collect_journal(journal, urls_by_category), filename)
+    else:
+        scraped = journal.done()
+        for url in scraped:
+            fingerprints.add_unknown(url)       # resumed pages
+        print(f"{len(fingerprints.changed)}/{len(scraped)} pages changed "
+              f"since the scrape merged into the price guide")
+        urls = [url for url in scrape_order(urls_by_category)
+                if url in scraped]
+        locations = dump_list(journal.ordered(urls), filename)
+        fingerprints.save(filename, dict(zip(urls, locations)))
+    journal.remove()
     print(f"Success!")
+    prom_path, json_path = write_metrics('pcgs_prices')
+    print(f"Saved metrics to {prom_path} and {json_path}")
     return filename
 
 
 ########################
 # PROCESS SCRAPED DATA #
 ########################
-def merge_grade_bins(filepath):
+def merge_entries(pcgs_num, entries):
+    """
+    Combine the rows of every grade bin of a pcgs number into one entry
+
+    v0.0.5: raises ValueError instead of failing an assert, returns a compact
+    MergedEntry that works like the dict it used to return, see records.py
+
+    :param pcgs_num: (str) PCGS Number
+    :param entries: (list(dict)) rows from scrape_all with that pcgs number
+    :return merged_entry: (MergedEntry) entry for the price guide
+    :raises ValueError: if the rows are not one row of each grade bin with the
+        right number of prices
+    """
+    # 1: merge price information into a single dict that points from # to $
+    grades = [entry['grades'] for entry in entries]
+    if sorted(grades) != sorted(BINS):
+        raise ValueError(f'Expected one row of each grade bin, got '
+                         f'{len(entries)}: {", ".join(map(str, grades))}')
+    # make absolutely certain that prices are in the correct order, overkill
+    temp_order = [None, None, None]
+    desigs = []
+    for entry in entries:
+        desigs.append(entry['desig'])       # save desig for step 2
+        temp_order[BINS.index(entry['grades'])] = entry['prices']
+    this_num_prices = []        # prices for this pcgs number
+    for grade_bin in temp_order:
+        for price in grade_bin:
+            this_num_prices.append(price)
+    if len(this_num_prices) != len(GRADES):
+        raise ValueError(f'Wrong number of grades for PCGS#{pcgs_num}: '
+                         f'{len(this_num_prices)}')
+    price_by_grade = dict(zip(GRADES, this_num_prices))
+
+    # 2: Ensure that the desig is always two place if at least one is
+    merged_desig = []       # start with len == 0
+    for desig in desigs:
+        if len(desig) > len(merged_desig):   # longest desig wins
+            merged_desig = desig
+
+    merged_entry = MergedEntry(
+        pcgs_num=pcgs_num,
+        desig=merged_desig,
+        prices=price_by_grade,
+        merged_from=entries,
+    )
+    return merged_entry
+
+
+def snapshot_time(filepath):
+    """
+    :param filepath: (str) file saved by scrape_all, named
+        pcgs_prices_unprocessed-<time>.pkl
+    :return time: (datetime) when it was saved, from its name, or its
+        modification time if the name has no time
+    """
+    name = basename(filepath)
+    stamp = name[len('pcgs_prices_unprocessed-'):-len('.pkl')]
+    try:
+        return datetime.strptime(stamp, SNAPSHOT_TIME_FORMAT)
+    except ValueError:
+        return datetime.fromtimestamp(getmtime(filepath))
+
+
+def snapshot_rows(filepath):
+    """
+    :param filepath: (str) rows of a scrape: an unprocessed .pkl file saved by
+        scrape_all, or the journal of a scrape (see journal.py)
+    :return: generator of rows
+    """
+    if filepath.endswith('.pkl'):
+        with open(filepath, 'rb') as infile:
+            rows = pickle.load(infile)
+        # hand the rows out without keeping them, so spilled rows are freed
+        rows.reverse()
+        while len(rows) > 0:
+            yield rows.pop()
+    else:
+        yield from Journal(filepath).rows()
+
+
+def group_snapshots(filepaths, run_size=RUN_SIZE, spill_dir=None,
+                    first_seen=None):
+    """
+    Group the rows of one or more scrapes by pcgs number with an external sort,
+    so only run_size rows and one group are in memory at once. When a pcgs
+    number is in more than one scrape, the rows of the latest one are used
+
+    :param filepaths: (list(str)) scrapes, see snapshot_rows, oldest first
+    :param run_size: (int) rows sorted in memory at a time, see extsort.py
+    :param spill_dir: (str) directory for sorted runs, see extsort.py
+    :param first_seen: (dict) if given, filled with pcgs_num -> order in which
+        the pcgs numbers were first seen
+    :return: generator of (pcgs_num, rows) in pcgs number order
+    """
+    if first_seen is None:
+        first_seen = {}
+
+    def keyed_rows():
+        for snapshot, filepath in enumerate(filepaths):
+            for row in snapshot_rows(filepath):
+                pcgs_num = row['pcgs_num']
+                # NOTE: see merge_grade_bins about rows without a pcgs_num
+                if pcgs_num is None:
+                    continue
+                first_seen.setdefault(pcgs_num, len(first_seen))
+                yield (pcgs_num, snapshot), row
+
+    groups = sorted_groups(keyed_rows(), run_size, spill_dir)
+    for pcgs_num, snapshot_groups in groupby(groups, key=lambda g: g[0][0]):
+        *_, (_, rows) = snapshot_groups     # latest snapshot
+        yield pcgs_num, rows
+
+
+def write_malformed(malformed, filename=MALFORMED_FILE):
+    """
+    :param malformed: (list(dict)) groups merge_entries could not merge
+    :param filename: (str) file to write, one JSON object per line
+    """
+    with open(ensure_parent(filename), 'w') as outfile:
+        for group in malformed:
+            outfile.write(json.dumps(group) + '\n')
+    print(f'{len(malformed)} pcgs numbers could not be merged and were left '
+          f'out, see {filename}')
+    for group in malformed[:5]:
+        print(f'    PCGS#{group["pcgs_num"]}: {group["error"]}')
+
+
+def merge_grade_bins(filepath, changed_urls=None, deltas=False, matrix=True,
+                     run_size=RUN_SIZE, spill_dir=None):
     """
     data from scrape_all is separated by grade_bins, combine into a single
     entry for each pcgs number
@@ -192,7 +482,24 @@ def merge_grade_bins(filepath):
     that the scraped data is saved as soon as possible to avoid errors causing
     data loss after waiting for all the prices to be scraped
 
-    :param filepath: path to scraped data pkl from scrape_all
+    v0.0.5: rows are grouped by pcgs number with an external sort instead of in
+    memory, several scrapes can be merged at once, pcgs numbers whose rows
+    cannot be merged are reported and left out instead of stopping the merge,
+    and the price guide is saved in chunks that scraper.py reads one at a time
+
+    :param filepath: path to scraped data pkl from scrape_all or a scrape
+        journal, or a list of them (oldest first) to merge the latest prices of
+        every pcgs number in any of them
+    :param changed_urls: (set) if given, only pcgs numbers with a row from one
+        of these pages are merged again, the rest are copied from the previous
+        price guide. Once one incremental scrape is merged, its fingerprints
+        are what the next one is compared against, see fingerprints.commit
+    :param deltas: (bool) write the prices that changed since the previous
+        price guide to a delta file, see write_price_deltas
+    :param matrix: (bool) also write the prices as numpy arrays, see
+        write_price_matrix, skipped if numpy is not installed
+    :param run_size: (int) rows sorted in memory at a time, see group_snapshots
+    :param spill_dir: (str) directory for sorted runs, see group_snapshots
     :return price_guide: (dict) lookup table for
     """
     # NOTE: there will be a lot of entries with a None pcgs_num, these are
@@ -201,60 +508,209 @@ def merge_grade_bins(filepath):
     # that information, capture the title of each subsection of the table and
     # you can relate it
 
-    price_guide = {}
+    if isinstance(filepath, str):
+        filepath = [filepath]
 
-    scraped_data = pickle.load(open(filepath, 'rb'))
-    by_pcgs_num = ft.indexBy('pcgs_num', scraped_data)
-
-    for pcgs_num, entries in by_pcgs_num.items():
-        if pcgs_num is None:
-            continue        # see above comment
-
-        # 1: merge price information into a single dict that points from # to $
-        assert len(entries) == 3, 'Something went wrong, more than 3 bins'
-        # make absolutely certain that prices are in the correct order, overkill
-        temp_order = [None, None, None]
-        desigs = []
-        for entry in entries:
-            desigs.append(entry['desig'])       # save desig for step 2
-            if entry['grades'] == 'grades-1-20':
-                temp_order[0] = entry['prices']
-            elif entry['grades'] == 'grades-25-60':
-                temp_order[1] = entry['prices']
-            elif entry['grades'] == 'grades-61-70':
-                temp_order[2] = entry['prices']
-        this_num_prices = []        # prices for this pcgs number
-        for grade_bin in temp_order:
-            for price in grade_bin:
-                this_num_prices.append(price)
-        assert len(this_num_prices) == len(GRADES), \
-            f'Wrong number of grades for PCGS#{pcgs_num}: ' \
-            f'{len(this_num_prices)}'
-        price_by_grade = dict(zip(GRADES, this_num_prices))
-
-        # 2: Ensure that the desig is always two place if at least one is
-        merged_desig = []       # start with len == 0
-        for desig in desigs:
-            if len(desig) > len(merged_desig):   # longest desig wins
-                merged_desig = desig
-
-        merged_entry = {
-            'pcgs_num': pcgs_num,
-            'desig': merged_desig,
-            'prices': price_by_grade,
-            'merged_from': entries,
-        }
-        price_guide[pcgs_num] = merged_entry
+    price_guide = {}
+    malformed = []
+
+    previous_guide = {}
+    if (changed_urls is not None or deltas) and isfile(PRICE_GUIDE_FILE):
+        previous_guide = pickle.load(open(PRICE_GUIDE_FILE, 'rb'))
+
+    first_seen = {}
+    reused = 0
+    for pcgs_num, entries in group_snapshots(filepath, run_size, spill_dir,
+                                             first_seen):
+        if changed_urls is not None and pcgs_num in previous_guide and \
+                not any(entry['url'] in changed_urls for entry in entries):
+            price_guide[pcgs_num] = previous_guide[pcgs_num]
+            reused += 1
+            continue
+        try:
+            price_guide[pcgs_num] = merge_entries(pcgs_num, entries)
+        except (ValueError, KeyError, TypeError) as e:
+            malformed.append({
+                'pcgs_num': pcgs_num,
+                'error': f'{type(e).__name__}: {e}',
+                'urls': [entry.get('url') for entry in entries],
+            })
+    # same order as the scrape
+    price_guide = {pcgs_num: price_guide[pcgs_num] for pcgs_num in
+                   sorted(price_guide, key=first_seen.__getitem__)}
+    if changed_urls is not None:
+        print(f'Merged {len(price_guide) - reused} changed pcgs numbers, '
+              f'reused {reused} from {PRICE_GUIDE_FILE}')
+    if len(malformed) > 0:
+        write_malformed(malformed)
+
+    if deltas:
+        if len(previous_guide) == 0:
+            print(f'No previous price guide at {PRICE_GUIDE_FILE}, skipping '
+                  f'price deltas')
+        else:
+            write_price_deltas(previous_guide, price_guide)
 
     print('Saving price guide to pkl and json files...')
-    pickle.dump(price_guide, open('data/scraped_pcgs_prices.pkl', 'wb'))
-    with open('data/scraped_pcgs_prices.json', 'w') as outfile:
-        json.dump(price_guide, outfile)
+    # in chunks, so scraper.py can join it one chunk at a time
+    entries = iter(price_guide.items())
+    dump_dict(iter(lambda: list(islice(entries, GUIDE_CHUNK)), []),
+              PRICE_GUIDE_FILE)
+    with open(PRICE_GUIDE_JSON, 'w') as outfile:
+        json.dump(price_guide, outfile, default=to_json)
+    if matrix:
+        try:
+            write_price_matrix(price_guide)
+        except ImportError:
+            print('numpy is not installed, skipping price matrix')
+    if len(filepath) == 1:
+        # an incremental scrape is compared against this guide from now on
+        commit(filepath[0])
+    return price_guide
+
+
+def price_to_cents(price):
+    """
+    :param price: (str) price as scraped, e.g. '1,250' or '$12.50'
+    :return cents: (float) price in cents, nan if there is no price
+    """
+    if price is None:
+        return float('nan')
+    try:
+        return round(float(price.replace(',', '').replace('$', '')) * 100)
+    except ValueError:
+        return float('nan')
 
 
-def main():
-    save_file = scrape_all()
-    merge_grade_bins(save_file)
+def write_price_matrix(price_guide, keys_path=PRICE_KEYS_FILE,
+                       cents_path=PRICE_CENTS_FILE):
+    """
+    Save the prices of a price guide as two .npy arrays that can be memory
+    mapped with load_price_matrix:
+        keys:  (n_coins,) sorted pcgs numbers, int64 if every pcgs number is
+               all digits, str otherwise
+        cents: (n_coins, len(GRADES), 2) float64 prices in cents, nan where
+               there is no price. cents[i, j, k] is price k (0 is the top price
+               in the table, 1 the bottom) of grade GRADES[j] of coin keys[i]
+
+    :param price_guide: (dict) output of merge_grade_bins
+    :param keys_path: (str) where to save the keys array
+    :param cents_path: (str) where to save the cents array
+    :return keys, cents: the saved arrays
+    """
+    import numpy as np
+
+    if all(pcgs_num.isdigit() for pcgs_num in price_guide):
+        pcgs_nums = sorted(price_guide, key=int)
+        keys = np.array([int(pcgs_num) for pcgs_num in pcgs_nums],
+                        dtype=np.int64)
+    else:
+        pcgs_nums = sorted(price_guide)
+        keys = np.array(pcgs_nums, dtype=str)
+
+    cents = np.full((len(pcgs_nums), len(GRADES), 2), np.nan,
+                    dtype=np.float64)
+    grade_index = {grade: j for j, grade in enumerate(GRADES)}
+    for i, pcgs_num in enumerate(pcgs_nums):
+        for grade, prices in price_guide[pcgs_num]['prices'].items():
+            j = grade_index[grade]
+            for k, price in enumerate(prices[:2]):
+                cents[i, j, k] = price_to_cents(price)
+
+    np.save(ensure_parent(keys_path), keys)
+    np.save(ensure_parent(cents_path), cents)
+    print(f'Saved price matrix to {keys_path} and {cents_path}')
+    return keys, cents
+
+
+def load_price_matrix(keys_path=PRICE_KEYS_FILE, cents_path=PRICE_CENTS_FILE,
+                      mmap_mode='r'):
+    """
+    :param mmap_mode: passed to numpy.load, 'r' memory maps the arrays so only
+        the pages that are used are read from disk, None loads them fully
+    :return keys, cents: arrays saved by write_price_matrix
+    """
+    import numpy as np
+    keys = np.load(keys_path, mmap_mode=mmap_mode)
+    cents = np.load(cents_path, mmap_mode=mmap_mode)
+    return keys, cents
+
+
+def matrix_row(keys, pcgs_num):
+    """
+    :param keys: keys array from load_price_matrix
+    :param pcgs_num: (str) PCGS Number
+    :return i: (int) index of the coin in the cents array, None if not found
+    """
+    import numpy as np
+    key = int(pcgs_num) if keys.dtype.kind == 'i' else pcgs_num
+    i = int(np.searchsorted(keys, key))
+    if i < len(keys) and keys[i] == key:
+        return i
+    return None
+
+
+def price_deltas(old_guide, new_guide):
+    """
+    Prices that changed between two price guides from merge_grade_bins
+
+    :param old_guide: (dict) previous price guide
+    :param new_guide: (dict) current price guide
+    :return deltas: generator of (pcgs_num, grade, old, new), old/new are the
+        (price, price) tuples or None if the coin is not in that guide
+    """
+    for pcgs_num, new_entry in new_guide.items():
+        old_entry = old_guide.get(pcgs_num)
+        if old_entry is new_entry:
+            continue        # reused, nothing changed
+        old_prices = {} if old_entry is None else old_entry['prices']
+        for grade, new in new_entry['prices'].items():
+            old = old_prices.get(grade)
+            if old is None:
+                if any(price is not None for price in new):
+                    yield pcgs_num, grade, old, new
+            elif tuple(old) != tuple(new):
+                yield pcgs_num, grade, old, new
+    for pcgs_num, old_entry in old_guide.items():
+        if pcgs_num not in new_guide:
+            for grade, old in old_entry['prices'].items():
+                yield pcgs_num, grade, old, None
+
+
+def write_price_deltas(old_guide, new_guide):
+    """
+    Write price_deltas to price_deltas-DD-MM-YYYY-HH:MM:SS.jsonl in the data
+    directory, one
+    [pcgs_num, grade, old, new] list per line
+
+    :return filename: (str) path of the delta file
+    """
+    current_time = datetime.now().strftime("%d-%m-%Y-%H:%M:%S")
+    filename = data_path(f'price_deltas-{current_time}.jsonl')
+    count = 0
+    with open(ensure_parent(filename), 'w') as outfile:
+        for delta in price_deltas(old_guide, new_guide):
+            outfile.write(json.dumps(delta) + '\n')
+            count += 1
+    print(f'Saved {count} price changes to {filename}')
+    return filename
+
+
+def main(concurrency=None, rate=None, incremental=False, history=False):
+    save_file = scrape_all(concurrency=concurrency, rate=rate,
+                           incremental=incremental)
+    if incremental:
+        price_guide = merge_grade_bins(save_file,
+                                       changed_urls=load_changed(save_file),
+                                       deltas=True)
+    else:
+        price_guide = merge_grade_bins(save_file)
+    if history:
+        from pcgs_scraper.price_history import connect, add_price_guide, \
+            PRICE_HISTORY_FILE
+        add_price_guide(connect(), price_guide, snapshot_time(save_file),
+                        source=save_file)
+        print(f'Added the prices to {PRICE_HISTORY_FILE}')
 
 
 if __name__ == "__main__":
@@ -264,18 +720,78 @@ if __name__ == "__main__":
     parser.add_argument('--scrape_only', '-s', action='store_true',
                         help="only scrape coin prices and save unprocessed "
                              "file")
-    parser.add_argument('--process', '-p', action='store',
+    parser.add_argument('--process', '-p', action='store', nargs='+',
                         help="process only, specify path to .pkl file to "
-                             "process and create lookup table from")
+                             "process and create lookup table from. Given "
+                             "several, the latest prices of each coin in any "
+                             "of them are used")
+    parser.add_argument('--cache', action='store', nargs='?',
+                        const=DEFAULT_CACHE_DIR,
+                        help="cache pages on disk and revalidate them with "
+                             "pcgs.com instead of downloading them again, "
+                             f"defaults to {DEFAULT_CACHE_DIR}")
+    parser.add_argument('--offline', action='store_true',
+                        help="only serve pages from the --cache directory, "
+                             "never touch the network")
+    parser.add_argument('--parser', action='store', choices=BACKENDS,
+                        help="html parser backend, defaults to lxml if it is "
+                             "installed and bs4 otherwise")
+    parser.add_argument('--incremental', '-i', action='store_true',
+                        help="only parse and merge pages whose prices changed "
+                             "since the last incremental run, and save the "
+                             "changed prices to a data/price_deltas-*.jsonl "
+                             "file")
+    parser.add_argument('--concurrency', '-c', action='store', type=int,
+                        help="scrape asynchronously with up to this many "
+                             "pages in flight at once")
+    parser.add_argument('--rate', '-r', action='store', type=float,
+                        help="fixed max requests per second to pcgs.com, by "
+                             "default the rate adapts: it grows while pages "
+                             "load and is cut on a 429")
+    parser.add_argument('--min_rate', action='store', type=float,
+                        default=MIN_RATE,
+                        help="the adaptive rate is never cut below this many "
+                             f"requests per second, defaults to {MIN_RATE}")
+    parser.add_argument('--max_rate', action='store', type=float,
+                        default=MAX_RATE,
+                        help="the adaptive rate never grows above this many "
+                             f"requests per second, defaults to {MAX_RATE}")
+    parser.add_argument('--history', action='store_true',
+                        help="with --all, also add the prices to the price "
+                             "history, see price_history.py")
+    parser.add_argument('--run_size', action='store', type=int,
+                        default=RUN_SIZE,
+                        help="rows sorted in memory at a time when merging, "
+                             f"larger scrapes are sorted on disk, defaults to "
+                             f"{RUN_SIZE}")
+    parser.add_argument('--spill_dir', action='store',
+                        help="directory for rows sorted on disk, defaults to "
+                             "the system temporary directory")
 
     args = parser.parse_args()
 
+    if args.cache is not None or args.offline:
+        set_client(PCGSClient(cache=PageCache(args.cache or DEFAULT_CACHE_DIR),
+                              offline=args.offline))
+
+    if args.parser is not None:
+        set_backend(args.parser)
+
+    if args.rate is not None:
+        set_limiter(HostRateLimiter(args.rate))
+    else:
+        set_limiter(AdaptiveRateLimiter(floor=args.min_rate,
+                                        ceiling=args.max_rate))
+
     if args.all is True:
-        main()
+        main(concurrency=args.concurrency, rate=args.rate,
+             incremental=args.incremental, history=args.history)
     elif args.scrape_only is True:
-        scrape_all()
+        scrape_all(concurrency=args.concurrency, rate=args.rate,
+                   incremental=args.incremental)
     elif args.process is not None:
-        merge_grade_bins(args.process)
+        merge_grade_bins(sorted(args.process, key=snapshot_time),
+                         run_size=args.run_size, spill_dir=args.spill_dir)
     else:
         print('Please specify an option. Documentation available at '
               'https://github.com/ryanamannion/pcgs_prices')
@@ -9,16 +9,22 @@ Author: Ryan A. Mannion, 2020
 github: ryanamannion
 twitter: @ryanamannion
 """
-import ft
 import sys
+import json
 import pickle
+import sqlite3
 import argparse
 from copy import deepcopy
+from os.path import isfile, getmtime
 
-from nltk.metrics import edit_distance
-
+from pcgs_scraper.config import data_path
+from pcgs_scraper.ranking import rank
 from pcgs_scraper.utils import YEAR, DENOM_CI, MINT_CI       # regex
 from pcgs_scraper.utils import fold_denoms, price_table
+from pcgs_scraper.price_db import connect, query_price_db
+from pcgs_scraper.records import compact_coins
+
+PRICE_GUIDE_FILE = data_path('pcgs_price_guide.pkl')
 
 
 def validate_query(query_str, verbose=True):
@@ -77,98 +83,199 @@ def validate_query(query_str, verbose=True):
     return query_params
 
 
-def rank_results(normalized_query, results):
+def rank_results(normalized_query, results, top_k=None):
     """
     Rank results by lowest-highest Levenshtein Edit Distance
 
     v0.0.4: exact description match returns just that result
+    v0.0.5: bit-parallel edit distance and top k, see pcgs_scraper.ranking
 
     :param normalized_query: query normalized (denom folded)
     :param results: results list from query_price_guide
+    :param top_k: (int) only return the best top_k results, None for all
     :return sorted_results: results sorted from lowest to highest edit distance
     """
-    scores = []
-    for result in results:
-        score = edit_distance(normalized_query, result['description'])
-        if score == 0:      # exact match
-            return [result]
-        scores.append((score, result))
-    # sort scores by index 0, aka edit distance
-    scores.sort(key=lambda x: x[0])
-    sorted_results = [score[1] for score in scores]
-    return sorted_results
+    return rank(normalized_query, results, k=top_k)
+
+
+def build_query_index(coin_ft):
+    """
+    Nested lookup index for query_price_guide, build it once per price guide:
+        year_short -> denom -> mint -> positions of the coins in coin_ft
+    where the mint None holds every coin of that year and denomination
 
+    :param coin_ft: (list(dict)) free table of coin prices, made with
+        pcgs_scraper
+    :return index: (dict) the index
+    """
+    index = {}
+    for i, coin in enumerate(coin_ft):
+        by_denom = index.setdefault(coin['year_short'], {})
+        by_mint = by_denom.setdefault(coin['denom'], {None: []})
+        by_mint[None].append(i)
+        if coin['mint'] is not None:
+            by_mint.setdefault(coin['mint'], []).append(i)
+    return index
 
-def query_price_guide(query_tuple, coin_ft):
+
+def index_path(price_guide_path):
+    """
+    :param price_guide_path: (str) path to the price guide pkl
+    :return path: (str) where the query index of that price guide is saved
+    """
+    return price_guide_path + '.idx'
+
+
+def save_query_index(index, price_guide_path):
+    """
+    Save a query index alongside its price guide
+
+    :param index: (dict) output of build_query_index
+    :param price_guide_path: (str) path to the price guide pkl it was built from
+    """
+    pickle.dump(index, open(index_path(price_guide_path), 'wb'))
+
+
+def load_price_guide(price_guide_path, compact=True):
+    """
+    Load a price guide and its query index, the index is built and saved if it
+    is missing or older than the price guide
+
+    v0.0.5: the coins are made compact records, see records.compact_coins
+
+    :param price_guide_path: (str) path to the price guide pkl
+    :param compact: (bool) make the coins compact records, which takes a
+        fraction of the memory but a few times as long to load. False for
+        plain dicts, e.g. to answer one query and exit
+    :return coin_ft, index: the price guide and its query index
+    """
+    coin_ft = pickle.load(open(price_guide_path, 'rb'))
+    if compact:
+        compact_coins(coin_ft)
+    idx_path = index_path(price_guide_path)
+    if isfile(idx_path) and \
+            getmtime(idx_path) >= getmtime(price_guide_path):
+        index = pickle.load(open(idx_path, 'rb'))
+    else:
+        index = build_query_index(coin_ft)
+        try:
+            save_query_index(index, price_guide_path)
+        except OSError:
+            pass        # e.g. read-only directory, the index still works
+    return coin_ft, index
+
+
+def query_price_guide(query_tuple, coin_ft, index=None, top_k=None):
     """
     With a validated query, return one or more coins from the free table
     matching the description
 
     :param query_tuple: (tuple) output from validate_query
     :param coin_ft: (list(dict)) free table of coin prices, made with
-        pcgs_scraper
-    :return :
+        pcgs_scraper, or (sqlite3.Connection) connection to a price guide
+        database, see pcgs_scraper.price_db
+    :param index: (dict) query index of coin_ft from build_query_index or
+        load_price_guide, built on the fly if not given
+    :param top_k: (int) only return the best top_k results, None for all
+    :return results: (list(dict)) coins matching year, denomination and mint
+        if given, ranked by edit distance. If no coin matches the mint, all
+        coins matching year and denomination. None if no coin matches year or
+        denomination
     """
     query_year, query_denom, query_mint, query_orig, query_norm = query_tuple
 
-    # lots of loops, make life easy
-    result_found = False
-
-    # index the ft by year to quick search for year
-    coins_by_year = ft.indexBy('year_short', coin_ft)
-    for year, year_coins in coins_by_year.items():
-        if result_found:
-            break
-        if year == query_year:
-            coins_by_denom = ft.indexBy('denom', year_coins)
-            for denom, denom_coins in coins_by_denom.items():
-                if result_found:
-                    break
-                if denom == query_denom:
-                    if query_mint is not None:
-                        coins_by_mint = ft.indexBy('mint', denom_coins)
-                        for mint, mint_coins in coins_by_mint.items():
-                            if mint == query_mint:
-                                # ding ding ding: year, denom, & mint match
-                                results = mint_coins
-                                result_found = True
-                                break
-                        else:
-                            # mint loop completed without breaks, means no mint
-                            # match was found ... return denomination matches
-                            # anyway (max 4-5 coins, user can choose)
-                            results = denom_coins
-                            result_found = True
-                            break
-                    else:
-                        # query_mint is none, return denominations
-                        results = denom_coins
-                        result_found = True
-                        break
-            else:
-                # denomination loop completed without breaking, no match found
-                # perhaps that denomination was not minted in the specified year
-                results = None
-                break
+    if isinstance(coin_ft, sqlite3.Connection):
+        results = query_price_db(query_tuple, coin_ft)
     else:
-        # year loop completed without breaking, no year match found
-        # perhaps the specified year was out of range, or mistyped
-        results = None
+        if index is None:
+            index = build_query_index(coin_ft)
+        # year not found: perhaps the specified year was out of range, or
+        # mistyped. denomination not found: perhaps that denomination was not
+        # minted in the specified year
+        by_mint = index.get(query_year, {}).get(query_denom)
+        if by_mint is None:
+            results = None
+        else:
+            # no mint match: return denomination matches anyway (max 4-5
+            # coins, user can choose)
+            positions = by_mint.get(query_mint, by_mint[None])
+            results = [coin_ft[i] for i in positions]
 
     # rank results by Levenshtein Edit Distance
     if results is not None:
         if len(results) > 1:
-            results = rank_results(query_norm, results)
+            results = rank_results(query_norm, results, top_k)
 
     return results
 
 
-def query_cli(query_str, price_guide):
+def query_answer(query_str, price_guide, index=None, top_k=None):
+    """
+    Validate and run a query, as a json serializable dict, used by pcgs_batch
+    and pcgs_daemon
+
+    :param query_str: (str) query input from user
+    :param price_guide: price guide, see query_price_guide
+    :param index: query index of price_guide, see build_query_index
+    :param top_k: (int) only return the best top_k results, None for all
+    :return answer: (dict) the query, its year, denom and mint and the results
+        (pcgs_num, description, desig and prices of each coin), or an error
+        message if the query has no year or denomination
+    """
+    validated_query = validate_query(query_str, verbose=False)
+    if validated_query is None:
+        return {'query': query_str,
+                'error': 'could not detect a year and a denomination'}
+    query_results = query_price_guide(validated_query, price_guide, index,
+                                      top_k)
+    results = []
+    for result in query_results or []:
+        results.append({
+            'pcgs_num': result['pcgs_num'],
+            'description': result['description'],
+            'desig': result['desig'],
+            'prices': result['prices'],
+        })
+    return {
+        'query': query_str,
+        'year': validated_query[0],
+        'denom': validated_query[1],
+        'mint': validated_query[2],
+        'results': results,
+    }
+
+
+def query_server(query_str, server, top_k=None, timeout_s=10.0):
+    """
+    Run a query against a running pcgs_daemon instead of a local price guide
+
+    :param query_str: (str) query input from user
+    :param server: (str) base url of the daemon, e.g. http://127.0.0.1:8765
+    :param top_k: (int) only return the best top_k results, None for all
+    :param timeout_s: (float) seconds to wait for the daemon
+    :return answer: (dict) see query_answer
+    """
+    from urllib.parse import urlencode
+    from urllib.request import urlopen
+
+    params = {'q': query_str}
+    if top_k is not None:
+        params['k'] = top_k
+    url = f"{server.rstrip('/')}/query?{urlencode(params)}"
+    with urlopen(url, timeout=timeout_s) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def query_cli(query_str, price_guide, index=None, top_k=None, server=None):
     """
     Handle printing messages etc. for CLI
 
     :param query_str:
     :param price_guide:
+    :param index: query index of price_guide, see build_query_index
+    :param top_k: (int) only show the best top_k results, None for all
+    :param server: (str) base url of a pcgs_daemon to send the query to, used
+        instead of price_guide if given
     :return:
     """
     if query_str is None:
@@ -182,7 +289,13 @@ def query_cli(query_str, price_guide):
     print(f"\tMint: {validated_query[2]}")
     print(f"\tDenomination: {validated_query[1]}")
 
-    query_results = query_price_guide(validated_query, price_guide)
+    if server is not None:
+        query_results = query_server(query_str, server, top_k)['results']
+        if len(query_results) == 0:
+            query_results = None
+    else:
+        query_results = query_price_guide(validated_query, price_guide, index,
+                                          top_k)
     if query_results is None:
         print(f"Found 0 results")
         sys.exit()
@@ -217,7 +330,7 @@ if __name__ == "__main__":
                              'pcgs_scraper package, link at '
                              'https://github.com/ryanamannion/pcgs_scraper.git '
                              '\nDefaults to 30-11-2020',
-                        default='data/pcgs_price_guide.pkl'
+                        default=PRICE_GUIDE_FILE
                         )
     parser.add_argument('--query', '-q', action='store',
                         help='Coin to get price for, in format: \n '
@@ -226,6 +339,24 @@ if __name__ == "__main__":
                              ' and DNM the denomination (dime, penny, 25c, $1),'
                              ' any details may follow to give more information'
                              ' about the coin')
+    parser.add_argument('--db', '-d', action='store',
+                        help='path to SQLite price guide created with '
+                             'pcgs_scraper, used instead of --price_guide')
+    parser.add_argument('--top', '-k', action='store', type=int, default=10,
+                        help='number of results to show, best first, '
+                             'defaults to 10')
+    parser.add_argument('--server', '-s', action='store',
+                        help='url of a running pcgs_daemon.py to query, e.g. '
+                             'http://127.0.0.1:8765, used instead of '
+                             '--price_guide and --db')
     args = parser.parse_args()
 
-    query_cli(args.query, pickle.load(open(args.price_guide, 'rb')))
+    if args.server is not None:
+        query_cli(args.query, None, top_k=args.top, server=args.server)
+    elif args.db is not None:
+        query_cli(args.query, connect(args.db), top_k=args.top)
+    else:
+        # one query and out, the memory of compact records does not pay off
+        query_cli(args.query, *load_price_guide(args.price_guide,
+                                                compact=False),
+                  top_k=args.top)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+price_db.py
+
+SQLite version of the price guide, so a query only reads the few pages of the
+database it needs instead of unpickling the whole price guide
+
+    coins:  one row per coin, indexed on year_short, denom, mint and pcgs_num
+            (the primary key)
+    prices: one row per (pcgs_num, grade)
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import os
+import json
+import sqlite3
+
+from pcgs_scraper.config import data_path, ensure_parent
+from pcgs_scraper.records import to_json
+
+PRICE_DB_FILE = data_path('pcgs_price_guide.db')
+
+SCHEMA = """
+CREATE TABLE coins (
+    pcgs_num TEXT PRIMARY KEY,
+    description TEXT,
+    desig TEXT,
+    year_short TEXT,
+    year_full TEXT,
+    mint TEXT,
+    denom TEXT,
+    detail TEXT,
+    image TEXT,
+    images TEXT,
+    narrative TEXT,
+    coinfacts_url TEXT
+);
+CREATE TABLE prices (
+    pcgs_num TEXT NOT NULL,
+    grade INTEGER NOT NULL,
+    price TEXT,
+    price_plus TEXT,
+    PRIMARY KEY (pcgs_num, grade)
+) WITHOUT ROWID;
+CREATE INDEX idx_coins_year_short ON coins (year_short);
+CREATE INDEX idx_coins_denom ON coins (denom);
+CREATE INDEX idx_coins_mint ON coins (mint);
+"""
+
+# columns stored as json text, everything else is stored as is
+JSON_COLUMNS = ['desig', 'image', 'images']
+COIN_COLUMNS = ['pcgs_num', 'description', 'desig', 'year_short', 'year_full',
+                'mint', 'denom', 'detail', 'image', 'images', 'narrative',
+                'coinfacts_url']
+
+
+def write_price_db(coins, db_path=PRICE_DB_FILE, batch_size=1000):
+    """
+    Save a price guide to a new SQLite database, replacing db_path if it exists
+
+    :param coins: (iterable(dict)) price guide, output of combine_number_price,
+        or coins from join_number_price, written as they come
+    :param db_path: (str) database file
+    :param batch_size: (int) coins inserted at a time
+    :return count: (int) number of coins written
+    """
+    if os.path.isfile(db_path):
+        os.remove(db_path)
+    conn = sqlite3.connect(ensure_parent(db_path))
+    placeholders = ', '.join('?' * len(COIN_COLUMNS))
+    insert_coin = f"INSERT OR REPLACE INTO coins ({', '.join(COIN_COLUMNS)}) " \
+                  f"VALUES ({placeholders})"
+    insert_price = "INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?)"
+    count = 0
+    with conn:
+        conn.executescript(SCHEMA)
+        coin_rows = []
+        price_rows = []
+        for coin in coins:
+            coin_rows.append(tuple(
+                json.dumps(coin.get(column), default=to_json)
+                if column in JSON_COLUMNS
+                else coin.get(column)
+                for column in COIN_COLUMNS))
+            for grade, prices in coin['prices'].items():
+                price_rows.append((coin['pcgs_num'], grade) + tuple(prices))
+            count += 1
+            if len(coin_rows) >= batch_size:
+                conn.executemany(insert_coin, coin_rows)
+                conn.executemany(insert_price, price_rows)
+                coin_rows = []
+                price_rows = []
+        conn.executemany(insert_coin, coin_rows)
+        conn.executemany(insert_price, price_rows)
+    conn.execute('ANALYZE')
+    conn.close()
+    return count
+
+
+def connect(db_path=PRICE_DB_FILE):
+    """
+    :param db_path: (str) database made with write_price_db
+    :return conn: (sqlite3.Connection) read-only connection to the database
+    """
+    if not os.path.isfile(db_path):
+        raise FileNotFoundError(db_path)
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True,
+                           check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def as_tuples(value):
+    # json turns tuples into lists, turn them back to match the pickle
+    if isinstance(value, list):
+        return [tuple(item) if isinstance(item, list) else item
+                for item in value]
+    return value
+
+
+def coins_from_rows(conn, rows):
+    """
+    :param conn: (sqlite3.Connection) connection from connect
+    :param rows: (list(sqlite3.Row)) rows of the coins table
+    :return coins: (list(dict)) coins with the same keys as the price guide
+        from combine_number_price, except merged_from
+    """
+    coins = []
+    by_pcgs_num = {}
+    for row in rows:
+        coin = dict(row)
+        for column in JSON_COLUMNS:
+            coin[column] = json.loads(coin[column])
+        coin['image'] = tuple(coin['image']) if coin['image'] else None
+        coin['images'] = as_tuples(coin['images'])
+        coin['prices'] = {}
+        coins.append(coin)
+        by_pcgs_num[coin['pcgs_num']] = coin
+    if len(coins) > 0:
+        placeholders = ', '.join('?' * len(by_pcgs_num))
+        price_rows = conn.execute(
+            f"SELECT pcgs_num, grade, price, price_plus FROM prices "
+            f"WHERE pcgs_num IN ({placeholders}) ORDER BY pcgs_num, grade",
+            list(by_pcgs_num))
+        for pcgs_num, grade, price, price_plus in price_rows:
+            by_pcgs_num[pcgs_num]['prices'][grade] = (price, price_plus)
+    return coins
+
+
+def query_price_db(query_tuple, conn):
+    """
+    Same search as pcgs_query.query_price_guide (without the ranking), run
+    against the database
+
+    :param query_tuple: (tuple) output from validate_query
+    :param conn: (sqlite3.Connection) connection from connect
+    :return results: (list(dict)) coins matching year, denomination and mint
+        if given. If no coin matches the mint, all coins matching year and
+        denomination. None if no coin matches year or denomination
+    """
+    query_year, query_denom, query_mint, query_orig, query_norm = query_tuple
+    select = f"SELECT {', '.join(COIN_COLUMNS)} FROM coins"
+
+    year_found = conn.execute("SELECT 1 FROM coins WHERE year_short = ? "
+                              "LIMIT 1", (query_year,)).fetchone()
+    if year_found is None:
+        return None
+
+    if query_mint is not None:
+        rows = conn.execute(f"{select} WHERE year_short = ? AND denom = ? "
+                            f"AND mint = ? ORDER BY rowid",
+                            (query_year, query_denom, query_mint)).fetchall()
+        if len(rows) > 0:
+            return coins_from_rows(conn, rows)
+
+    rows = conn.execute(f"{select} WHERE year_short = ? AND denom = ? "
+                        f"ORDER BY rowid",
+                        (query_year, query_denom)).fetchall()
+    if len(rows) == 0:
+        return None
+    return coins_from_rows(conn, rows)
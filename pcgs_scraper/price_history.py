@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+price_history.py
+
+Append-only history of prices across scrapes, so how a coin's price moved does
+not take unpickling every saved scrape. Prices are stored per
+(pcgs_num, grade) run-length encoded: one row per run of scrapes in a row with
+the same price, since most prices do not change between scrapes
+
+    snapshots:  one row per scrape added, with when it was taken
+    price_runs: (pcgs_num, grade, start_at) -> price, price_plus, the price
+                from the scrape taken at start_at until the one at end_at,
+                which is NULL while the price is current
+
+Adding a scrape only writes the prices that changed. A coin missing from a
+scrape ends its runs, so the price of a coin at a time when it was not in the
+price guide is None
+
+    $ python price_history.py add data/pcgs_prices_unprocessed-*.pkl
+    $ python price_history.py at 3086 --grade 65 --when 2021-06-01
+    $ python price_history.py history 3086 --grade 65 --start 2020-01-01
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import sys
+import sqlite3
+import argparse
+from datetime import datetime
+
+from pcgs_scraper.config import data_path, ensure_parent
+
+PRICE_HISTORY_FILE = data_path('price_history.db')
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    taken_at TEXT PRIMARY KEY,
+    source TEXT,
+    coins INTEGER
+);
+CREATE TABLE IF NOT EXISTS price_runs (
+    pcgs_num TEXT NOT NULL,
+    grade INTEGER NOT NULL,
+    start_at TEXT NOT NULL,
+    end_at TEXT,
+    price TEXT,
+    price_plus TEXT,
+    PRIMARY KEY (pcgs_num, grade, start_at)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_price_runs_open ON price_runs (pcgs_num, grade)
+    WHERE end_at IS NULL;
+"""
+
+INCOMING = """
+CREATE TEMP TABLE incoming (
+    pcgs_num TEXT NOT NULL,
+    grade INTEGER NOT NULL,
+    price TEXT,
+    price_plus TEXT,
+    PRIMARY KEY (pcgs_num, grade)
+) WITHOUT ROWID
+"""
+
+# current runs whose price changed or is not in the new scrape end
+END_RUNS = """
+UPDATE price_runs SET end_at = :taken_at
+WHERE end_at IS NULL AND NOT EXISTS (
+    SELECT 1 FROM incoming
+    WHERE incoming.pcgs_num = price_runs.pcgs_num
+      AND incoming.grade = price_runs.grade
+      AND incoming.price IS price_runs.price
+      AND incoming.price_plus IS price_runs.price_plus)
+"""
+# prices without a current run start one
+START_RUNS = """
+INSERT INTO price_runs
+SELECT pcgs_num, grade, :taken_at, NULL, price, price_plus FROM incoming
+WHERE NOT EXISTS (
+    SELECT 1 FROM price_runs
+    WHERE price_runs.pcgs_num = incoming.pcgs_num
+      AND price_runs.grade = incoming.grade
+      AND price_runs.end_at IS NULL)
+"""
+
+
+def connect(history_path=PRICE_HISTORY_FILE):
+    """
+    :param history_path: (str) history database, created if it does not exist
+    :return conn: (sqlite3.Connection)
+    """
+    conn = sqlite3.connect(ensure_parent(history_path))
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def as_time(when):
+    """
+    :param when: (datetime or str) a time, as a datetime or ISO format string,
+        e.g. '2021-06-01' or '2021-06-01T12:00:00'
+    :return when: (str) the time as stored in the history
+    """
+    if isinstance(when, str):
+        when = datetime.fromisoformat(when)
+    return when.strftime(TIME_FORMAT)
+
+
+def price_rows(price_guide):
+    """
+    :param price_guide: (dict) pcgs_num -> entry from merge_grade_bins, or an
+        iterable of (pcgs_num, entry)
+    :return: generator of (pcgs_num, grade, price, price_plus)
+    """
+    if hasattr(price_guide, 'items'):
+        price_guide = price_guide.items()
+    for pcgs_num, entry in price_guide:
+        if pcgs_num is None:
+            continue
+        for grade, (price, price_plus) in entry['prices'].items():
+            yield pcgs_num, grade, price, price_plus
+
+
+def add_price_guide(conn, price_guide, taken_at, source=None):
+    """
+    Add the prices of one scrape to the history. Scrapes must be added in the
+    order they were taken, a scrape already in the history is skipped
+
+    :param conn: (sqlite3.Connection) from connect
+    :param price_guide: (dict) pcgs_num -> entry from merge_grade_bins, or an
+        iterable of (pcgs_num, entry)
+    :param taken_at: (datetime or str) when the scrape was taken
+    :param source: (str) where the scrape came from, e.g. its file
+    :return added: (bool) False if the scrape was already in the history
+    :raises ValueError: if a later scrape is already in the history
+    """
+    taken_at = as_time(taken_at)
+    previous_at = snapshot_at(conn)
+    if previous_at is not None and taken_at <= previous_at:
+        known = conn.execute('SELECT 1 FROM snapshots WHERE taken_at = ?',
+                             (taken_at,)).fetchone()
+        if known is not None:
+            return False
+        raise ValueError(f'The history is append only: the scrape taken at '
+                         f'{taken_at} is older than the last one added, '
+                         f'{previous_at}')
+    with conn:
+        conn.execute('DROP TABLE IF EXISTS temp.incoming')
+        conn.execute(INCOMING)
+        conn.executemany('INSERT OR REPLACE INTO incoming VALUES (?, ?, ?, ?)',
+                         price_rows(price_guide))
+        coins, = conn.execute(
+            'SELECT COUNT(DISTINCT pcgs_num) FROM incoming').fetchone()
+        conn.execute(END_RUNS, {'taken_at': taken_at})
+        conn.execute(START_RUNS, {'taken_at': taken_at})
+        conn.execute('INSERT INTO snapshots VALUES (?, ?, ?)',
+                     (taken_at, source, coins))
+        conn.execute('DROP TABLE temp.incoming')
+    return True
+
+
+def add_snapshot_file(conn, filepath):
+    """
+    Merge the grade bins of a scrape saved by scrape_all and add its prices to
+    the history, when it was taken comes from the file name. Groups that can
+    not be merged are left out, see merge_grade_bins
+
+    :param conn: (sqlite3.Connection) from connect
+    :param filepath: (str) pcgs_prices_unprocessed-<time>.pkl
+    :return added: (bool) see add_price_guide
+    """
+    from pcgs_scraper.pcgs_prices import group_snapshots, merge_entries, \
+        snapshot_time
+
+    def merged_entries():
+        for pcgs_num, entries in group_snapshots([filepath]):
+            try:
+                yield pcgs_num, merge_entries(pcgs_num, entries)
+            except (ValueError, KeyError, TypeError):
+                continue
+
+    return add_price_guide(conn, merged_entries(), snapshot_time(filepath),
+                           source=filepath)
+
+
+def snapshot_at(conn, when=None):
+    """
+    :param conn: (sqlite3.Connection) from connect
+    :param when: (datetime or str) a time, None for now
+    :return taken_at: (str) the last scrape taken at or before when, None if
+        there is none
+    """
+    if when is None:
+        taken_at, = conn.execute('SELECT MAX(taken_at) FROM snapshots'
+                                 ).fetchone()
+    else:
+        taken_at, = conn.execute(
+            'SELECT MAX(taken_at) FROM snapshots WHERE taken_at <= ?',
+            (as_time(when),)).fetchone()
+    return taken_at
+
+
+def price_at(conn, pcgs_num, grade=None, when=None):
+    """
+    Point in time query: the prices of a coin in the last scrape taken at or
+    before a time
+
+    :param conn: (sqlite3.Connection) from connect
+    :param pcgs_num: (str) PCGS number
+    :param grade: (int) a grade, None for every grade
+    :param when: (datetime or str) a time, None for the latest scrape
+    :return prices: (tuple) (price, price_plus) of the grade, or (dict)
+        grade -> (price, price_plus) if grade is None. None or {} if the coin
+        was not in that scrape
+    """
+    taken_at = snapshot_at(conn, when)
+    query = 'SELECT grade, price, price_plus FROM price_runs ' \
+            'WHERE pcgs_num = ? AND start_at <= ? ' \
+            'AND (end_at IS NULL OR end_at > ?)'
+    params = [pcgs_num, taken_at, taken_at]
+    if grade is not None:
+        query += ' AND grade = ?'
+        params.append(grade)
+    prices = {grade: (price, price_plus) for grade, price, price_plus in
+              conn.execute(query + ' ORDER BY grade', params)}
+    if grade is not None:
+        return prices.get(grade)
+    return prices
+
+
+def price_history(conn, pcgs_num, grade, start=None, end=None,
+                  per_snapshot=False):
+    """
+    Range query: how the price of a coin at a grade moved between two times
+
+    :param conn: (sqlite3.Connection) from connect
+    :param pcgs_num: (str) PCGS number
+    :param grade: (int) grade
+    :param start: (datetime or str) start of the range, None for the first scrape
+    :param end: (datetime or str) end of the range, None for the last scrape
+    :param per_snapshot: (bool) one item per scrape instead of per run
+    :return history: (list(tuple)) (start_at, end_at, price, price_plus) for
+        each run of the same price overlapping the range, in order, end_at is
+        None for the current price. If per_snapshot, (taken_at, price,
+        price_plus) for each scrape in the range the coin was in
+    """
+    start = '' if start is None else as_time(start)
+    end = '~' if end is None else as_time(end)
+    if not per_snapshot:
+        return conn.execute(
+            'SELECT start_at, end_at, price, price_plus FROM price_runs '
+            'WHERE pcgs_num = ? AND grade = ? AND start_at <= ? '
+            'AND (end_at IS NULL OR end_at > ?) ORDER BY start_at',
+            (pcgs_num, grade, end, start)).fetchall()
+    return conn.execute(
+        'SELECT taken_at, price, price_plus FROM price_runs JOIN snapshots '
+        'ON taken_at >= start_at AND (end_at IS NULL OR taken_at < end_at) '
+        'WHERE pcgs_num = ? AND grade = ? AND taken_at BETWEEN ? AND ? '
+        'ORDER BY taken_at', (pcgs_num, grade, start, end)).fetchall()
+
+
+def history_stats(conn):
+    """
+    :param conn: (sqlite3.Connection) from connect
+    :return stats: (dict) number of scrapes, runs and prices stored
+    """
+    snapshots, prices = conn.execute(
+        'SELECT COUNT(*), COALESCE(SUM(coins), 0) FROM snapshots').fetchone()
+    runs, = conn.execute('SELECT COUNT(*) FROM price_runs').fetchone()
+    first, last = conn.execute(
+        'SELECT MIN(taken_at), MAX(taken_at) FROM snapshots').fetchone()
+    return {'snapshots': snapshots, 'first': first, 'last': last,
+            'coin_snapshots': prices, 'runs': runs}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--history', action='store', default=PRICE_HISTORY_FILE,
+                        help=f'history database, defaults to '
+                             f'{PRICE_HISTORY_FILE}')
+    commands = parser.add_subparsers(dest='command', required=True)
+    add_parser = commands.add_parser(
+        'add', help='add scrapes saved by pcgs_prices.py to the history')
+    add_parser.add_argument('files', nargs='+',
+                            help='pcgs_prices_unprocessed-*.pkl files, added '
+                                 'in the order they were taken')
+    at_parser = commands.add_parser(
+        'at', help='prices of a coin at a point in time')
+    at_parser.add_argument('pcgs_num')
+    at_parser.add_argument('--grade', '-g', action='store', type=int)
+    at_parser.add_argument('--when', '-w', action='store',
+                           help='e.g. 2021-06-01, defaults to the last scrape')
+    history_parser = commands.add_parser(
+        'history', help='how the price of a coin at a grade moved over time')
+    history_parser.add_argument('pcgs_num')
+    history_parser.add_argument('--grade', '-g', action='store', type=int,
+                                required=True)
+    history_parser.add_argument('--start', '-s', action='store')
+    history_parser.add_argument('--end', '-e', action='store')
+    history_parser.add_argument('--per_snapshot', action='store_true',
+                                help='one line per scrape instead of per run '
+                                     'of the same price')
+    commands.add_parser('stats', help='what is in the history')
+    args = parser.parse_args()
+
+    history_conn = connect(args.history)
+    if args.command == 'add':
+        from pcgs_scraper.pcgs_prices import snapshot_time
+        for snapshot_file in sorted(args.files, key=snapshot_time):
+            try:
+                if add_snapshot_file(history_conn, snapshot_file):
+                    print(f'Added {snapshot_file}')
+                else:
+                    print(f'Already in the history: {snapshot_file}')
+            except ValueError as e:
+                sys.exit(str(e))
+    elif args.command == 'at':
+        at_prices = price_at(history_conn, args.pcgs_num, args.grade,
+                             args.when)
+        if args.grade is not None:
+            at_prices = {args.grade: at_prices}
+        print(f'PCGS#{args.pcgs_num} as of '
+              f'{snapshot_at(history_conn, args.when)}')
+        for at_grade, at_price in at_prices.items():
+            print(f'{at_grade:>4}  {at_price}')
+    elif args.command == 'history':
+        for history_row in price_history(history_conn, args.pcgs_num,
+                                         args.grade, args.start, args.end,
+                                         args.per_snapshot):
+            print('  '.join(str(value) for value in history_row))
+    elif args.command == 'stats':
+        for stat, value in history_stats(history_conn).items():
+            print(f'{stat:<16}{value}')
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+ranking.py
+
+Ranking engine for query results: Levenshtein edit distance computed with the
+bit-parallel algorithm of Myers (1999) as described by Hyyrö (2001), which
+handles a whole column of the dynamic programming table with a few integer
+operations per character. Combined with an early exit once a candidate can no
+longer make the top k, and a bounded heap so only the top k are kept
+
+Gives the same distances as nltk.metrics.edit_distance with its defaults
+(substitution cost 1, no transpositions)
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import heapq
+from functools import lru_cache
+
+
+@lru_cache(maxsize=65536)
+def pattern_masks(pattern):
+    """
+    Bit mask of the positions of each character in pattern, cached since the
+    same descriptions and queries come up over and over
+
+    :param pattern: (str) string to make masks for
+    :return masks: (dict) character -> int with bit i set if pattern[i] is
+        that character
+    """
+    masks = {}
+    for i, char in enumerate(pattern):
+        masks[char] = masks.get(char, 0) | (1 << i)
+    return masks
+
+
+def edit_distance(s1, s2, max_distance=None):
+    """
+    Levenshtein edit distance
+
+    :param s1: (str) first string
+    :param s2: (str) second string
+    :param max_distance: (int) if given, stop as soon as the distance is known
+        to be more than this, a value above max_distance is returned then
+    :return distance: (int) edit distance between s1 and s2, or a lower bound
+        of it greater than max_distance
+    """
+    # the shorter string is the pattern, fewer bits per operation
+    if len(s1) > len(s2):
+        s1, s2 = s2, s1
+    m, n = len(s1), len(s2)
+    if m == 0:
+        return n
+    if max_distance is not None and n - m > max_distance:
+        return n - m
+
+    masks = pattern_masks(s1)
+    full = (1 << m) - 1
+    high = 1 << (m - 1)
+    vp = full       # vertical positive deltas
+    vn = 0          # vertical negative deltas
+    score = m
+    for j, char in enumerate(s2):
+        eq = masks.get(char, 0)
+        xv = eq | vn
+        xh = (((eq & vp) + vp) ^ vp) | eq
+        hp = vn | (~(xh | vp) & full)
+        hn = vp & xh
+        if hp & high:
+            score += 1
+        elif hn & high:
+            score -= 1
+        hp = ((hp << 1) | 1) & full
+        hn = (hn << 1) & full
+        vp = hn | (~(xv | hp) & full)
+        vn = hp & xv
+        if max_distance is not None:
+            # each remaining character can lower the score by at most one
+            lower_bound = score - (n - j - 1)
+            if lower_bound > max_distance:
+                return lower_bound
+    return score
+
+
+def rank(query, results, k=None, key='description'):
+    """
+    Rank results by lowest-highest edit distance of their description to the
+    query, ties keep their original order. An exact match returns just that
+    result
+
+    :param query: (str) normalized query
+    :param results: (list(dict)) candidates
+    :param k: (int) only return the best k, None for all
+    :param key: key of the text to compare the query to
+    :return ranked: (list(dict)) sorted results
+    """
+    for result in results:
+        if result[key] == query:        # exact match
+            return [result]
+
+    if k is None or k >= len(results):
+        scores = [(edit_distance(query, result[key]), i)
+                  for i, result in enumerate(results)]
+        scores.sort()
+        return [results[i] for _, i in scores]
+
+    if k <= 0:
+        return []
+
+    # max heap (by negating) of the best k so far, worst on top
+    heap = []
+    for i, result in enumerate(results):
+        if len(heap) < k:
+            score = edit_distance(query, result[key])
+            heapq.heappush(heap, (-score, -i))
+            continue
+        worst = -heap[0][0]
+        # a later candidate has to be strictly better to beat a tie
+        score = edit_distance(query, result[key], max_distance=worst - 1)
+        if score < worst:
+            heapq.heapreplace(heap, (-score, -i))
+    best = sorted((-score, -i) for score, i in heap)
+    return [results[i] for _, i in best]
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+ratelimit.py
+
+rate limiting for scraping, keeps the total request rate to a host under a
+given budget no matter how many requests are in flight at once
+
+The budget shared by the scrapers is adaptive (AdaptiveRateLimiter): it grows
+while pcgs.com answers and is cut when it answers 429, and the rate that last
+worked is saved to data/rate_state.json for the next run
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import os
+import json
+import time
+import asyncio
+import threading
+from urllib.parse import urlparse
+
+from pcgs_scraper.config import data_path
+from pcgs_scraper.metrics import get_metrics
+
+RATE_STATE_FILE = data_path('rate_state.json')
+
+
+class TokenBucket:
+    """
+    Token bucket limiter, tokens refill at `rate` per second up to `capacity`
+
+    Each request takes one token. When the bucket is empty the token is
+    reserved anyway and the caller is told how long to wait for it, so waiting
+    callers are served in the order they asked and the rate is never exceeded
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: (float) requests per second
+        :param capacity: (float) max burst size, defaults to one second's worth
+            of tokens (at least 1)
+        """
+        if rate <= 0:
+            raise ValueError(f'rate must be positive, got {rate}')
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token from the bucket
+
+        :return wait_s: (float) seconds to wait before the token may be used
+        """
+        with self._lock:
+            self.refill(time.monotonic())
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def refill(self, now):
+        # callers hold the lock
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def set_rate(self, rate):
+        """
+        :param rate: (float) new requests per second, tokens already reserved
+            keep their place in line
+        """
+        with self._lock:
+            self.refill(time.monotonic())
+            self.rate = rate
+
+    def pause(self, seconds):
+        """
+        Hold back every token not yet reserved for at least `seconds`
+
+        :param seconds: (float) e.g. the retry-after of a 429
+        """
+        with self._lock:
+            self.refill(time.monotonic())
+            self._tokens = min(self._tokens, 1 - seconds * self.rate)
+
+    def acquire(self):
+        """ Block until a token is available """
+        wait_s = self.reserve()
+        if wait_s > 0:
+            get_metrics().inc('pcgs_wait_seconds_total', wait_s,
+                              cause='rate_limit')
+            time.sleep(wait_s)
+
+    async def acquire_async(self):
+        """ Wait (without blocking the event loop) until a token is available """
+        wait_s = self.reserve()
+        if wait_s > 0:
+            get_metrics().inc('pcgs_wait_seconds_total', wait_s,
+                              cause='rate_limit')
+            await asyncio.sleep(wait_s)
+
+
+class HostRateLimiter:
+    """
+    One TokenBucket per host, all sharing the same rate budget settings
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: (float) requests per second allowed to each host
+        :param capacity: (float) burst size for each host, see TokenBucket
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url):
+        """
+        :param url: (str) url about to be requested
+        :return bucket: (TokenBucket) the bucket for the url's host
+        """
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate, self.capacity)
+            return self._buckets[host]
+
+    def acquire(self, url):
+        self.bucket(url).acquire()
+
+    async def acquire_async(self, url):
+        await self.bucket(url).acquire_async()
+
+    # a fixed budget ignores how pcgs.com answers, see AdaptiveRateLimiter
+    def on_success(self, url):
+        pass
+
+    def on_throttle(self, url, retry_after=None, sent_at=None):
+        pass
+
+    def save(self):
+        pass
+
+
+# requests per second to pcgs.com shared by all scrapers that do not bring
+# their own limiter, same pace as the old 2s sleep between coinfacts pages.
+# The adaptive limiter starts here and stays between MIN_RATE and MAX_RATE
+DEFAULT_RATE = 0.5
+MIN_RATE = 0.05
+MAX_RATE = 5.0
+# requests per second added per second of successful requests
+RATE_INCREASE = 0.05
+# the rate is multiplied by this on a 429
+RATE_DECREASE = 0.5
+
+
+class AdaptiveRateLimiter(HostRateLimiter):
+    """
+    AIMD rate budget per host: the rate grows additively, by `increase`
+    requests per second for each second of successful requests, and is cut
+    multiplicatively on a 429, to `decrease` times the rate or the one request
+    per retry-after the server asked for if that is slower. After a cut the
+    host is paused for the retry-after, and 429s of requests sent before the
+    cut (the rest of the same burst) do not cut it again.
+
+    The rate of each host is saved to state_path on every cut and on save(),
+    and a new limiter starts each host at its saved rate
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, floor=MIN_RATE, ceiling=MAX_RATE,
+                 increase=RATE_INCREASE, decrease=RATE_DECREASE,
+                 state_path=RATE_STATE_FILE):
+        """
+        :param rate: (float) requests per second of hosts with no saved rate
+        :param floor: (float) the rate is never cut below this
+        :param ceiling: (float) the rate never grows above this
+        :param increase: (float) see class docstring
+        :param decrease: (float) see class docstring, between 0 and 1
+        :param state_path: (str) json file of the rate of each host, None to
+            neither load nor save it
+        """
+        if not 0 < floor <= ceiling:
+            raise ValueError(f'need 0 < floor <= ceiling, got {floor}, '
+                             f'{ceiling}')
+        if not 0 < decrease < 1:
+            raise ValueError(f'decrease must be between 0 and 1, got '
+                             f'{decrease}')
+        # no bursts, requests are spaced 1 / rate apart
+        super().__init__(rate, capacity=1)
+        self.floor = floor
+        self.ceiling = ceiling
+        self.increase = increase
+        self.decrease = decrease
+        self.state_path = state_path
+        self.saved = load_rate_state(state_path) if state_path else {}
+        self._cut_at = {}
+
+    def clamp(self, rate):
+        return min(self.ceiling, max(self.floor, rate))
+
+    def bucket(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._buckets:
+                rate = self.saved.get(host, {}).get('rate', self.rate)
+                self._buckets[host] = TokenBucket(self.clamp(rate),
+                                                  self.capacity)
+            return self._buckets[host]
+
+    def rates(self):
+        """
+        :return rates: (dict) host -> current requests per second
+        """
+        with self._lock:
+            return {host: bucket.rate for host, bucket in self._buckets.items()}
+
+    def on_success(self, url):
+        """
+        :param url: (str) url that was answered
+        """
+        bucket = self.bucket(url)
+        with self._lock:
+            bucket.set_rate(self.clamp(bucket.rate +
+                                       self.increase / bucket.rate))
+
+    def on_throttle(self, url, retry_after=None, sent_at=None):
+        """
+        :param url: (str) url that was answered 429
+        :param retry_after: (float) seconds the server asked to wait
+        :param sent_at: (float) time.monotonic() when the request was sent
+        """
+        host = urlparse(url).netloc
+        bucket = self.bucket(url)
+        with self._lock:
+            if sent_at is not None and sent_at < self._cut_at.get(host, 0.0):
+                return      # sent before the last cut, same burst
+            rate = bucket.rate * self.decrease
+            if retry_after:
+                rate = min(rate, 1 / retry_after)
+            bucket.set_rate(self.clamp(rate))
+            if retry_after:
+                bucket.pause(retry_after)
+            self._cut_at[host] = time.monotonic()
+        get_metrics().inc('pcgs_rate_cuts_total', host=host)
+        self.save()
+
+    def save(self):
+        """ Save the rate of every host to state_path """
+        if self.state_path is None:
+            return
+        from pcgs_scraper.cache import atomic_write
+
+        now = time.time()
+        with self._lock:
+            for host, bucket in self._buckets.items():
+                self.saved[host] = {'rate': round(bucket.rate, 4),
+                                    'saved': now}
+            data = json.dumps(self.saved, indent=2, sort_keys=True)
+        atomic_write(os.path.abspath(self.state_path), data.encode('utf-8'))
+
+
+def load_rate_state(state_path=RATE_STATE_FILE):
+    """
+    :param state_path: (str) json file saved by AdaptiveRateLimiter.save
+    :return state: (dict) host -> {'rate': float, 'saved': timestamp}, empty
+        if there is no file or it can not be read
+    """
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return state if isinstance(state, dict) else {}
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """
+    :return limiter: (AdaptiveRateLimiter) global rate budget shared by all
+        scrapers, created on first use, or the limiter given to set_limiter
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = AdaptiveRateLimiter()
+        return _limiter
+
+
+def set_limiter(limiter):
+    """
+    Replace the global rate budget
+
+    :param limiter: (HostRateLimiter) new shared limiter
+    """
+    global _limiter
+    _limiter = limiter
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+records.py
+
+Compact record types for the data the scrapers produce. A price guide used to
+be dicts all the way down, most of its memory going to dict overhead and the 30
+(price, price_plus) tuples of each coin. These records keep the same data in
+__slots__ and flat tuples, and intern values that repeat across coins (pcgs
+numbers, designations, grade bins, urls, mint marks, prices), so one copy is
+shared. See benchmarks/record_memory.py for the memory per coin
+
+    PriceRow:    one row of a price table, from pcgs_prices.get_prices
+    MergedEntry: the rows of every grade bin of a coin, from merge_grade_bins
+    Coin:        a coin of the price guide, from combine_number_price
+    GradePrices: grade -> (price, price_plus), the 'prices' of the above
+
+They behave like the dicts they replace: coin['prices'][65], coin.get('mint'),
+iteration in the same key order, == with dicts. Fields that used to be lists
+(e.g. 'desig') are stored as shared tuples and read as new lists, so
+coin['desig'] == ['MS', 'RD'] still holds, but changing the list does not
+change the record, set the key instead. Setting a key a record does not have
+keeps it in a dict on the side. json.dump needs default=to_json to write them
+
+Records are pickled as the plain dicts and lists of v0.0.4, so saved files
+load without pcgs_scraper and compare equal to older ones. Loaders make them
+compact again, see compact_coins
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import gc
+import sys
+from itertools import chain
+from contextlib import contextmanager
+from collections.abc import Mapping, MutableMapping
+
+
+class _Missing:
+    """ Value of a field that was never set or was deleted """
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'MISSING'
+
+    def __reduce__(self):
+        return 'MISSING'
+
+
+MISSING = _Missing()
+
+# one shared tuple per distinct designation, there are only a few dozen
+_DESIGS = {}
+# one shared grade -> position lookup per distinct set of grades
+_POSITIONS = {}
+# one shared copy of each distinct price text, see GradePrices
+_PRICES = {}
+
+
+def intern(value):
+    """
+    :param value: any value
+    :return value: value, the shared copy of it if it is a str
+    """
+    if type(value) is str:
+        return sys.intern(value)
+    return value
+
+
+def intern_desig(desig):
+    """
+    :param desig: (list(str)) designation, e.g. ['MS', 'RD']
+    :return desig: (tuple(str)) shared tuple of the designation
+    """
+    if desig is None:
+        return None
+    desig = tuple(intern(part) for part in desig)
+    return _DESIGS.setdefault(desig, desig)
+
+
+def intern_pairs(pairs):
+    """
+    :param pairs: (list(tuple)) prices of a price row, see parsers.price_cell
+    :return pairs: (tuple(tuple)) the same prices with interned strings
+    """
+    flat = tuple(chain.from_iterable(pairs))
+    shared = iter(map(_PRICES.setdefault, flat, flat))
+    return tuple(zip(shared, shared))
+
+
+def intern_tuple(values):
+    """
+    :param values: (list) or None
+    :return values: (tuple) or None
+    """
+    if values is None:
+        return None
+    return tuple(values)
+
+
+class GradePrices(Mapping):
+    """
+    Read-only grade -> (price, price_plus) mapping over one flat tuple
+    """
+    __slots__ = ('positions', 'flat')
+
+    def __init__(self, prices=()):
+        """
+        :param prices: (dict) grade -> (price, price_plus), or a list of
+            (grade, (price, price_plus))
+        """
+        if isinstance(prices, Mapping):
+            grades = tuple(prices)
+            pairs = prices.values()
+        else:
+            prices = list(prices)
+            grades = tuple(grade for grade, _ in prices)
+            pairs = [pair for _, pair in prices]
+        self.positions = self.grade_positions(grades)
+        # runs for every price of a loaded guide, map over the bound
+        # setdefault shares one copy of each price without a python call each
+        flat = tuple(chain.from_iterable(pairs))
+        self.flat = tuple(map(_PRICES.setdefault, flat, flat))
+
+    @staticmethod
+    def grade_positions(grades):
+        """
+        :param grades: (iterable) grades in order
+        :return positions: (dict) shared grade -> index lookup
+        """
+        grades = tuple(grades)
+        positions = _POSITIONS.get(grades)
+        if positions is None:
+            positions = {grade: i for i, grade in enumerate(grades)}
+            _POSITIONS[grades] = positions
+        return positions
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+    def __getitem__(self, grade):
+        i = 2 * self.positions[grade]
+        return self.flat[i], self.flat[i + 1]
+
+    def __contains__(self, grade):
+        return grade in self.positions
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __repr__(self):
+        return f'GradePrices({dict(self)!r})'
+
+
+def grade_prices(prices):
+    """
+    :param prices: (dict) grade -> (price, price_plus)
+    :return prices: (GradePrices) prices, as is if it already is one
+    """
+    if prices is None or type(prices) is GradePrices:
+        return prices
+    return GradePrices(prices)
+
+
+class Record(MutableMapping):
+    """
+    Dict-like record with a fixed set of keys kept in __slots__. Subclasses
+    set FIELDS, the keys in order, CONVERT, key -> function applied to values
+    as they are set (e.g. intern), and LISTS, keys that were lists before
+    v0.0.5, stored as tuples and read as lists
+    """
+    __slots__ = ('_extra',)
+    FIELDS = ()
+    _fields = frozenset()
+    CONVERT = {}
+    LISTS = frozenset()
+
+    def __init__(self, *args, **kwargs):
+        """
+        :param args, kwargs: same as dict()
+        """
+        self._extra = None
+        if len(args) == 1 and not kwargs and type(args[0]) is dict:
+            self._set_all(args[0])      # fast path, e.g. a loaded pickle
+            return
+        for field in self.FIELDS:
+            setattr(self, field, MISSING)
+        self.update(*args, **kwargs)
+
+    def _set_all(self, values):
+        """
+        :param values: (dict) every key and value of the record
+        """
+        found = 0
+        for field in self.FIELDS:
+            value = values.get(field, MISSING)
+            if value is not MISSING:
+                found += 1
+                convert = self.CONVERT.get(field)
+                if convert is not None:
+                    value = convert(value)
+            setattr(self, field, value)
+        if found < len(values):
+            self._extra = {key: value for key, value in values.items()
+                           if key not in self._fields}
+
+    def __reduce__(self):
+        return dict, (self.plain(),)
+
+    def plain(self):
+        """
+        :return record: (dict) the record as the plain dicts and lists it
+            replaces, records it holds (e.g. in 'merged_from') included
+        """
+        return {key: plain(value) for key, value in self.items()}
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            value = getattr(self, key)
+            if value is MISSING:
+                raise KeyError(key)
+            if key in self.LISTS and value is not None:
+                return list(value)
+            return value
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self._fields:
+            convert = self.CONVERT.get(key)
+            setattr(self, key, value if convert is None else convert(value))
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._fields:
+            if getattr(self, key) is MISSING:
+                raise KeyError(key)
+            setattr(self, key, MISSING)
+        else:
+            if self._extra is None:
+                raise KeyError(key)
+            del self._extra[key]
+
+    def __contains__(self, key):
+        if key in self._fields:
+            return getattr(self, key) is not MISSING
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for field in self.FIELDS:
+            if getattr(self, field) is not MISSING:
+                yield field
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        count = sum(getattr(self, field) is not MISSING
+                    for field in self.FIELDS)
+        if self._extra is not None:
+            count += len(self._extra)
+        return count
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self)!r})'
+
+
+class PriceRow(Record):
+    """ One row of a price table, see parsers.Bs4Backend.price_rows """
+    FIELDS = ('pcgs_num', 'description', 'desig', 'grades', 'prices', 'url')
+    __slots__ = FIELDS
+    _fields = frozenset(FIELDS)
+    CONVERT = {
+        'pcgs_num': intern,
+        'desig': intern_desig,
+        'grades': intern,
+        'prices': intern_pairs,
+        'url': intern,
+    }
+    LISTS = frozenset(('desig', 'prices'))
+
+
+def price_rows(rows):
+    """
+    :param rows: (list(dict)) price rows, e.g. the plain dicts of a loaded
+        price guide, or None
+    :return rows: (tuple(PriceRow)) or None
+    """
+    if rows is None:
+        return None
+    return tuple(row if type(row) is PriceRow else PriceRow(row)
+                 for row in rows)
+
+
+class MergedEntry(Record):
+    """ Every grade bin of a coin merged, see pcgs_prices.merge_entries """
+    FIELDS = ('pcgs_num', 'desig', 'prices', 'merged_from')
+    __slots__ = FIELDS
+    _fields = frozenset(FIELDS)
+    CONVERT = {
+        'pcgs_num': intern,
+        'desig': intern_desig,
+        'prices': grade_prices,
+        'merged_from': price_rows,
+    }
+    LISTS = frozenset(('desig', 'merged_from'))
+
+
+class Coin(Record):
+    """ A coin of the price guide, see scraper.join_number_price """
+    FIELDS = ('pcgs_num', 'description', 'desig', 'prices', 'image', 'images',
+              'narrative', 'coinfacts_url', 'merged_from', 'year_short',
+              'year_full', 'mint', 'denom', 'detail')
+    __slots__ = FIELDS
+    _fields = frozenset(FIELDS)
+    CONVERT = {
+        'pcgs_num': intern,
+        'desig': intern_desig,
+        'prices': grade_prices,
+        'images': intern_tuple,
+        'year_short': intern,
+        'year_full': intern,
+        'mint': intern,
+        'denom': intern,
+    }
+    LISTS = frozenset(('desig', 'images'))
+
+
+def plain(value):
+    """
+    :param value: a record, GradePrices, or a list or tuple of them, or any
+        other value
+    :return value: the value with every record made a plain dict, see
+        Record.plain
+    """
+    if isinstance(value, Record):
+        return value.plain()
+    if type(value) is GradePrices:
+        return dict(value)
+    if type(value) is list:
+        return [plain(item) for item in value]
+    return value
+
+
+@contextmanager
+def gc_paused():
+    """
+    Pause the cyclic garbage collector while many records are made, records
+    are tracked by it (dicts of strings are not), so it would otherwise scan
+    every record made so far again and again. Records never form cycles
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def compact_coins(coins):
+    """
+    Make the coins of a loaded price guide compact records again, one at a
+    time so the plain dicts are freed as they are replaced. This is what
+    loading them costs on top of pickle.load, see benchmarks/record_memory.py
+
+    :param coins: (list(dict)) price guide, e.g. loaded from a pkl file
+    :return coins: (list(Coin)) the same list, changed in place
+    """
+    with gc_paused():
+        for i, coin in enumerate(coins):
+            if type(coin) is not Coin:
+                coins[i] = Coin(coin)
+    return coins
+
+
+def to_json(value):
+    """
+    default= function for json.dump and json.dumps to write records
+
+        json.dumps(coin, default=to_json)
+
+    :param value: value json can not serialize
+    :return: a dict json can serialize
+    """
+    if isinstance(value, (Record, GradePrices)):
+        return plain(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON '
+                    f'serializable')
@@ -16,11 +16,24 @@ twitter: @ryanamannion
 import sys
 import json
 import pickle
+import argparse
+import tracemalloc
 from os.path import isfile
+from itertools import chain
+from contextlib import contextmanager
 
 from pcgs_scraper import pcgs_nums
 from pcgs_scraper import pcgs_prices
-from pcgs_scraper.utils import parse_descriptions
+from pcgs_scraper.config import data_path, ensure_parent
+from pcgs_scraper.journal import Journal, load_chunks
+from pcgs_scraper.records import Coin, to_json
+from pcgs_scraper.utils import parse_description_set, DESCRIPTION_CACHE_FILE
+from pcgs_scraper.price_db import write_price_db, PRICE_DB_FILE
+from pcgs_scraper.pcgs_query import build_query_index, save_query_index, \
+    PRICE_GUIDE_FILE
+
+PRICE_GUIDE_JSON = data_path('pcgs_price_guide.json')
+PROVENANCE_FILE = data_path('pcgs_price_guide.provenance')
 
 
 def prompt(message):
@@ -33,48 +46,114 @@ def prompt(message):
     prompt(message)
 
 
-def combine_number_price():
-    """
-    Combine the scraped number data and descriptions with the price information
+def join_number_price(price_guide, pcgs_numbers, slim=False, provenance=None,
+                      cache_path=None):
     """
-    price_guide = pickle.load(open('data/scraped_pcgs_prices.pkl', 'rb')) # dict
-    pcgs_numbers = pickle.load(open('data/number_data.pkl', 'rb'))       # ft
-
-    # -1 because of the None tags
-    print(f"Price guide contains {len(price_guide) - 1} entries")
-    print(f"Detailed PCGS # to description mapping contains "
-          f"{len(pcgs_numbers)} entries")
+    Streaming join of the price data and the number data: coins are made one
+    at a time and both inputs are emptied as they are joined, so the records a
+    coin was made from can be freed as soon as it is made. Given the price
+    guide in chunks, only one chunk of it is in memory at a time
 
+    :param price_guide: (dict) output of merge_grade_bins, or an iterable of
+        its chunks (see load_inputs), emptied
+    :param pcgs_numbers: (list(dict)) output of pcgs_nums, emptied
+    :param slim: (bool) leave out 'merged_from', the price and number records
+        each coin was made from, which are most of the size of the price guide
+    :param provenance: (function) append(pcgs_num, records) from
+        Journal.batch, if given the records each coin was made from are
+        written to it
+    :param cache_path: (str) description cache, see utils.parse_descriptions
+    :return: generator of Coin (see records.py), in price guide order
+    """
     # organize numbers data to be a dict that points from pcgs# to coin entry
     pcgs_number_lookup = {}
     for entry in pcgs_numbers:
         pcgs_number_lookup[entry['pcgs_num']] = entry
+    pcgs_numbers.clear()
 
-    coins_w_price_and_detail = []
-    for number, price_entry in price_guide.items():
-        try:
-            # see if pcgsnolookup page data has a number for this coin
-            detail = pcgs_number_lookup[number]
-        except KeyError:
-            # for debugging, see note below
+    # parse dscription and add year, denom, mint, descriptions parsed by a
+    # previous run are reused. The price guide may not be read yet, so this
+    # includes the few numbers that have no prices
+    parsed_descriptions = parse_description_set(
+        (detail['description'] for detail in pcgs_number_lookup.values()),
+        cache_path)
+
+    if isinstance(price_guide, dict):
+        price_guide = [price_guide]
+    for number, price_entry in popped_items(price_guide):
+        # see if pcgsnolookup page data has a number for this coin
+        detail = pcgs_number_lookup.pop(number, None)
+        if detail is None:
+            # for debugging, see note in combine_number_price
             # print(f'KeyError for key: {number}', end=" ", flush=True)
             # print('continuing...')
             continue
-        coin = {
-            'pcgs_num': price_entry['pcgs_num'],
-            'description': detail['description'],
-            'desig': price_entry['desig'],
-            'prices': price_entry['prices'],
-            'image': detail['image'],
-            'images': detail['images'],
-            'narrative': detail['narrative'],
-            'coinfacts_url': detail['coinfacts_url'],
-            'merged_from': [price_entry, detail]
-        }
-        coins_w_price_and_detail.append(coin)
-
-    # parse dscription and add year, denom, mint
-    coins_full_data = parse_descriptions(coins_w_price_and_detail)
+        coin = Coin(
+            pcgs_num=price_entry['pcgs_num'],
+            description=detail['description'],
+            desig=price_entry['desig'],
+            prices=price_entry['prices'],
+            image=detail['image'],
+            images=detail['images'],
+            narrative=detail['narrative'],
+            coinfacts_url=detail['coinfacts_url'],
+        )
+        if not slim:
+            coin['merged_from'] = [price_entry, detail]
+        if provenance is not None:
+            provenance(number, [price_entry, detail])
+        year_short, year_full, mint, denom, detail_text = \
+            parsed_descriptions[detail['description']]
+        coin['year_short'] = year_short
+        coin['year_full'] = year_full
+        coin['mint'] = mint
+        coin['denom'] = denom
+        coin['detail'] = detail_text
+        yield coin
+
+
+def popped_items(chunks):
+    """
+    :param chunks: iterable of dicts, each emptied as it is read
+    :return: generator of (key, value) of every chunk, in order
+    """
+    for chunk in chunks:
+        for key in list(chunk):
+            yield key, chunk.pop(key)
+
+
+def load_inputs():
+    """
+    v0.0.5: the price data is read one chunk at a time as it is joined, only
+    the number data is loaded in full (see journal.load_chunks)
+
+    :return price_guide, pcgs_numbers: generator of chunks of the merged price
+        data from pcgs_prices.py and number data from pcgs_nums.py
+    """
+    price_guide = load_chunks(pcgs_prices.PRICE_GUIDE_FILE)       # dicts
+    pcgs_numbers = list(chain.from_iterable(
+        load_chunks(pcgs_nums.NUMS_FILE)))                        # ft
+
+    print(f"Reading price guide from {pcgs_prices.PRICE_GUIDE_FILE} as it "
+          f"is joined")
+    print(f"Detailed PCGS # to description mapping contains "
+          f"{len(pcgs_numbers)} entries")
+    return price_guide, pcgs_numbers
+
+
+def combine_number_price(db_path=None, slim=False, provenance_path=None):
+    """
+    Combine the scraped number data and descriptions with the price information
+
+    :param db_path: (str) if given, also write the price guide to a SQLite
+        database at this path, see pcgs_scraper.price_db
+    :param slim: (bool) leave out 'merged_from' from each coin, see
+        join_number_price
+    :param provenance_path: (str) if given, save the records each coin was
+        made from to this journal instead, read it back with load_provenance
+    :return coins_full_data: (list(dict)) the price guide
+    """
+    price_guide, pcgs_numbers = load_inputs()
 
     # So here was the point when I realized there are about 3000 PCGS numbers in
     # the price guide that when you look them up on pcgs.com/pcgsnolookup it
@@ -83,13 +162,96 @@ def combine_number_price():
     # ... huh?? So I did some digging and it looks like those may be the prices
     # for different sets or type coins
 
+    with provenance_journal(provenance_path) as provenance:
+        coins_full_data = list(join_number_price(
+            price_guide, pcgs_numbers, slim=slim, provenance=provenance,
+            cache_path=DESCRIPTION_CACHE_FILE))
+
+    if db_path is not None:
+        write_price_db(coins_full_data, db_path)
+        print(f"Saved price guide database to {db_path}")
+
     return coins_full_data
 
 
-def cli():
+def stream_number_price(db_path=PRICE_DB_FILE, provenance_path=None):
+    """
+    Slim join of the number data and the price information written straight
+    to a SQLite price guide, the coins are never all in memory at once
+
+    :param db_path: (str) SQLite price guide to write, see pcgs_scraper.price_db
+    :param provenance_path: (str) if given, save the records each coin was
+        made from to this journal, see load_provenance
+    :return count: (int) number of coins written
+    """
+    price_guide, pcgs_numbers = load_inputs()
+    with provenance_journal(provenance_path) as provenance:
+        count = write_price_db(join_number_price(
+            price_guide, pcgs_numbers, slim=True, provenance=provenance,
+            cache_path=DESCRIPTION_CACHE_FILE), db_path)
+    print(f"Saved {count} coins to price guide database {db_path}")
+    return count
+
+
+@contextmanager
+def provenance_journal(provenance_path=None):
+    """
+    :param provenance_path: (str) journal to write provenance records to, it is
+        replaced if it exists. None to not keep provenance
+    :return: context manager giving an append(pcgs_num, records) function, or
+        None if provenance_path is None
+    """
+    if provenance_path is None:
+        yield None
+        return
+    journal = Journal(provenance_path)
+    journal.remove()
+    with journal.batch() as append:
+        yield append
+    print(f"Saved provenance of the price guide to {provenance_path}")
+
+
+def load_provenance(pcgs_nums=None, provenance_path=PROVENANCE_FILE):
+    """
+    :param pcgs_nums: (set) PCGS numbers to load, None for all
+    :param provenance_path: (str) journal written by combine_number_price
+    :return provenance: (dict) pcgs_num -> [price_entry, detail], what
+        'merged_from' holds in a price guide that is not slim
+    """
+    return {pcgs_num: records for pcgs_num, records in Journal(provenance_path)
+            if pcgs_nums is None or pcgs_num in pcgs_nums}
+
+
+def traced(function, *args, trace_memory=False, **kwargs):
+    """
+    :param function: function to call
+    :param trace_memory: (bool) print the peak memory allocated by the call,
+        measured with tracemalloc, which slows it down
+    :return: output of function
+    """
+    if not trace_memory:
+        return function(*args, **kwargs)
+    tracemalloc.start()
+    try:
+        output = function(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    print(f"Peak memory of {function.__name__}: {peak / 2 ** 20:.1f} MiB")
+    return output
+
+
+def cli(slim=False, provenance_path=None, stream_db=False, trace_memory=False):
+    """
+    :param slim: (bool) leave out 'merged_from' from each coin
+    :param provenance_path: (str) journal to save 'merged_from' to instead
+    :param stream_db: (bool) write the price guide straight to the SQLite
+        database without keeping it in memory or asking what to save
+    :param trace_memory: (bool) print the peak memory of combining
+    """
     # ensure user has the necessary files
-    if isfile('data/scraped_pcgs_prices.pkl') \
-            and isfile('data/number_data.pkl'):
+    if isfile(pcgs_prices.PRICE_GUIDE_FILE) \
+            and isfile(pcgs_nums.NUMS_FILE):
 
         # check if user wants to redownload prices
         msg = "It looks like you have already scraped data, would you like to" \
@@ -98,7 +260,7 @@ def cli():
         response = prompt(msg)
         if response:
             msg = "WARNING: This operation will overwrite files with the " \
-                  "name: data/scraped_pcgs_prices.pkl\n" \
+                  f"name: {pcgs_prices.PRICE_GUIDE_FILE}\n" \
                   "Are you sure you want to continue? y/n\n>"
             confirmation = prompt(msg)
             if confirmation:
@@ -106,29 +268,43 @@ def cli():
             else:
                 sys.exit()
 
-        detailed_price_guide = combine_number_price()
+        if stream_db:
+            traced(stream_number_price, PRICE_DB_FILE, provenance_path,
+                   trace_memory=trace_memory)
+            return
+
+        detailed_price_guide = traced(combine_number_price, slim=slim,
+                                      provenance_path=provenance_path,
+                                      trace_memory=trace_memory)
         msg = 'The PCGS Price Guide is complete. Would you like to save as a ' \
               'pickle file? This format is good for loading as a python ' \
               'object. y/n\n> '
         response = prompt(msg)
         if response:
             pickle.dump(detailed_price_guide,
-                        open('data/pcgs_price_guide.pkl', 'wb'))
+                        open(ensure_parent(PRICE_GUIDE_FILE), 'wb'))
+            save_query_index(build_query_index(detailed_price_guide),
+                             PRICE_GUIDE_FILE)
         msg = 'Would you like to save the PCGS Price Guide as a JSON file? ' \
               'y/n\n> '
         response = prompt(msg)
         if response:
-            with open('data/pcgs_price_guide.json', 'w') as outfile:
-                json.dump(detailed_price_guide, outfile)
+            with open(ensure_parent(PRICE_GUIDE_JSON), 'w') as outfile:
+                json.dump(detailed_price_guide, outfile, default=to_json)
+        msg = 'Would you like to save the PCGS Price Guide as a SQLite ' \
+              'database? This format is fastest to query. y/n\n> '
+        response = prompt(msg)
+        if response:
+            write_price_db(detailed_price_guide, PRICE_DB_FILE)
     # if they do not, prompt to download them
     else:
-        if not isfile('data/scraped_pcgs_prices.pkl'):
+        if not isfile(pcgs_prices.PRICE_GUIDE_FILE):
             price_prompt = "It looks like you are missing the pricing data. " \
                            "Would you like to scrape that data now? y/n\n> "
             download_price = prompt(price_prompt)
             if download_price:
                 pcgs_prices.main()
-        if not isfile('data/number_data.pkl'):
+        if not isfile(pcgs_nums.NUMS_FILE):
             number_prompt = "It looks like you are missing the PCGS number " \
                             "data. Would you like to scrape that data now? y/n" \
                             "\n> "
@@ -136,8 +312,22 @@ def cli():
             if download_numbers:
                 pcgs_nums.main()
         # try main again
-        cli()
+        cli(slim, provenance_path, stream_db, trace_memory)
 
 
 if __name__ == "__main__":
-    cli()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--slim', action='store_true',
+                        help="leave out 'merged_from', the records each coin "
+                             "was made from, which take most of the memory")
+    parser.add_argument('--provenance', action='store', nargs='?',
+                        const=PROVENANCE_FILE, default=None,
+                        help="save 'merged_from' to a journal instead, "
+                             f"default {PROVENANCE_FILE}")
+    parser.add_argument('--stream_db', action='store_true',
+                        help='slim join written straight to the SQLite price '
+                             'guide, lowest memory')
+    parser.add_argument('--trace_memory', action='store_true',
+                        help='print the peak memory of combining')
+    args = parser.parse_args()
+    cli(args.slim, args.provenance, args.stream_db, args.trace_memory)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+standin.py
+
+Local stand-in for pcgs.com: serves the pages of a synthetic catalog (see
+synthetic.py) with the markup the parsers expect, so the scrapers can be load
+tested without touching pcgs.com. Latency, throttling (429 with retry-after)
+and server errors can be injected
+
+    GET /prices                                  price guide categories
+    GET /prices/detail/<series>/<id>/<bin>       price table, every row
+    GET /pcgsnolookup/                           number lookup categories
+    GET /pcgsnolookup/<series>/<id>              PCGS numbers
+    GET /coinfacts/coin/<series>/<pcgs_num>      coinfacts page
+    GET /_standin/stats                          responses by status so far
+
+Point the scrapers at it with PCGS_BASE_URL, e.g.
+
+    $ python standin.py --coins 5000 --rate_limit 20 --latency 0.05
+    $ PCGS_BASE_URL=http://127.0.0.1:8766 python pcgs_prices.py --all -c 8
+
+or in python with start() and config.set_base_url
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import sys
+import json
+import time
+import math
+import random
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from urllib.parse import urlparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from pcgs_scraper.synthetic import SyntheticSite
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8766
+STATS_PATH = '/_standin/stats'
+
+
+class StandinServer(ThreadingHTTPServer):
+    """
+    HTTP server for a synthetic site, one thread per connection
+    """
+    daemon_threads = True
+
+    def __init__(self, address, site, latency_s=0.0, jitter_s=0.0,
+                 rate_limit=None, throttle_rate=0.0, retry_after_s=1,
+                 error_rate=0.0, seed=0, verbose=False):
+        """
+        :param address: (tuple) (host, port) to listen on, port 0 for any
+        :param site: (SyntheticSite) pages to serve
+        :param latency_s: (float) seconds every response is delayed
+        :param jitter_s: (float) up to this many more seconds, at random
+        :param rate_limit: (float) requests per second served before
+            answering 429, like pcgs.com does, None for no limit
+        :param throttle_rate: (float) fraction of requests answered 429 at
+            random on top of rate_limit
+        :param retry_after_s: (int) retry-after of random 429s, the 429s of
+            rate_limit say how long until a request would be served
+        :param error_rate: (float) fraction of requests answered 503
+        :param seed: (int) random seed of the injected latency and errors
+        :param verbose: (bool) log every request to stderr
+        """
+        super().__init__(address, StandinHandler)
+        self.site = site
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.rate_limit = rate_limit
+        self.throttle_rate = throttle_rate
+        self.retry_after_s = retry_after_s
+        self.error_rate = error_rate
+        self.verbose = verbose
+        self.started = time.monotonic()
+        self.statuses = Counter()
+        self.bytes_sent = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        # token bucket of rate_limit, one second of burst (at least one
+        # request, or a rate_limit below 1 would never allow any)
+        self._capacity = max(1.0, rate_limit or 0.0)
+        self._tokens = self._capacity if rate_limit else 0.0
+        self._refilled = time.monotonic()
+
+    @property
+    def url(self):
+        """ base url to scrape the server at, see config.set_base_url """
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def outcome(self):
+        """
+        :return status, retry_after, delay_s: (int) status to answer with,
+            (int) retry-after seconds of a 429, (float) latency to add
+        """
+        with self._lock:
+            delay_s = self.latency_s + self._rng.uniform(0, self.jitter_s)
+            if self.rate_limit is not None:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens +
+                                   (now - self._refilled) * self.rate_limit)
+                self._refilled = now
+                if self._tokens < 1:
+                    wait_s = (1 - self._tokens) / self.rate_limit
+                    return 429, max(1, math.ceil(wait_s)), delay_s
+                self._tokens -= 1
+            draw = self._rng.random()
+            if draw < self.throttle_rate:
+                return 429, self.retry_after_s, delay_s
+            if draw < self.throttle_rate + self.error_rate:
+                return 503, None, delay_s
+            return 200, None, delay_s
+
+    def count(self, status, size):
+        with self._lock:
+            self.statuses[status] += 1
+            self.bytes_sent += size
+
+    def stats(self):
+        """
+        :return stats: (dict) requests, responses by status, bytes sent and
+            requests per second since the server started
+        """
+        with self._lock:
+            uptime_s = time.monotonic() - self.started
+            requests = sum(self.statuses.values())
+            return {
+                'requests': requests,
+                'statuses': {str(status): count for status, count
+                             in sorted(self.statuses.items())},
+                'bytes_sent': self.bytes_sent,
+                'uptime_s': round(uptime_s, 3),
+                'requests_per_s': round(requests / uptime_s, 3),
+            }
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    # keep-alive, the scrapers use a pooled session
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if urlparse(self.path).path == STATS_PATH:
+            self.send(200, json.dumps(self.server.stats()).encode('utf-8'),
+                      'application/json', count=False)
+            return
+
+        status, retry_after, delay_s = self.server.outcome()
+        if delay_s > 0:
+            time.sleep(delay_s)
+        if status == 429:
+            self.send(429, b'Too Many Requests', 'text/plain',
+                      {'Retry-After': str(retry_after)})
+            return
+        if status == 503:
+            self.send(503, b'Service Unavailable', 'text/plain')
+            return
+
+        html = self.server.site.page(self.path)
+        if html is None:
+            self.send(404, b'Not Found', 'text/plain')
+            return
+        body = html.encode('utf-8')
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send(304, b'', None, {'ETag': etag})
+            return
+        self.send(200, body, 'text/html; charset=utf-8', {'ETag': etag})
+
+    def send(self, status, body, content_type, headers=None, count=True):
+        self.send_response(status)
+        if content_type is not None:
+            self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if count:
+            self.server.count(status, len(body))
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def start(site=None, host=DEFAULT_HOST, port=0, **options):
+    """
+    Start a stand-in server in a background thread
+
+        server = start(SyntheticSite(coins=500), rate_limit=20)
+        set_base_url(server.url)
+        ...
+        server.shutdown()
+
+    :param site: (SyntheticSite) pages to serve, defaults to a site of 5000
+        coins
+    :param host: (str) address to listen on
+    :param port: (int) port to listen on, 0 for any free port
+    :param options: see StandinServer
+    :return server: (StandinServer) the running server
+    """
+    if site is None:
+        site = SyntheticSite()
+    server = StandinServer((host, port), site, **options)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def serve(site, host=DEFAULT_HOST, port=DEFAULT_PORT, **options):
+    """
+    Serve the site until interrupted, then print the stats
+
+    :param site: (SyntheticSite) pages to serve
+    :param host: (str) address to listen on, local only by default
+    :param port: (int) port to listen on
+    :param options: see StandinServer
+    """
+    server = StandinServer((host, port), site, **options)
+    print(f'Serving {len(site.coins)} coins in {len(site.subcategories)} '
+          f'subcategories on {server.url}\n'
+          f'Scrape it with PCGS_BASE_URL={server.url}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats()), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--coins', '-n', action='store', type=int,
+                        default=5000, help='size of the synthetic catalog')
+    parser.add_argument('--largest_table', action='store', type=int,
+                        default=3000, help='rows of the largest price table')
+    parser.add_argument('--seed', action='store', type=int, default=0,
+                        help='seed of the catalog and the injected faults')
+    parser.add_argument('--latency', action='store', type=float, default=0.0,
+                        help='seconds every response is delayed')
+    parser.add_argument('--jitter', action='store', type=float, default=0.0,
+                        help='up to this many more seconds of delay')
+    parser.add_argument('--rate_limit', action='store', type=float,
+                        help='requests per second served, the rest are '
+                             'answered 429 with retry-after')
+    parser.add_argument('--throttle_rate', action='store', type=float,
+                        default=0.0,
+                        help='fraction of requests answered 429 at random')
+    parser.add_argument('--retry_after', action='store', type=int, default=1,
+                        help='retry-after seconds of random 429s')
+    parser.add_argument('--error_rate', action='store', type=float,
+                        default=0.0,
+                        help='fraction of requests answered 503')
+    parser.add_argument('--host', action='store', default=DEFAULT_HOST,
+                        help=f'address to listen on, default {DEFAULT_HOST}')
+    parser.add_argument('--port', action='store', type=int,
+                        default=DEFAULT_PORT,
+                        help=f'port to listen on, default {DEFAULT_PORT}')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='log every request')
+    args = parser.parse_args()
+
+    serve(SyntheticSite(coins=args.coins, largest_table=args.largest_table,
+                        seed=args.seed),
+          args.host, args.port, latency_s=args.latency, jitter_s=args.jitter,
+          rate_limit=args.rate_limit, throttle_rate=args.throttle_rate,
+          retry_after_s=args.retry_after, error_rate=args.error_rate,
+          seed=args.seed, verbose=args.verbose)
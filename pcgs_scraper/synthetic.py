@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+synthetic.py
+
+A synthetic pcgs.com: a deterministic catalog of coins and the html of every
+page the scrapers read, with the same markup the parsers look for, so the
+scrapers can be run and timed without touching pcgs.com
+
+    /prices                                  categories of the price guide
+    /prices/detail/<series>/<id>/<bin>       price table of a subcategory for a
+                                             grade bin, every row (ps=-1)
+    /pcgsnolookup/                           categories of the number lookup
+    /pcgsnolookup/<series>/<id>              PCGS numbers of a subcategory
+    /coinfacts/coin/<series>/<pcgs_num>      images and narrative of a coin
+
+One subcategory has `largest_table` coins, like the Morgan dollar tables with
+thousands of varieties, the rest of the coins are spread over subcategories of
+about `subcat_size`. Every page is padded with navigation markup, scripts and
+a footer like the real pages
+
+    site = SyntheticSite(coins=5000)
+    html = site.page('/prices')
+    site.record(PageCache('fixtures'))      # save every page as if scraped
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import random
+from html import escape
+from urllib.parse import urlsplit
+
+BASE_URL = 'https://www.pcgs.com'
+BINS = ['grades-1-20', 'grades-25-60', 'grades-61-70']
+GRADES = [1, 2, 3, 4, 6, 8, 10, 12, 15, 20, 25, 30, 35, 40, 45, 50, 53, 55, 58,
+          60, 61, 62, 63, 64, 65, 66, 67, 68, 69, 70]
+BIN_GRADES = [GRADES[:10], GRADES[10:20], GRADES[20:]]
+
+# category, series, denomination, years, mint marks, designations, details
+SERIES = [
+    ('Cents', 'Indian Cent', '1C', (1859, 1909), ['', 'S'],
+     [['MS', 'RD'], ['MS', 'RB'], ['MS', 'BN']], ['', 'Bold N', 'Doubled Die']),
+    ('Cents', 'Lincoln Cent (Wheat Reverse)', '1C', (1909, 1958),
+     ['', 'D', 'S'], [['MS', 'RD'], ['MS', 'RB'], ['MS', 'BN']],
+     ['', 'VDB', 'DDO', 'RPM']),
+    ('Nickels', 'Buffalo Nickel', '5C', (1913, 1938), ['', 'D', 'S'],
+     [['MS']], ['', 'Type 1', 'Type 2', '3 Legs']),
+    ('Dimes', 'Mercury Dime', '10C', (1916, 1945), ['', 'D', 'S'],
+     [['MS', 'FB'], ['MS']], ['', 'Doubled Die', 'Over Date']),
+    ('Quarters', 'Washington Quarter', '25C', (1932, 1998), ['', 'D', 'S'],
+     [['MS'], ['PR', 'DCAM']], ['', 'DDO', 'Wide AM']),
+    ('Half Dollars', 'Walking Liberty Half Dollar', '50C', (1916, 1947),
+     ['', 'D', 'S'], [['MS']], ['', 'Obverse Mintmark']),
+    ('Dollars', 'Morgan Dollar', '$1', (1878, 1921),
+     ['', 'CC', 'O', 'S', 'D'], [['MS', 'DMPL'], ['MS', 'PL'], ['MS']],
+     ['', '8TF', '7TF', 'VAM']),
+    ('Dollars', 'Peace Dollar', '$1', (1921, 1935), ['', 'D', 'S'],
+     [['MS']], ['', 'High Relief']),
+    ('Gold', 'Liberty Head $10', '$10', (1838, 1907),
+     ['', 'C', 'D', 'O', 'S', 'CC'], [['MS'], ['PR', 'CAM']], ['', 'No Motto']),
+    ('Gold', 'Saint Gaudens $20', '$20', (1907, 1933), ['', 'D', 'S'],
+     [['MS']], ['', 'High Relief', 'Motto']),
+]
+LARGEST_SERIES = 6      # Morgan Dollar
+
+NARRATIVE = (
+    'The {description} is one of the better known dates of the {series} '
+    'series. Most survivors are well worn, and mint state examples with full '
+    'detail and original surfaces are seldom offered. ')
+
+
+class SyntheticSite:
+    """
+    Catalog of synthetic coins and the pages pcgs.com would show for it
+    """
+
+    def __init__(self, coins=5000, largest_table=3000, subcat_size=60,
+                 padding_kb=40, seed=0):
+        """
+        :param coins: (int) number of coins in the catalog
+        :param largest_table: (int) rows of the largest price table
+        :param subcat_size: (int) about how many coins the other subcategories
+            have
+        :param padding_kb: (int) kB of navigation, scripts and footer around
+            the content of each page
+        :param seed: (int) random seed, the same seed makes the same site
+        """
+        self.rng = random.Random(seed)
+        self.padding = page_padding(padding_kb, self.rng)
+        self.coins = {}             # pcgs_num -> coin
+        self.subcategories = []     # (category, series, slug, id, [pcgs_num])
+        self.make_catalog(coins, min(largest_table, coins), subcat_size)
+        self.by_id = {subcat[3]: subcat for subcat in self.subcategories}
+
+    #############
+    # CATALOG   #
+    #############
+
+    def make_catalog(self, coins, largest_table, subcat_size):
+        """
+        :param coins: (int) number of coins
+        :param largest_table: (int) coins in the largest subcategory
+        :param subcat_size: (int) coins in each other subcategory
+        """
+        counts = {LARGEST_SERIES: largest_table}
+        others = [i for i in range(len(SERIES)) if i != LARGEST_SERIES]
+        for n, series_index in enumerate(others):
+            remaining = coins - largest_table
+            counts[series_index] = remaining // len(others) + \
+                (n < remaining % len(others))
+        next_num = 1000
+        subcat_id = 100
+        for series_index, count in sorted(counts.items()):
+            category, series, denom, years, mints, desigs, details = \
+                SERIES[series_index]
+            if series_index == LARGEST_SERIES:
+                chunks = [count]
+            else:
+                chunks = [subcat_size] * (count // subcat_size)
+                if count % subcat_size:
+                    chunks.append(count % subcat_size)
+            variety = 0
+            for part, chunk in enumerate(chunks):
+                pcgs_nums = []
+                for _ in range(chunk):
+                    year = years[0] + self.rng.randrange(years[1] - years[0])
+                    mint = self.rng.choice(mints)
+                    detail = self.rng.choice(details)
+                    if detail == 'VAM' or (detail and variety % 7 == 0):
+                        variety += 1
+                        detail = f'{detail} {variety}'.strip()
+                    description = f'{year}{"-" + mint if mint else ""} ' \
+                                  f'{denom}{" " + detail if detail else ""}'
+                    pcgs_num = str(next_num)
+                    next_num += self.rng.randrange(1, 4)
+                    self.coins[pcgs_num] = {
+                        'pcgs_num': pcgs_num,
+                        'description': description,
+                        'desig': self.rng.choice(desigs),
+                        'series': series,
+                        'prices': self.make_prices(year),
+                    }
+                    pcgs_nums.append(pcgs_num)
+                name = series if len(chunks) == 1 else f'{series} ({part + 1})'
+                slug = series.lower().replace(' ', '-').replace('$', '') \
+                    .replace('(', '').replace(')', '')
+                self.subcategories.append((category, name, slug,
+                                           str(subcat_id), pcgs_nums))
+                subcat_id += 1
+
+    def make_prices(self, year):
+        """
+        :param year: (int) year of the coin, older coins cost more
+        :return prices: (list(str)) text of the 30 price cells, one per grade
+        """
+        base = self.rng.uniform(2, 60) * (1 + max(0, 1930 - year) / 20)
+        cells = []
+        for i in range(len(GRADES)):
+            if self.rng.random() < 0.15:
+                cells.append('')
+                continue
+            price = round(base * 1.18 ** i)
+            text = f'{price:,}'
+            if self.rng.random() < 0.1:
+                text = self.rng.choice('▲▼') + text
+            if self.rng.random() < 0.3:
+                text += f'\n{round(price * 1.25):,}'
+            cells.append(text)
+        return cells
+
+    #############
+    # URLS      #
+    #############
+
+    def urls(self, base=BASE_URL):
+        """
+        :param base: (str) scheme and host the urls are for
+        :return urls: (dict) kind -> list of urls the scrapers request, kinds
+            are index, prices, numbers and coinfacts
+        """
+        prices = []
+        numbers = []
+        for _, _, slug, subcat_id, _ in self.subcategories:
+            for grade_bin in BINS:
+                prices.append(f'{base}/prices/detail/{slug}/{subcat_id}/'
+                              f'{grade_bin}?pn=1&ps=-1')
+            numbers.append(f'{base}/pcgsnolookup/{slug}/{subcat_id}')
+        coinfacts = [f'{base}{self.coinfacts_href(coin)}'
+                     for coin in self.coins.values()]
+        return {
+            'index': [f'{base}/prices', f'{base}/pcgsnolookup/'],
+            'prices': prices,
+            'numbers': numbers,
+            'coinfacts': coinfacts,
+        }
+
+    @staticmethod
+    def coinfacts_href(coin):
+        slug = coin['series'].lower().replace(' ', '-').replace('$', '') \
+            .replace('(', '').replace(')', '')
+        return f'/coinfacts/coin/{slug}/{coin["pcgs_num"]}'
+
+    def page(self, url):
+        """
+        :param url: (str) url or path of a page, the query string is ignored
+        :return html: (str) html of the page, None if there is no such page
+        """
+        parts = urlsplit(url).path.rstrip('/').split('/')[1:]
+        if parts == ['prices']:
+            return self.index_html('/prices/detail', '/most-active')
+        if parts == ['pcgsnolookup']:
+            return self.index_html('/pcgsnolookup', '')
+        if len(parts) == 5 and parts[:2] == ['prices', 'detail'] \
+                and parts[3] in self.by_id and parts[4] in BINS:
+            return self.price_html(self.by_id[parts[3]], BINS.index(parts[4]))
+        if len(parts) == 3 and parts[0] == 'pcgsnolookup' \
+                and parts[2] in self.by_id:
+            return self.numbers_html(self.by_id[parts[2]])
+        if len(parts) == 4 and parts[:2] == ['coinfacts', 'coin'] \
+                and parts[3] in self.coins:
+            return self.coinfacts_html(self.coins[parts[3]])
+        return None
+
+    def pages(self, base=BASE_URL, kinds=None):
+        """
+        :param base: (str) scheme and host, see urls
+        :param kinds: (list(str)) kinds of pages, see urls, None for all
+        :return: generator of (url, html) for every page of the site
+        """
+        for kind, urls in self.urls(base).items():
+            if kinds is not None and kind not in kinds:
+                continue
+            for url in urls:
+                yield url, self.page(url)
+
+    def record(self, cache, base=BASE_URL, kinds=None):
+        """
+        Save pages to a page cache as if they were scraped, so the scrapers
+        can replay them with an offline client, see pcgs_scraper.client
+
+        :param cache: (PageCache) cache to save to
+        :param base: (str) scheme and host, see urls
+        :param kinds: (list(str)) kinds of pages, see urls, None for all
+        :return count: (int) number of pages saved
+        """
+        import requests
+
+        count = 0
+        for url, html in self.pages(base, kinds):
+            response = requests.Response()
+            response.status_code = 200
+            response.url = url
+            response.encoding = 'utf-8'
+            response._content = html.encode('utf-8')
+            response.headers['content-type'] = 'text/html; charset=utf-8'
+            cache.store(url, response)
+            count += 1
+        return count
+
+    #############
+    # PAGES     #
+    #############
+
+    def wrap(self, title, content):
+        """
+        :param title: (str) page title
+        :param content: (str) html of the content of the page
+        :return html: (str) the whole page
+        """
+        head, foot = self.padding
+        return f'<!DOCTYPE html>\n<html lang="en">\n<head>\n' \
+               f'<meta charset="utf-8">\n<title>{escape(title)} | PCGS' \
+               f'</title>\n{head}\n<div class="container">\n{content}\n' \
+               f'</div>\n{foot}\n</body>\n</html>\n'
+
+    def index_html(self, prefix, suffix):
+        """
+        :param prefix: (str) path the subcategory links start with
+        :param suffix: (str) path the subcategory links end with
+        :return html: (str) category page, two columns of category boxes
+        """
+        by_category = {}
+        for category, name, slug, subcat_id, _ in self.subcategories:
+            by_category.setdefault(category, []).append(
+                f'<li><a href="{prefix}/{slug}/{subcat_id}{suffix}">'
+                f'{escape(name)}</a></li>')
+        boxes = [f'<div class="box">\n<div class="coin-heading">'
+                 f'{escape(category)}</div>\n<ul class="list-unstyled">\n'
+                 + '\n'.join(links) + '\n</ul>\n</div>'
+                 for category, links in by_category.items()]
+        half = (len(boxes) + 1) // 2
+        columns = [f'<div class="col-xs-12 col-sm-6">\n'
+                   f'{chr(10).join(column)}\n</div>'
+                   for column in (boxes[:half], boxes[half:])]
+        return self.wrap('Price Guide', '<div class="row">\n' +
+                         '\n'.join(columns) + '\n</div>')
+
+    def price_html(self, subcategory, bin_index):
+        """
+        :param subcategory: (tuple) see make_catalog
+        :param bin_index: (int) index of the grade bin in BINS
+        :return html: (str) price table with every coin of the subcategory
+        """
+        _, name, _, _, pcgs_nums = subcategory
+        grades = BIN_GRADES[bin_index]
+        header = ''.join(f'<th>{grade}</th>' for grade in grades)
+        rows = [f'<tr class="bg-dark"><td colspan="13">{escape(name)}</td>'
+                f'</tr>']
+        for i, pcgs_num in enumerate(pcgs_nums):
+            coin = self.coins[pcgs_num]
+            shade = 'bg-pale' if i % 2 == 0 else 'bg-light'
+            if i % 40 == 39:
+                # type set rows have no pcgs number
+                rows.append(self.price_row(shade, '', f'{coin["series"]} Type',
+                                           coin['desig'], ['1,000'] * 10))
+            cells = coin['prices'][bin_index * 10:(bin_index + 1) * 10]
+            rows.append(self.price_row(shade, pcgs_num, coin['description'],
+                                       coin['desig'], cells))
+        table = f'<table class="table table-main table-striped">\n<thead>' \
+                f'<tr><th>PCGS #</th><th>Description</th><th>Desig</th>' \
+                f'{header}</tr></thead>\n<tbody>\n' + '\n'.join(rows) + \
+                '\n</tbody>\n</table>'
+        return self.wrap(f'{name} Prices', f'<h1>{escape(name)}</h1>\n{table}')
+
+    @staticmethod
+    def price_row(shade, pcgs_num, description, desig, cells):
+        number = f'<a href="/cert/{pcgs_num}">{pcgs_num}</a>' if pcgs_num \
+            else ''
+        price_cells = ''.join(
+            '<td>{}\n<span class="price-plus">{}</span></td>'.format(
+                *cell.split('\n')) if '\n' in cell else f'<td>{cell}</td>'
+            for cell in cells)
+        return f'<tr class="{shade}"><td>{number}</td>' \
+               f'<td>{escape(description)}</td>' \
+               f'<td>{" ".join(desig)}</td>{price_cells}</tr>'
+
+    def numbers_html(self, subcategory):
+        """
+        :param subcategory: (tuple) see make_catalog
+        :return html: (str) table of the PCGS numbers of the subcategory
+        """
+        _, name, _, _, pcgs_nums = subcategory
+        rows = []
+        for pcgs_num in pcgs_nums:
+            coin = self.coins[pcgs_num]
+            rows.append(
+                f'<tr><td data-title="PCGS #"><a href="'
+                f'{self.coinfacts_href(coin)}">{pcgs_num}</a></td>'
+                f'<td data-title="Designation">{coin["desig"][0]}</td>'
+                f'<td data-title="Description">'
+                f'{escape(coin["description"])}</td></tr>')
+        table = '<table class="table">\n<thead><tr><th>PCGS #</th>' \
+                '<th>Designation</th><th>Description</th></tr></thead>\n' \
+                '<tbody>\n' + '\n'.join(rows) + '\n</tbody>\n</table>'
+        return self.wrap(f'{name} PCGS Numbers',
+                         f'<h1>{escape(name)}</h1>\n{table}')
+
+    def coinfacts_html(self, coin):
+        """
+        :param coin: (dict) coin of the catalog
+        :return html: (str) coinfacts page of the coin
+        """
+        description = escape(coin['description'])
+        images = '\n'.join(
+            f'<img class="lazy" data-src="https://images.pcgs.com/CoinFacts/'
+            f'{coin["pcgs_num"]}_{side}.jpg" alt="{description} PCGS '
+            f'{coin["desig"][0]}65 {side}">' for side in ('obv', 'rev'))
+        narrative = NARRATIVE.format(description=description,
+                                     series=escape(coin['series'])) * 4
+        return self.wrap(
+            f'{coin["description"]} CoinFacts',
+            f'<img src="/images/pcgs-logo.png" alt="PCGS logo">\n'
+            f'<h1>{description}</h1>\n<div class="coin-images">\n{images}\n'
+            f'</div>\n<div id="sectionNarrative">\n<p>{narrative}</p>\n</div>')
+
+
+def page_padding(padding_kb, rng):
+    """
+    Markup around the content of every page: stylesheets, scripts, a
+    navigation menu and a footer, none of it matching what the parsers look for
+
+    :param padding_kb: (int) about how many kB of markup
+    :param rng: (random.Random) random source
+    :return head, foot: (str) markup before and after the content
+    """
+    words = ['coins', 'grading', 'auctions', 'market', 'collectors', 'set',
+             'registry', 'population', 'report', 'news', 'shows', 'dealers']
+    head = ['<link rel="stylesheet" href="/css/site.min.css">',
+            '<script src="/js/vendor.min.js"></script>', '</head>\n<body>',
+            '<nav class="navbar">\n<ul class="nav">']
+    foot = ['<footer class="footer">']
+    size = 0
+    while size < padding_kb * 1024:
+        text = ' '.join(rng.choice(words) for _ in range(3))
+        link = f'<li class="nav-item"><a href="/{text.replace(" ", "-")}">' \
+               f'{text.title()}</a></li>'
+        (head if size % 2048 < 1536 else foot).append(link)
+        size += len(link)
+    head.append('</ul>\n</nav>')
+    foot.append('<script>window.dataLayer = window.dataLayer || [];</script>')
+    foot.append('</footer>')
+    return '\n'.join(head), '\n'.join(foot)
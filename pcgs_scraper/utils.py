@@ -8,40 +8,75 @@ Author: Ryan A. Mannion, 2020
 github: ryanamannion
 twitter: @ryanamannion
 """
+import os
 import re
-import sys
 import time
-import requests
+import pickle
+import hashlib
+from functools import lru_cache
 
-from bs4.element import NavigableString
+from pcgs_scraper.config import data_path, ensure_parent
 
 
 ##################
 # SCRAPING UTILS #
 ##################
 
-def request_page(page_url):
+def request_page(page_url, client=None):
     """
-    Makes sure page is responding
+    Makes sure page is responding, retrying if it is not
 
     :param page_url: url to request
-    :return: requested page if its working, error message with status if not
+    :param client: (PCGSClient) client to request with, defaults to the client
+        shared by all scrapers
+    :return: requested page if its working
+    :raises ScrapeError: (or a subclass) if the page could not be loaded, see
+        pcgs_scraper.client
     """
-    response = requests.get(page_url)
-    if response.status_code == 429:
-        # too many requests
-        retry_after = response.headers['retry-after']
-        print("Encountered response status 429: too many requests\n"
-              f"Waiting {retry_after}s and retrying...")
-        time.sleep(int(retry_after) + 2)     # for good measure
-        print("Retrying...")
-        response = request_page(page_url)
-    elif not response.status_code == 200:
-        print(f'Something went wrong with {page_url}!\n'
-              f'Status code: {response.status_code}\n'
-              f'Status text:\n' + response.text)
-        sys.exit()
-    return response
+    from pcgs_scraper.client import get_client
+
+    if client is None:
+        client = get_client()
+    return client.get(page_url)
+
+
+def polite_sleep(delay_s):
+    """
+    Sleep between requests to avoid response status 429, skipped when the
+    shared client is offline since no request will reach pcgs.com
+
+    :param delay_s: (float) seconds to sleep
+    """
+    from pcgs_scraper.client import get_client
+    from pcgs_scraper.metrics import get_metrics
+
+    if not get_client().offline:
+        get_metrics().inc('pcgs_wait_seconds_total', delay_s, cause='sleep')
+        time.sleep(delay_s)
+
+
+def pace(page_url, delay_s=None, limiter=None):
+    """
+    Wait until page_url may be requested: as long as the rate budget says,
+    the adaptive one shared by all scrapers unless limiter is given, or a
+    fixed delay_s seconds. Skipped when the shared client is offline
+
+    :param page_url: url about to be requested
+    :param delay_s: (float) if given, sleep this long instead
+    :param limiter: (HostRateLimiter) rate budget, defaults to the shared one,
+        see pcgs_scraper.ratelimit
+    """
+    from pcgs_scraper.client import get_client
+    from pcgs_scraper.ratelimit import get_limiter
+
+    if get_client().offline:
+        return
+    if delay_s is not None:
+        polite_sleep(delay_s)
+        return
+    if limiter is None:
+        limiter = get_limiter()
+    limiter.acquire(page_url)
 
 
 def non_ns_children(tag, search_type):
@@ -53,6 +88,8 @@ def non_ns_children(tag, search_type):
     :param search_type: string, {children, descendants}
     :return: list of bs4.Tag objects
     """
+    from bs4.element import NavigableString
+
     filtered = []
     if search_type == 'children':
         for child in tag.children:
@@ -138,7 +175,143 @@ DENOM = re.compile(denom_option)
 DENOM_CI = re.compile(denom_option, re.IGNORECASE)
 
 
-def parse_descriptions(price_guide):
+# mint marks and denominations in one alternation. A mint mark starts with '-'
+# and no denomination has one, so they never start at the same place
+DESCRIPTION_TOKEN = re.compile(f'(?P<mint>{mint_pattern})|'
+                               f'(?P<denom>{denom_option})')
+# parsed descriptions saved by parse_descriptions are only reused while the
+# regexes that parsed them are the same
+DESCRIPTION_PARSER_VERSION = hashlib.sha1(
+    (YEAR.pattern + DESCRIPTION_TOKEN.pattern).encode('utf-8')).hexdigest()
+DESCRIPTION_CACHE_FILE = data_path('description_cache.pkl')
+# below this many new descriptions starting worker processes costs more than
+# it saves
+PARALLEL_MIN_DESCRIPTIONS = 50000
+
+
+def parse_description(description):
+    """
+    Parse one description in a single scan, see parse_descriptions
+
+    :param description: (str) coin description, e.g. '1945-S 10C Micro S, FB'
+    :return parsed: (tuple) year_short, year_full, mint, denom, detail
+    """
+    # get year
+    year_search = YEAR.match(description)
+    if year_search is None:
+        year_short = None
+        year_full = None
+    else:
+        # year_short is for search purposes, year_full is more descriptive
+        year_short = year_search.group(1)       # e.g. 1825
+        year_full = year_search.group(0)        # e.g. 1825/4/(2) for errors
+
+    # first mint mark and first denomination, same as MINT.search and
+    # DENOM.search but the text before the first of them is only scanned once
+    token = DESCRIPTION_TOKEN.search(description)
+    if token is None:
+        mint_search = None
+        denom_search = None
+    elif token.lastgroup == 'denom':
+        denom_search = token
+        mint_search = MINT.search(description, token.end())
+    else:
+        mint_search = token
+        # a denomination can start inside the mint mark, e.g. H10C in -H10C
+        denom_search = DENOM.search(description, token.start() + 1)
+
+    # get mint information
+    if mint_search is None:
+        mint = None
+    else:
+        mint = mint_search.group(0).strip('-')
+
+    # get denomination
+    # get detail (everything after denomination, or year if no denom)
+    if denom_search is None:
+        denom = None
+        # detail information would start at different points
+        if year_short is None:
+            detail = description    # no denomination no year
+        else:
+            detail = description[year_search.end():]    # year but no denom
+    else:
+        denom = denom_search.group(0)
+        detail = description[denom_search.end():]
+
+    return year_short, year_full, mint, denom, detail
+
+
+def load_description_cache(cache_path=DESCRIPTION_CACHE_FILE):
+    """
+    :param cache_path: (str) file saved by parse_descriptions
+    :return cache: (dict) description -> output of parse_description, empty if
+        there is no cache or it was made by different regexes
+    """
+    if not os.path.isfile(cache_path):
+        return {}
+    try:
+        saved = pickle.load(open(cache_path, 'rb'))
+    except (pickle.UnpicklingError, EOFError):
+        return {}
+    if saved.get('version') != DESCRIPTION_PARSER_VERSION:
+        return {}
+    return saved['parsed']
+
+
+def save_description_cache(parsed_descriptions,
+                           cache_path=DESCRIPTION_CACHE_FILE):
+    """
+    :param parsed_descriptions: (dict) description -> output of
+        parse_description
+    :param cache_path: (str) file to save them to, see load_description_cache
+    """
+    with open(ensure_parent(cache_path), 'wb') as cache_file:
+        pickle.dump({'version': DESCRIPTION_PARSER_VERSION,
+                     'parsed': parsed_descriptions}, cache_file)
+
+
+def parse_description_set(descriptions, cache_path=None, processes=None):
+    """
+    Parse every distinct description once, see parse_descriptions
+
+    :param descriptions: iterable of descriptions (str)
+    :param cache_path: (str) if given, reuse the descriptions parsed last time
+        from this file and save these descriptions to it
+    :param processes: (int) worker processes for large inputs, defaults to the
+        number of cpus, 1 to always parse in this process
+    :return parsed_descriptions: (dict) description -> output of
+        parse_description
+    """
+    cache = load_description_cache(cache_path) if cache_path else {}
+    descriptions = dict.fromkeys(descriptions)
+    new_descriptions = [description for description in descriptions
+                        if description not in cache]
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if len(new_descriptions) >= PARALLEL_MIN_DESCRIPTIONS and processes > 1:
+        from multiprocessing import Pool
+
+        with Pool(processes) as pool:
+            parsed = pool.map(parse_description, new_descriptions,
+                              chunksize=2000)
+    else:
+        parsed = map(parse_description, new_descriptions)
+    cache.update(zip(new_descriptions, parsed))
+
+    # only these descriptions, old ones are dropped from the cache
+    parsed_descriptions = {description: cache[description]
+                           for description in descriptions}
+    if cache_path:
+        if len(new_descriptions) > 0 or len(cache) > len(descriptions):
+            save_description_cache(parsed_descriptions, cache_path)
+        print(f'Parsed {len(new_descriptions)} new descriptions, '
+              f'{len(descriptions) - len(new_descriptions)} from cache')
+    return parsed_descriptions
+
+
+def parse_descriptions(price_guide, cache_path=None, processes=None):
     """
     Parse descriptions for coins, e.g.
         '1794 1/2C Low Relief Head, BN' -->
@@ -148,8 +321,16 @@ def parse_descriptions(price_guide):
              'color': BN
             }
 
+    v0.0.5: single scan per description (parse_description), each distinct
+    description is parsed once, and only descriptions missing from the cache
+    at cache_path are parsed at all
+
     :param price_guide: price guide with descriptions, i.e.
         output of combine_number_price
+    :param cache_path: (str) if given, reuse the descriptions parsed last time
+        from this file and save this price guide's descriptions to it
+    :param processes: (int) worker processes for large inputs, defaults to the
+        number of cpus, 1 to always parse in this process
     :return price_guide_parsed: original price guide but with new keys from the
         description
     """
@@ -172,44 +353,13 @@ def parse_descriptions(price_guide):
     # Search algorithm will handle this by calculating edit distance between the
     # multiple options and ranking them
 
-    for entry in price_guide:
-        description = entry['description']
-
-        # get year
-        year_search = YEAR.match(description)
-        if year_search is None:
-            year_short = None
-            year_full = None
-        else:
-            # year_short is for search purposes, year_full is more descriptive
-            year_short = year_search.group(1)       # e.g. 1825
-            year_full = year_search.group(0)        # e.g. 1825/4/(2) for errors
-
-        # get mint information
-        mint_search = MINT.search(description)
-        if mint_search is None:
-            mint = None
-        else:
-            mint = mint_search.group(0)
-            mint = mint.strip('-')
-
-        # get denomination
-        # get detail (everything after denomination, or year if no denom)
-        denom_search = DENOM.search(description)
-        if denom_search is None:
-            denom = None
-            # detail information would start at different points
-            if year_short is None:
-                detail = description    # no denomination no year
-            else:
-                year_span_end = year_search.regs[0][1]
-                detail = description[year_span_end:]    # year but no denom
-        else:
-            denom = denom_search.group(0)
-            denom_span_end = denom_search.regs[0][1]
-            detail = description[denom_span_end:]
+    parsed_descriptions = parse_description_set(
+        (entry['description'] for entry in price_guide), cache_path, processes)
 
+    for entry in price_guide:
         # update entry with parsed description info
+        year_short, year_full, mint, denom, detail = \
+            parsed_descriptions[entry['description']]
         entry['year_short'] = year_short
         entry['year_full'] = year_full
         entry['mint'] = mint
@@ -219,99 +369,160 @@ def parse_descriptions(price_guide):
     return price_guide
 
 
+# typed-out numbers common to coins, not meant to be for all numbers
+NUMBER_WORDS = {
+    'one': '1',
+    'two': '2',
+    'three': '3',
+    'four': '4',
+    'five': '5',
+    'six': '6',
+    'seven': '7',
+    'eight': '8',
+    'nine': '9',
+    'ten': '10',
+    'twenty': '20',
+    'twenty five': '25',
+    'fifty': '50',
+}
+
+
+def number_words(digits=None):
+    """
+    :param digits: (str) if given, only words for this number
+    :return pattern: (str) regex alternation of number words, longest first so
+        'twenty five' wins over 'twenty'
+    """
+    words = sorted((word for word, value in NUMBER_WORDS.items()
+                    if digits is None or value == digits),
+                   key=len, reverse=True)
+    return r'\b(?:' + '|'.join(word.replace(' ', '[ -]') for word in words) + \
+        r')\b'
+
+
+def not_after_number(exclude=()):
+    """
+    :param exclude: (list(str)) number words that are allowed before the match
+    :return pattern: (str) lookbehinds failing right after a number (digit or
+        word) and a space
+    """
+    digits = ''.join(d for d in '0123456789'
+                     if not any(NUMBER_WORDS[w] == d for w in exclude))
+    # one or two digit numbers only, a year right before is fine
+    lookbehinds = [f'(?<!\\b[{digits}] )', f'(?<!\\b[0-9][{digits}] )']
+    lookbehinds.extend(f'(?<!\\b{word.split()[-1]} )' for word in NUMBER_WORDS
+                       if word not in exclude)
+    return ''.join(sorted(set(lookbehinds), key=lookbehinds.index))
+
+
+# numbers in the denomination rules can be digits or words, e.g. {twenty_five}
+NUMBERS = {word.replace(' ', '_'): f'(?:{digits}|{number_words(digits)})'
+           for word, digits in NUMBER_WORDS.items()}
+NUMBERS['not_after_number'] = not_after_number()
+NUMBERS['not_after_number_but_one'] = not_after_number(exclude=['one'])
+
+# (PCGS denomination, pattern) in order of priority: where two rules match at
+# the same place the first one wins. A (?=x) before lookbehinds only makes the
+# rule give up quickly where it can not match
+DENOMINATION_RULES = [
+    (r'1/2C', r'({one} )?half( of (a|{one}) ?)? cents?'),  # half cent
+    (r'1C', r'({one} cent|penny)'),  # 1 cent
+    # (r'Cent', ['1C']),
+    # (r' C ', ['1C'],
+    (r'2C', r'{two} cents? (silver)?'),  # 2 cent
+    (r'3CS', r'{three}( ?C| cents?) silver'),  # flag this and ask if they mean silver or nickel
+    (r'3CN', r'{three} cents? nickel'),  # 3 cent nickel
+    (r'5C', r'((?=n)(?<!cent )nickel|{five} cents?)'),  # 5 cent (nickel)
+    (r'H10C', r'half dime'),  # half Dime
+    (r'10C', r'(dime|{ten} cents?)'),  # dime
+    (r'20C', r'{twenty} cents?'),  # 20 cent
+    (r'25C', r'(quarter|{twenty_five} cents?)'),  # quarter
+    (r'50C', r'(?=[h5f])(?<!and a )(half dollar|{fifty} cents?)'),  # half dollar
+    (r'$1', r'(?=[1od]){not_after_number_but_one}(?<!half )({one} )?dollar'),  # dollar coin
+    (r'$2.50', r'({two} (and a half dollars?|dollars and {fifty} cents)|\$?2\.50)'),  # $2.50 gold
+    (r'$3', r'{three} dollars?'),  # $3 gold
+    (r'$4', r'{four} dollars?'),  # $4 gold
+    (r'$5', r'{five} dollars?'),  # $4 gold
+    (r'$10', r'{ten} dollars?'),  # $10 gold
+    (r'$20', r'{twenty} dollars?'),  # $20 St. Gaudens Double Eagle
+    (r'$25', r'{twenty_five} dollars?'),  # Gold Eagle
+    (r'$50', r'{fifty} dollars?'),  # Gold Eagle
+    # after all of the main ones are done
+    (r'1C', r'(?=c){not_after_number}(?<!half )cent')     # lincoln cent, wheat cent, etc.
+    # Colonials and special cases
+    # (r'\'?Penny\'?', ['']),
+    # (r'1P', ['']),
+    # (r'1/2 ?P', ['']),
+    # (r'3Pence', ['']),
+    # (r'2Pence', ['']),
+    # (r'6Pence', ['']),
+    # (r'Shilling', ['']),
+    # (r'Shilng', ['']),  # Special case, see PCGS#249
+    # (r'1/24RL', ['']),  # see PCGS#49
+    # (r'9 Den', ['']),  # French colonies, Deniers
+    # (r'15 Den', ['']),
+    # (r'30 Den', ['']),
+    # (r'Farth', ['']),  # e.g. PCGS#256
+    # (r'Sou', ['']),  # French Colonies
+    # (r'Sol', ['']),  # French Colonies, see PCGS#167113
+    # (r'1/2 Db', ['']),  # see PCGS#489
+    # (r'1/2 (R', ['']),  # see PCGS#600506
+    # (r'1/2 RL', ['']),
+    # (r'Rial', ['']
+]
+
+# one pass over the query: each denomination rule is a named group d0, d1...,
+# number words not part of a denomination are a last group. Rules are only
+# tried at the start of a word (e.g. not the '4 dollar' in '1874 dollar')
+NUMBER_WORD = re.compile(number_words(), re.IGNORECASE)
+NORMALIZER = re.compile(
+    r'(?<![a-z0-9])(?:'
+    + '|'.join(f'(?P<d{i}>{pattern.format(**NUMBERS)})'
+               for i, (_, pattern) in enumerate(DENOMINATION_RULES))
+    + f'|(?P<number>{number_words()}))',
+    re.IGNORECASE)
+
+
+def number_to_digit(match):
+    # the digits for a match of a number word, any case, 'twenty-five' too
+    return NUMBER_WORDS[match.group(0).lower().replace('-', ' ')]
+
+
+def fold_match(match):
+    # replacement for a match of NORMALIZER
+    if match.lastgroup == 'number':
+        return number_to_digit(match)
+    return DENOMINATION_RULES[int(match.lastgroup[1:])][0]
+
+
 def word_to_digit(input_string):
     """
     Help normalize the query string by replacing typed-out forms of numbers into
     digits. NOTE: this is only for numbers common to coins, and is not meant to
     be for all numbers
 
+    v0.0.5: replaces every number, not only 'fifty', and only whole words
+
     :param input_string: string to change words to digits
     :return output_string: new string with digits in place of numbers
     """
-    replacement_pairs = [
-        ('one', '1'),
-        ('two', '2'),
-        ('three', '3'),
-        ('four', '4'),
-        (r'(?<!twenty )five', '5'),
-        ('six', '6'),
-        ('seven', '7'),
-        ('eight', '8'),
-        ('nine', '9'),
-        ('ten', '10'),
-        ('twenty', '20'),
-        ('twenty five', '25'),
-        ('fifty', '50')
-    ]
-    for pattern, replacement in replacement_pairs:
-        output_string = re.sub(pattern, replacement, input_string)
-
-    return output_string
+    return NUMBER_WORD.sub(number_to_digit, input_string)
 
 
+@lru_cache(maxsize=65536)
 def fold_denoms(query_str):
     """
     Given a user input string, normalize and 'fold' denominations into PCGS
     denomination category, less focus is given to colonial coins here, that's a
     to-do
 
+    v0.0.5: one precompiled pass for every rule and number word, see
+    NORMALIZER, and queries are cached
+
     :param query_str: string queried by the user
     :return :
     """
-    denominations_mapping = [
-        # key is PCGS denomination
-        (r'1/2C', r'(1 )?half( of (a|one) ?)? cents?'),  # half cent
-        (r'1C', r'(1 cent|penny)'),  # 1 cent
-        # (r'Cent', ['1C']),
-        # (r' C ', ['1C'],
-        (r'2C', r'2 cents? (silver)?'),  # 2 cent
-        (r'3CS', r'3( ?C| cents?) silver'),  # flag this and ask if they mean silver or nickel
-        (r'3CN', r'3 cents? nickel'),  # 3 cent nickel
-        (r'5C', r'((?<!cent )nickel|5 cents?)'),  # 5 cent (nickel)
-        (r'H10C', r'half dime'),  # half Dime
-        (r'10C', '(dime|10 cents?)'),  # dime
-        (r'20C', r'20 cents?'),  # 20 cent
-        (r'25C', r'(quarter|25 cents?)'),  # quarter
-        (r'50C', r'(?<!and a )(half dollar|50 cents?)'),  # half dollar
-        (r'$1', r'(?<![02-9] )(?<!half )(1 )?dollar'),  # dollar coin
-        (r'$2.50', r'(2 (and a half dollars?|dollars and 50 cents)|\$?2\.50)'),  # $2.50 gold
-        (r'$3', r'3 dollars?'),  # $3 gold
-        (r'$4', r'4 dollars?'),  # $4 gold
-        (r'$5', r'5 dollars?'),  # $4 gold
-        (r'$10', r'10 dollars?'),  # $10 gold
-        (r'$20', r'20 dollars?'),  # $20 St. Gaudens Double Eagle
-        (r'$25', r'25 dollars?'),  # Gold Eagle
-        (r'$50', r'50 dollars?'),  # Gold Eagle
-        # after all of the main ones are done
-        (r'1C', r'(?<![0-9] )(?<!half )cent')     # lincoln cent, wheat cent, etc.
-        # Colonials and special cases
-        # (r'\'?Penny\'?', ['']),
-        # (r'1P', ['']),
-        # (r'1/2 ?P', ['']),
-        # (r'3Pence', ['']),
-        # (r'2Pence', ['']),
-        # (r'6Pence', ['']),
-        # (r'Shilling', ['']),
-        # (r'Shilng', ['']),  # Special case, see PCGS#249
-        # (r'1/24RL', ['']),  # see PCGS#49
-        # (r'9 Den', ['']),  # French colonies, Deniers
-        # (r'15 Den', ['']),
-        # (r'30 Den', ['']),
-        # (r'Farth', ['']),  # e.g. PCGS#256
-        # (r'Sou', ['']),  # French Colonies
-        # (r'Sol', ['']),  # French Colonies, see PCGS#167113
-        # (r'1/2 Db', ['']),  # see PCGS#489
-        # (r'1/2 (R', ['']),  # see PCGS#600506
-        # (r'1/2 RL', ['']),
-        # (r'Rial', ['']
-    ]
-
-    query_str = word_to_digit(query_str)
-
-    for repl, pattern in denominations_mapping:
-        query_str = re.sub(pattern, repl, query_str, flags=re.IGNORECASE)
-
-    return query_str
+    return NORMALIZER.sub(fold_match, query_str)
 
 
 def price_table(desig, prices_by_grade):
@@ -0,0 +1,603 @@
+#!/usr/bin/env python3
+"""
+work_queue.py
+
+Durable queue of scrape work shared by any number of worker processes, on one
+machine or on several machines (e.g. one per egress IP) mounting the same
+directory. The grade bin pages of pcgs.com/prices and the subcategory pages of
+pcgs.com/pcgsnolookup are the tasks, kept in a SQLite database in the queue
+directory:
+
+    tasks: url -> kind (prices or numbers), position in a sequential scrape,
+           the worker holding it, until when, attempts and when it was done
+
+A worker claims a task under a lease that expires after lease_s seconds and is
+renewed while the worker is busy with it. A worker that crashes stops renewing,
+its leases expire and the tasks are claimed by the next worker that asks. Each
+worker journals the rows it scrapes to its own file in the queue directory,
+results-<worker>.journal, so workers never write to the same file. Once every
+task is done, finalize puts the rows of all workers in the order of a
+sequential scrape and hands them to merge_grade_bins and combine_number_price
+
+    $ python work_queue.py init /mnt/shared/queue
+    $ python work_queue.py work /mnt/shared/queue          # on every machine
+    $ python work_queue.py status /mnt/shared/queue
+    $ python work_queue.py finalize /mnt/shared/queue
+
+Claims take a write lock on the database, so the directory needs a file system
+with working locks (a local disk, or NFS with locking enabled)
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+import os
+import sys
+import glob
+import json
+import time
+import pickle
+import socket
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+
+from pcgs_scraper.config import data_path, ensure_parent
+from pcgs_scraper.journal import Journal, open_journal, dump_list
+from pcgs_scraper.metrics import get_metrics, write_metrics
+from pcgs_scraper.price_db import PRICE_DB_FILE
+
+QUEUE_DB = 'queue.db'
+RESULTS_GLOB = 'results-*.journal'
+KINDS = ('prices', 'numbers')
+LEASE_S = 300           # seconds a claimed task is held without a renewal
+MAX_ATTEMPTS = 5        # claims of a task before it is given up on
+POLL_S = 10             # seconds between claims while others hold the rest
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    url TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    category TEXT,
+    subcat TEXT,
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    done_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_open ON tasks (kind, position)
+    WHERE done_at IS NULL;
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def queue_path(queue_dir):
+    """
+    :param queue_dir: (str) queue directory
+    :return path: (str) the queue database in it
+    """
+    return os.path.join(queue_dir, QUEUE_DB)
+
+
+def results_path(queue_dir, worker):
+    """
+    :param queue_dir: (str) queue directory
+    :param worker: (str) worker id
+    :return path: (str) journal of the rows scraped by the worker
+    """
+    return os.path.join(queue_dir, f'results-{worker}.journal')
+
+
+def default_worker_id():
+    """
+    :return worker: (str) id unique to this process, host name and pid
+    """
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def connect(queue_dir):
+    """
+    :param queue_dir: (str) queue directory, the database is created if it
+        does not exist
+    :return conn: (sqlite3.Connection) in autocommit mode, transactions are
+        begun explicitly so a claim holds the write lock from read to update
+    """
+    conn = sqlite3.connect(ensure_parent(queue_path(queue_dir)), timeout=60,
+                           isolation_level=None)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+#########
+# QUEUE #
+#########
+def init_queue(queue_dir, kinds=KINDS):
+    """
+    Fill the queue with every grade bin page of pcgs.com/prices and every
+    subcategory page of pcgs.com/pcgsnolookup. Tasks already in the queue are
+    kept as they are, so init can be run again on a queue in progress
+
+    :param queue_dir: (str) queue directory, created if it does not exist
+    :param kinds: (tuple(str)) which scrapes to queue, prices and/or numbers
+    :return added: (dict) kind -> number of tasks added
+    """
+    from pcgs_scraper import pcgs_nums, pcgs_prices
+
+    tasks = []
+    if 'prices' in kinds:
+        print(f"Getting URLs from {pcgs_prices.PRICES}...")
+        for category, subcategories in \
+                pcgs_prices.get_urls(pcgs_prices.PRICES).items():
+            for subcat, subcat_url in subcategories:
+                for this_bin_url in pcgs_prices.bin_urls(subcat_url):
+                    tasks.append((this_bin_url, 'prices', category, subcat))
+    if 'numbers' in kinds:
+        print(f"Getting URLs from {pcgs_nums.URL_NOLOOKUP}...")
+        for category, subcategories in \
+                pcgs_prices.get_urls(pcgs_nums.URL_NOLOOKUP).items():
+            for subcat, subcat_url in subcategories:
+                tasks.append((subcat_url, 'numbers', category, subcat))
+
+    conn = connect(queue_dir)
+    added = {kind: 0 for kind in kinds}
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        start = conn.execute('SELECT COALESCE(MAX(position) + 1, 0) '
+                             'FROM tasks').fetchone()[0]
+        for position, (url, kind, category, subcat) in \
+                enumerate(tasks, start):
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO tasks (url, kind, position, category, '
+                'subcat) VALUES (?, ?, ?, ?, ?)',
+                (url, kind, position, category, subcat))
+            added[kind] += cursor.rowcount
+        conn.execute("INSERT OR IGNORE INTO meta VALUES ('created', ?)",
+                     (datetime.now().isoformat(timespec='seconds'),))
+    conn.close()
+    return added
+
+
+def claim(conn, worker, kinds=KINDS, lease_s=LEASE_S,
+          max_attempts=MAX_ATTEMPTS):
+    """
+    Lease the first open task: never claimed, or leased by a worker that did
+    not renew it in time
+
+    :param conn: (sqlite3.Connection) see connect
+    :param worker: (str) id of the claiming worker
+    :param kinds: (tuple(str)) kinds of task the worker takes
+    :param lease_s: (float) seconds until the lease expires
+    :param max_attempts: (int) tasks claimed this many times are skipped
+    :return url, kind: (str) the task, or None, None if none is open
+    """
+    now = time.time()
+    placeholders = ', '.join('?' * len(kinds))
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        task = conn.execute(
+            f'SELECT url, kind FROM tasks WHERE done_at IS NULL '
+            f'AND kind IN ({placeholders}) AND attempts < ? '
+            f'AND (lease_until IS NULL OR lease_until < ?) '
+            f'ORDER BY position LIMIT 1',
+            (*kinds, max_attempts, now)).fetchone()
+        if task is None:
+            return None, None
+        conn.execute('UPDATE tasks SET worker = ?, lease_until = ?, '
+                     'attempts = attempts + 1 WHERE url = ?',
+                     (worker, now + lease_s, task[0]))
+    return task
+
+
+def renew(conn, worker, lease_s=LEASE_S):
+    """
+    Extend the leases of every task the worker holds
+
+    :param conn: (sqlite3.Connection) see connect
+    :param worker: (str) worker id
+    :param lease_s: (float) seconds from now until the leases expire
+    :return renewed: (int) number of leases extended
+    """
+    with conn:
+        return conn.execute('UPDATE tasks SET lease_until = ? WHERE worker = ? '
+                            'AND done_at IS NULL AND lease_until IS NOT NULL',
+                            (time.time() + lease_s, worker)).rowcount
+
+
+def complete(conn, worker, url):
+    """
+    Mark a task done, after its rows are journaled
+
+    :param conn: (sqlite3.Connection) see connect
+    :param worker: (str) worker id
+    :param url: (str) the task
+    """
+    with conn:
+        conn.execute('UPDATE tasks SET done_at = ?, worker = ?, '
+                     'lease_until = NULL, error = NULL '
+                     'WHERE url = ? AND done_at IS NULL',
+                     (time.time(), worker, url))
+
+
+def release(conn, worker, url=None, error=None):
+    """
+    Give up leases so the tasks can be claimed again right away, instead of
+    when the lease expires
+
+    :param conn: (sqlite3.Connection) see connect
+    :param worker: (str) worker id
+    :param url: (str) the task to give up, None for all tasks of the worker
+    :param error: (str) why, shown by status
+    """
+    with conn:
+        if url is None:
+            conn.execute('UPDATE tasks SET lease_until = NULL WHERE worker = ? '
+                         'AND done_at IS NULL', (worker,))
+        else:
+            conn.execute('UPDATE tasks SET lease_until = NULL, error = ? '
+                         'WHERE url = ? AND worker = ? AND done_at IS NULL',
+                         (error, url, worker))
+
+
+def queue_status(queue_dir, max_attempts=MAX_ATTEMPTS):
+    """
+    :param queue_dir: (str) queue directory
+    :param max_attempts: (int) tasks claimed this many times count as failed
+    :return status: (dict) kind -> counts of tasks total, done, leased,
+        pending and failed, and 'workers' -> worker -> leases held
+    """
+    conn = connect(queue_dir)
+    now = time.time()
+    status = {}
+    for kind, total, done, leased, failed in conn.execute(
+            'SELECT kind, COUNT(*), COUNT(done_at), '
+            'SUM(done_at IS NULL AND IFNULL(lease_until, 0) >= ?), '
+            'SUM(done_at IS NULL AND (lease_until IS NULL OR lease_until < ?) '
+            '    AND attempts >= ?) '
+            'FROM tasks GROUP BY kind', (now, now, max_attempts)):
+        status[kind] = {'total': total, 'done': done, 'leased': leased,
+                        'pending': total - done - leased - failed,
+                        'failed': failed}
+    status['workers'] = dict(conn.execute(
+        'SELECT worker, COUNT(*) FROM tasks WHERE done_at IS NULL '
+        'AND lease_until >= ? GROUP BY worker ORDER BY worker', (now,)))
+    conn.close()
+    return status
+
+
+def failed_tasks(queue_dir, max_attempts=MAX_ATTEMPTS):
+    """
+    :param queue_dir: (str) queue directory
+    :param max_attempts: (int) see claim
+    :return tasks: (list(tuple)) url, attempts and last error of every task
+        given up on
+    """
+    conn = connect(queue_dir)
+    tasks = conn.execute(
+        'SELECT url, attempts, error FROM tasks WHERE done_at IS NULL '
+        'AND attempts >= ? AND (lease_until IS NULL OR lease_until < ?) '
+        'ORDER BY position', (max_attempts, time.time())).fetchall()
+    conn.close()
+    return tasks
+
+
+##########
+# WORKER #
+##########
+class LeaseKeeper:
+    """
+    Renews the leases of a worker in a background thread while it scrapes, so
+    a slow task (a pcgsnolookup page with its coinfacts) is not re-issued
+    """
+
+    def __init__(self, queue_dir, worker, lease_s=LEASE_S):
+        """
+        :param queue_dir: (str) queue directory
+        :param worker: (str) worker id
+        :param lease_s: (float) lease length, renewed every third of it
+        """
+        self.queue_dir = queue_dir
+        self.worker = worker
+        self.lease_s = lease_s
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        conn = connect(self.queue_dir)
+        while not self._stop.wait(self.lease_s / 3):
+            try:
+                renew(conn, self.worker, self.lease_s)
+            except sqlite3.OperationalError as e:
+                # a busy database, try again at the next renewal
+                print(f'Could not renew leases: {e}', file=sys.stderr)
+        conn.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_task(url, kind, enrich=True, workers=4, limiter=None, seen=None):
+    """
+    :param url: (str) grade bin or pcgsnolookup page
+    :param kind: (str) prices or numbers
+    :param enrich: (bool) see pcgs_nums.scrape_nums
+    :param workers: (int) see pcgs_nums.scrape_nums
+    :param limiter: (HostRateLimiter) rate budget of the worker
+    :param seen: (dict) see pcgs_nums.enrich_rows
+    :return rows: (list) rows scraped from the page
+    """
+    from pcgs_scraper import pcgs_nums, pcgs_prices
+
+    if kind == 'prices':
+        return pcgs_prices.get_prices(url, limiter=limiter)
+    return pcgs_nums.scrape_nums(url, enrich=enrich, workers=workers,
+                                 limiter=limiter, seen=seen)
+
+
+def work(queue_dir, worker=None, kinds=KINDS, lease_s=LEASE_S,
+         max_attempts=MAX_ATTEMPTS, enrich=True, workers=4, max_tasks=None,
+         wait=True, poll_s=POLL_S):
+    """
+    Claim and scrape tasks until the queue is empty. Rows of each task are
+    journaled to this worker's results file before the task is marked done,
+    a task that fails is released for another attempt (by any worker, up to
+    max_attempts). Requests go through the shared rate budget, see
+    pcgs_scraper.ratelimit; run one worker per egress IP, each adapts its own
+    rate. Metrics are saved as data/pcgs_worker-<worker>.prom and .json
+
+    :param queue_dir: (str) queue directory made by init_queue
+    :param worker: (str) unique id of this worker, defaults to host and pid
+    :param kinds: (tuple(str)) kinds of task to take, prices and/or numbers
+    :param lease_s: (float) seconds a task is held without a renewal
+    :param max_attempts: (int) see claim
+    :param enrich: (bool) scrape coinfacts of numbers tasks
+    :param workers: (int) max coinfacts pages fetched at once
+    :param max_tasks: (int) stop after this many tasks, None for no limit
+    :param wait: (bool) when no task is open but others still hold leases,
+        wait for them to finish or expire instead of returning
+    :param poll_s: (float) seconds between claims while waiting
+    :return finished: (int) number of tasks this worker finished
+    """
+    from pcgs_scraper.client import ScrapeError
+    from pcgs_scraper.ratelimit import get_limiter
+    from pcgs_scraper.pcgs_nums import RecentCoinfacts
+
+    if worker is None:
+        worker = default_worker_id()
+    get_metrics().reset()
+    limiter = get_limiter()
+    journal = open_journal(results_path(queue_dir, worker))
+    conn = connect(queue_dir)
+    seen = RecentCoinfacts()     # shared by all tasks of the worker
+    finished = 0
+    print(f'Worker {worker} taking {", ".join(kinds)} tasks from {queue_dir}')
+    try:
+        with LeaseKeeper(queue_dir, worker, lease_s):
+            while max_tasks is None or finished < max_tasks:
+                url, kind = claim(conn, worker, kinds, lease_s, max_attempts)
+                if url is None:
+                    status = queue_status(queue_dir, max_attempts)
+                    leased = sum(status[k]['leased'] for k in kinds
+                                 if k in status)
+                    if not wait or leased == 0:
+                        break
+                    time.sleep(poll_s)
+                    continue
+                try:
+                    rows = run_task(url, kind, enrich, workers, limiter, seen)
+                except ScrapeError as e:
+                    print(f'Failed {url}: {e}', file=sys.stderr)
+                    release(conn, worker, url, f'{type(e).__name__}: {e}')
+                    continue
+                journal.append(url, rows)
+                complete(conn, worker, url)
+                finished += 1
+    finally:
+        # hand back anything claimed but not done, e.g. on ctrl-c
+        release(conn, worker)
+        conn.close()
+        limiter.save()
+    print(f'Worker {worker} finished {finished} tasks')
+    prom_path, json_path = write_metrics(f'pcgs_worker-{worker}')
+    print(f'Saved metrics to {prom_path} and {json_path}')
+    return finished
+
+
+############
+# FINALIZE #
+############
+def collect_results(queue_dir, kind):
+    """
+    Rows of every done task of a kind from the results of all workers, in the
+    order of a sequential scrape, read one task at a time. A task scraped by
+    two workers (its lease expired while the first was still on it) is taken
+    once
+
+    :param queue_dir: (str) queue directory
+    :param kind: (str) prices or numbers
+    :return: generator of the list of rows of each task, for
+        journal.dump_list
+    """
+    locations = {}      # url -> (journal, location)
+    for path in sorted(glob.glob(os.path.join(queue_dir, RESULTS_GLOB))):
+        journal = Journal(path)
+        for url, location in journal.index().items():
+            locations.setdefault(url, (journal, location))
+    conn = connect(queue_dir)
+    files = {}
+    try:
+        for url, in conn.execute('SELECT url FROM tasks WHERE kind = ? AND '
+                                 'done_at IS NOT NULL ORDER BY position',
+                                 (kind,)):
+            if url not in locations:
+                continue
+            journal, location = locations[url]
+            if journal.path not in files:
+                files[journal.path] = open(journal.path, 'rb')
+            yield journal.read_rows(location, files[journal.path])
+    finally:
+        for results_file in files.values():
+            results_file.close()
+        conn.close()
+
+
+def finalize(queue_dir, combine=True, force=False, db_path=None):
+    """
+    Save the rows scraped by all workers like scrape_all and pcgs_nums.main
+    would, then merge the grade bins and combine numbers and prices:
+        prices: data/pcgs_prices_unprocessed-<time>.pkl, merge_grade_bins
+        numbers: data/number_data.pkl
+        both: combine_number_price, saved to data/pcgs_price_guide.pkl (with
+            its query index) and data/pcgs_price_guide.json like scraper.py
+
+    :param queue_dir: (str) queue directory
+    :param combine: (bool) run combine_number_price once both are saved
+    :param force: (bool) save what is done even if some tasks are not
+    :param db_path: (str) if given, also write the combined price guide to a
+        SQLite database at this path, see pcgs_scraper.price_db
+    :return saved: (dict) kind -> file saved, 'guide' for the combined price
+        guide and 'db' for its database
+    :raises ValueError: if tasks are not done and force is False
+    """
+    from pcgs_scraper import pcgs_nums, pcgs_prices
+
+    status = queue_status(queue_dir)
+    kinds = [kind for kind in KINDS if kind in status]
+    unfinished = sum(status[kind]['total'] - status[kind]['done']
+                     for kind in kinds)
+    if unfinished > 0 and not force:
+        raise ValueError(f'{unfinished} tasks are not done, see status')
+
+    saved = {}
+    if status.get('prices', {}).get('done', 0) > 0:
+        current_time = datetime.now().strftime(pcgs_prices.SNAPSHOT_TIME_FORMAT)
+        filename = data_path(f'pcgs_prices_unprocessed-{current_time}.pkl')
+        print(f'Saving price data to {filename}')
+        dump_list(collect_results(queue_dir, 'prices'), filename)
+        pcgs_prices.merge_grade_bins(filename)
+        saved['prices'] = filename
+    if status.get('numbers', {}).get('done', 0) > 0:
+        print(f'Saving number data to {pcgs_nums.NUMS_FILE}')
+        dump_list(collect_results(queue_dir, 'numbers'), pcgs_nums.NUMS_FILE)
+        # the coinfacts scraped for an older number data file do not apply,
+        # enrich_file goes by the rows instead
+        scraped = pcgs_nums.scraped_path()
+        if os.path.isfile(scraped):
+            os.remove(scraped)
+        saved['numbers'] = pcgs_nums.NUMS_FILE
+    if combine and len(saved) == len(KINDS):
+        from pcgs_scraper.records import to_json
+        from pcgs_scraper.scraper import combine_number_price, \
+            build_query_index, save_query_index, PRICE_GUIDE_FILE, \
+            PRICE_GUIDE_JSON
+        price_guide = combine_number_price(db_path=db_path)
+        print(f'Saving price guide to {PRICE_GUIDE_FILE} and '
+              f'{PRICE_GUIDE_JSON}')
+        pickle.dump(price_guide, open(ensure_parent(PRICE_GUIDE_FILE), 'wb'))
+        save_query_index(build_query_index(price_guide), PRICE_GUIDE_FILE)
+        with open(ensure_parent(PRICE_GUIDE_JSON), 'w') as outfile:
+            json.dump(price_guide, outfile, default=to_json)
+        saved['guide'] = PRICE_GUIDE_FILE
+        if db_path is not None:
+            saved['db'] = db_path
+    return saved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    init_parser = commands.add_parser(
+        'init', help='queue every grade bin and pcgsnolookup page')
+    work_parser = commands.add_parser(
+        'work', help='claim and scrape tasks until the queue is empty')
+    status_parser = commands.add_parser(
+        'status', help='tasks done, leased, pending and failed')
+    finalize_parser = commands.add_parser(
+        'finalize', help='merge the results of all workers into the price '
+                         'guide')
+    for command_parser in (init_parser, work_parser, status_parser,
+                           finalize_parser):
+        command_parser.add_argument('queue_dir',
+                                    help='queue directory, on a volume every '
+                                         'worker mounts')
+    for command_parser in (init_parser, work_parser):
+        command_parser.add_argument('--kinds', nargs='+', choices=KINDS,
+                                    default=list(KINDS),
+                                    help='prices (grade bin pages) and/or '
+                                         'numbers (pcgsnolookup pages)')
+    work_parser.add_argument('--worker', action='store',
+                             help='unique worker id, defaults to host-pid')
+    work_parser.add_argument('--lease', action='store', type=float,
+                             default=LEASE_S,
+                             help='seconds a task is held without a renewal, '
+                                  f'defaults to {LEASE_S}')
+    work_parser.add_argument('--max_attempts', action='store', type=int,
+                             default=MAX_ATTEMPTS,
+                             help='claims of a task before it is given up '
+                                  f'on, defaults to {MAX_ATTEMPTS}')
+    work_parser.add_argument('--max_tasks', action='store', type=int,
+                             help='stop after this many tasks')
+    work_parser.add_argument('--no_wait', action='store_true',
+                             help='stop when no task is open, instead of '
+                                  'waiting for the leases of other workers')
+    work_parser.add_argument('--no_coinfacts', action='store_true',
+                             help='skip coinfacts pages of numbers tasks')
+    work_parser.add_argument('--workers', '-w', action='store', type=int,
+                             default=4,
+                             help='max coinfacts pages fetched at once')
+    work_parser.add_argument('--rate', '-r', action='store', type=float,
+                             help='fixed max requests per second of this '
+                                  'worker, by default the rate adapts')
+    finalize_parser.add_argument('--no_combine', action='store_true',
+                                 help='do not run combine_number_price')
+    finalize_parser.add_argument('--db', action='store', nargs='?',
+                                 const=PRICE_DB_FILE,
+                                 help='also save the price guide to a SQLite '
+                                      f'database, defaults to {PRICE_DB_FILE}')
+    finalize_parser.add_argument('--force', action='store_true',
+                                 help='save the tasks done so far even if '
+                                      'some are not')
+    args = parser.parse_args()
+
+    if args.command == 'init':
+        for task_kind, count in init_queue(args.queue_dir,
+                                           tuple(args.kinds)).items():
+            print(f'Queued {count} new {task_kind} tasks')
+    elif args.command == 'work':
+        if args.rate is not None:
+            from pcgs_scraper.ratelimit import HostRateLimiter, set_limiter
+            set_limiter(HostRateLimiter(args.rate))
+        work(args.queue_dir, args.worker, tuple(args.kinds), args.lease,
+             args.max_attempts, enrich=not args.no_coinfacts,
+             workers=args.workers, max_tasks=args.max_tasks,
+             wait=not args.no_wait)
+    elif args.command == 'status':
+        queue = queue_status(args.queue_dir)
+        for task_kind in KINDS:
+            if task_kind in queue:
+                print(f'{task_kind:<10}' + '  '.join(
+                    f'{name} {count}' for name, count
+                    in queue[task_kind].items()))
+        for worker_id, leases in queue['workers'].items():
+            print(f'  {worker_id} holds {leases}')
+        for failed_url, attempts, error in failed_tasks(args.queue_dir):
+            print(f'  failed after {attempts} attempts: {failed_url} '
+                  f'({error})')
+    elif args.command == 'finalize':
+        try:
+            for task_kind, saved_file in finalize(
+                    args.queue_dir, combine=not args.no_combine,
+                    force=args.force, db_path=args.db).items():
+                print(f'Saved {task_kind} to {saved_file}')
+        except ValueError as e:
+            sys.exit(str(e))
@@ -16,7 +16,10 @@ setuptools.setup(
     python_requires='>=3.7',
     install_requires=[
         'beautifulsoup4',
-        'ft',
         'requests'
-    ]
+    ],
+    extras_require={
+        'lxml': ['lxml'],
+        'numpy': ['numpy'],
+    }
 )
@@ -0,0 +1,73 @@
+"""
+test_parsers.py
+
+The lxml parser backend must return exactly what the bs4 backend (the original
+implementation) returns, for every kind of page of a synthetic pcgs.com
+
+    $ python -m pytest tests
+
+Author: Ryan A. Mannion, 2020
+github: ryanamannion
+twitter: @ryanamannion
+"""
+from urllib.parse import urlsplit
+
+import pytest
+
+pytest.importorskip('bs4')
+pytest.importorskip('lxml')
+
+from pcgs_scraper.parsers import Bs4Backend, LxmlBackend     # noqa: E402
+from pcgs_scraper.synthetic import SyntheticSite, BASE_URL   # noqa: E402
+
+SITE = SyntheticSite(coins=60, largest_table=40, subcat_size=10)
+URLS = SITE.urls()
+BS4 = Bs4Backend()
+LXML = LxmlBackend()
+
+
+def pages(kind):
+    return [(url, SITE.page(url)) for url in URLS[kind]]
+
+
+@pytest.mark.parametrize('url, html', pages('index'))
+def test_category_urls(url, html):
+    expected = BS4.category_urls(html, BASE_URL)
+    assert len(expected) > 0
+    assert LXML.category_urls(html, BASE_URL) == expected
+
+
+@pytest.mark.parametrize('url, html', pages('prices'))
+def test_price_rows(url, html):
+    grades = urlsplit(url).path.rstrip('/').split('/')[-1]
+    expected = BS4.price_rows(html, grades, url)
+    assert len(expected) > 0
+    assert LXML.price_rows(html, grades, url) == expected
+
+
+@pytest.mark.parametrize('url, html', pages('numbers'))
+def test_number_rows(url, html):
+    expected = BS4.number_rows(html)
+    assert len(expected) > 0
+    assert LXML.number_rows(html) == expected
+
+
+@pytest.mark.parametrize('url, html', pages('coinfacts')[:20])
+def test_coinfacts(url, html):
+    expected = BS4.coinfacts(html)
+    assert expected['images'] is not None
+    assert LXML.coinfacts(html) == expected
+
+
+@pytest.mark.parametrize('kind', ['index', 'numbers', 'coinfacts'])
+def test_no_price_table(kind):
+    # pages without a price table, like counterstamped colonials
+    url, html = pages(kind)[0]
+    assert BS4.price_rows(html, 'grades-1-20', url) == []
+    assert LXML.price_rows(html, 'grades-1-20', url) == []
+
+
+@pytest.mark.parametrize('kind', ['index', 'coinfacts'])
+def test_no_number_table(kind):
+    url, html = pages(kind)[0]
+    assert LXML.number_rows(html) == BS4.number_rows(html)